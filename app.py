@@ -1,26 +1,88 @@
 # app.py
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from dotenv import load_dotenv
 import os
+import secrets
 import httpx
 from typing import Dict, Optional, List
 from datetime import datetime, timedelta, timezone
-from models import BirthData, UserData, LoginData, TokenResponse, GeocodeRequest, GeocodeResponse, RefreshTokenRequest, ChartResponse
-from services.chart import generate_chart
-from db import save_chart, get_chart, create_user, get_user_by_email, get_db, create_refresh_token, validate_refresh_token, revoke_refresh_token, get_charts_by_user_id
+from models import BirthData, UserData, LoginData, TokenResponse, GeocodeRequest, GeocodeResponse, RefreshTokenRequest, ChartResponse, ChartBatchRequest
+from services.chart import build_chart, build_charts, generate_dasha_window, parse_include, stored_result, materialize_chart
+from db import save_charts, create_user, get_db, get_charts_by_user_id, engine
+from db_async import get_chart, get_user_by_email, get_async_db, create_refresh_token, validate_refresh_token, revoke_refresh_token, async_engine
+from db_pool import pool_stats
+from db_migrate import migrate, require_schema, DB_MIGRATE_ON_STARTUP
+from db_writer import ChartWriter
 from passlib.context import CryptContext
 import jwt
 from jwt import PyJWTError, DecodeError, ExpiredSignatureError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import redis.asyncio as redis
-from utils import get_timezone_offset
+from services.ephemeris_cache import get_ephemeris_cache
+from services.workers import ChartWorkerPool
+from services.planetary import transit_ticker
+from services.chart_cache import worker_cache_stats, STATS_KEY, WORKERS_KEY
+from services.singleflight import SingleFlight, flight_key
+from services.encoding import chart_response, negotiate
+from services.jobs import get_job_queue, new_job_id, enqueue_upload, run_consumer, job_status
+from starlette.concurrency import run_in_threadpool
 import time
+import asyncio
+import math
 
 load_dotenv()
 app = FastAPI(title="Astrology Chart API", description="Vedic astrology charts with True Chitrapaksha Ayanamsa and timezone support", version="0.1.0")
 
+@app.on_event("startup")
+async def map_ephemeris_cache():
+    # Memory-map the Chebyshev ephemeris once per worker; the pages are shared read-only
+    get_ephemeris_cache()
+
+@app.on_event("startup")
+async def migrate_database():
+    # Columns and indexes create_all cannot add to existing tables; one worker at a time builds them
+    if DB_MIGRATE_ON_STARTUP:
+        await run_in_threadpool(migrate, engine)
+    # Chart saves upsert on ux_charts_user_input; without it (or a column) the worker refuses to start
+    await run_in_threadpool(require_schema, engine)
+
+# CPU-bound chart work runs here, off the event loop thread
+chart_pool = ChartWorkerPool()
+
+@app.on_event("startup")
+async def start_transit_ticker():
+    # Process workers run their own ticker; thread workers share this process's snapshots
+    if chart_pool.mode == "thread":
+        transit_ticker.start()
+
+# Bulk import chunks are consumed by every app instance, one consumer per chart worker
+import_consumers: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_import_consumers():
+    queue = get_job_queue()
+    import_consumers.extend(asyncio.create_task(run_consumer(queue, chart_pool)) for _ in range(chart_pool.workers))
+
+@app.on_event("shutdown")
+async def stop_import_consumers():
+    for consumer in import_consumers:
+        consumer.cancel()
+    await asyncio.gather(*import_consumers, return_exceptions=True)
+
+@app.on_event("shutdown")
+def stop_chart_pool():
+    chart_pool.shutdown()
+
+@app.on_event("shutdown")
+async def close_database_pool():
+    # Queued charts are written before the pool closes
+    await chart_writer.close()
+    await async_engine.dispose()
+
 # Get CORS allowed origins from environment or use a default for development
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:8000").split(",")
 
@@ -45,6 +107,9 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # OAuth2 scheme for token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
+# Operator token for the /*/stats endpoints, sent as X-Stats-Token; unset disables them
+STATS_TOKEN = os.getenv("STATS_TOKEN")
+
 # Get Redis configuration from environment variables
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
@@ -62,6 +127,16 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# Identical concurrent chart requests share one computation, across workers via a Redis lease
+chart_flight = SingleFlight(redis_client)
+
+# New charts are committed per request or queued and written in batches, per CHART_WRITE_MODE
+chart_writer = ChartWriter(redis_client=redis_client)
+
+@app.on_event("startup")
+async def start_chart_writer():
+    chart_writer.start()
+
 # Rate limiting configuration
 RATE_LIMIT_DURATION = int(os.getenv("RATE_LIMIT_DURATION", "60"))  # seconds
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "30"))  # requests per duration
@@ -139,10 +214,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except PyJWTError:
         raise credentials_exception
 
+async def require_stats_token(x_stats_token: Optional[str] = Header(None)):
+    # Pool, queue and cache internals are for operators, not for any logged-in user
+    if not STATS_TOKEN or x_stats_token is None or not secrets.compare_digest(x_stats_token, STATS_TOKEN):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
 @app.post("/users", response_model=Dict)
 async def create_new_user(user: UserData, db: Session = Depends(get_db)):
     try:
-        user_id = create_user(user.name, user.email, user.password, db)
+        # bcrypt hashing and the sync session both block: keep them off the loop thread
+        user_id = await run_in_threadpool(create_user, user.name, user.email, user.password, db)
         return {"user_id": user_id, "name": user.name, "email": user.email}
     except HTTPException as e:
         raise e
@@ -151,9 +232,9 @@ async def create_new_user(user: UserData, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error creating user")
 
 @app.post("/login", response_model=TokenResponse)
-async def login_for_access_token(form_data: LoginData, db: Session = Depends(get_db)):
-    user = get_user_by_email(form_data.email, db)
-    if not user or not pwd_context.verify(form_data.password, user["password_hash"]):
+async def login_for_access_token(form_data: LoginData, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_by_email(form_data.email, db)
+    if not user or not await run_in_threadpool(pwd_context.verify, form_data.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -164,7 +245,7 @@ async def login_for_access_token(form_data: LoginData, db: Session = Depends(get
         data={"sub": str(user["user_id"])}, expires_delta=access_token_expires
     )
     # Create refresh token
-    refresh_token = create_refresh_token(user["user_id"], db)
+    refresh_token = await create_refresh_token(user["user_id"], db)
     
     return {
         "access_token": access_token, 
@@ -174,10 +255,10 @@ async def login_for_access_token(form_data: LoginData, db: Session = Depends(get
     }
 
 @app.post("/refresh", response_model=TokenResponse)
-async def refresh_access_token(data: RefreshTokenRequest, db: Session = Depends(get_db)):
+async def refresh_access_token(data: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         # Validate the refresh token
-        user_id = validate_refresh_token(data.refresh_token, db)
+        user_id = await validate_refresh_token(data.refresh_token, db)
         
         # Create new access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -186,8 +267,8 @@ async def refresh_access_token(data: RefreshTokenRequest, db: Session = Depends(
         )
         
         # Create new refresh token and revoke the old one
-        new_refresh_token = create_refresh_token(user_id, db)
-        revoke_refresh_token(data.refresh_token, db)
+        new_refresh_token = await create_refresh_token(user_id, db)
+        await revoke_refresh_token(data.refresh_token, db)
         
         return {
             "access_token": access_token,
@@ -202,9 +283,9 @@ async def refresh_access_token(data: RefreshTokenRequest, db: Session = Depends(
         raise HTTPException(status_code=500, detail="Error refreshing token")
 
 @app.post("/logout")
-async def logout(data: RefreshTokenRequest, db: Session = Depends(get_db)):
+async def logout(data: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        success = revoke_refresh_token(data.refresh_token, db)
+        success = await revoke_refresh_token(data.refresh_token, db)
         if success:
             return {"detail": "Successfully logged out"}
         return {"detail": "Logout failed"}
@@ -212,8 +293,18 @@ async def logout(data: RefreshTokenRequest, db: Session = Depends(get_db)):
         # Generic error to avoid exposing implementation details
         raise HTTPException(status_code=500, detail="Error during logout")
 
+# Largest page of /users/me/charts
+CHART_PAGE_MAX = 200
+
 @app.get("/users/me/charts", response_model=List[ChartResponse])
-async def get_my_charts(current_user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_my_charts(
+    response: Response,
+    request: Request,
+    limit: int = Query(50, ge=1, le=CHART_PAGE_MAX),
+    cursor: Optional[str] = None,
+    current_user_id: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     if current_user_id is None: # Check if token was provided and valid, resulting in a user_id
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -221,7 +312,11 @@ async def get_my_charts(current_user_id: int = Depends(get_current_user), db: Se
             headers={"WWW-Authenticate": "Bearer"},
         )
     try:
-        charts = get_charts_by_user_id(user_id=current_user_id, db=db)
+        charts, next_cursor = await run_in_threadpool(get_charts_by_user_id, current_user_id, db, limit, cursor)
+        # The body stays a plain list; the next page, if any, is linked as in RFC 8288
+        if next_cursor is not None:
+            next_url = request.url.include_query_params(cursor=next_cursor, limit=limit)
+            response.headers["Link"] = f'<{next_url}>; rel="next"'
         return charts
     except HTTPException as e:
         raise e # Re-raise known HTTP exceptions from the db layer
@@ -229,23 +324,38 @@ async def get_my_charts(current_user_id: int = Depends(get_current_user), db: Se
         # Log error e in a real application
         raise HTTPException(status_code=500, detail="An unexpected error occurred while retrieving charts.")
 
-@app.post("/charts", response_model=Dict)
+@app.post("/charts", response_model=Dict, response_class=ORJSONResponse)
 async def get_charts(
     data: BirthData,
     tz_offset: Optional[float] = None,
     transit_date: Optional[datetime] = None,
-    ayanamsa_type: Optional[str] = None,
+    ayanamsa_type: Optional[List[str]] = Query(None),
     dasha_level: Optional[int] = 3,
+    include: Optional[List[str]] = Query(None),
+    accept: Optional[str] = Header(None),
     current_user: int = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        # If tz_offset is not provided, calculate it from coordinates
-        if tz_offset is None:
-            tz_offset = get_timezone_offset(data.latitude, data.longitude)
-            
-        result = generate_chart(data, tz_offset, transit_date, ayanamsa_type, current_user, dasha_level, db)
-        return result
+        # Several ayanamsas may be compared in one request: repeated or comma-separated values
+        ayanamsa_types = [t.strip() for value in ayanamsa_type or [] for t in value.split(",") if t.strip()]
+        # A missing tz_offset is looked up from the coordinates inside the worker
+        # include=kundali,D-9,dasha:1 limits the computation to those components and their prerequisites
+        # A binary response gets its dasha columnar from the worker, never built as a tree
+        dasha_columns = negotiate(accept) is not None
+        key = flight_key(data.dict(), tz_offset, transit_date, ayanamsa_types, dasha_level, include, dasha_columns)
+        shared = await chart_flight.run(key, lambda: chart_pool.run(
+            build_chart, data, tz_offset, transit_date, ayanamsa_types or None, dasha_level, include, dasha_columns))
+        result = dict(shared)  # coalesced requests each save their own chart
+
+        # A full row stores the dasha tree: expanding the columns is CPU work, kept off the event loop
+        stored = await run_in_threadpool(stored_result, result) if dasha_columns else stored_result(result)
+        result["chart_id"] = await chart_writer.save(result["birth_data"], stored, current_user, db)
+        result["user_id"] = current_user
+        # A Response is sent as is: no response_model validation of the nested dasha and vargas,
+        # and orjson (or MessagePack/CBOR, per Accept) encodes it in one native pass.
+        # response_model only documents the endpoint.
+        return chart_response(result, accept)
     except ValueError as e:
         # Limited error details to avoid information leakage
         raise HTTPException(status_code=400, detail="Chart generation failed: invalid input")
@@ -255,10 +365,105 @@ async def get_charts(
         # Generic error to avoid exposing implementation details
         raise HTTPException(status_code=500, detail="Unexpected error generating chart")
 
-@app.get("/charts/{chart_id}", response_model=Dict)
-async def get_chart_by_id(chart_id: int, current_user: int = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.post("/charts/batch", response_model=Dict, response_class=ORJSONResponse)
+async def get_charts_batch(
+    batch: ChartBatchRequest,
+    transit_date: Optional[datetime] = None,
+    ayanamsa_type: Optional[List[str]] = Query(None),
+    dasha_level: Optional[int] = 3,
+    include: Optional[List[str]] = Query(None),
+    accept: Optional[str] = Header(None),
+    current_user: int = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     try:
-        chart = get_chart(chart_id, db)
+        ayanamsa_types = [t.strip() for value in ayanamsa_type or [] for t in value.split(",") if t.strip()]
+        # One job per worker rather than per item: the queue stays short and results cross processes in bulk
+        size = math.ceil(len(batch.items) / chart_pool.workers)
+        chunks = [batch.items[i:i + size] for i in range(0, len(batch.items), size)]
+        jobs = [chart_pool.run(build_charts, chunk, transit_date, ayanamsa_types or None, dasha_level, include)
+                for chunk in chunks]
+        outcomes = []
+        for chunk, chunk_outcomes in zip(chunks, await asyncio.gather(*jobs, return_exceptions=True)):
+            if isinstance(chunk_outcomes, HTTPException):
+                chunk_outcomes = [{"error": {"status_code": chunk_outcomes.status_code, "detail": chunk_outcomes.detail}}] * len(chunk)
+            elif isinstance(chunk_outcomes, Exception):
+                chunk_outcomes = [{"error": {"status_code": 500, "detail": "Unexpected error generating chart"}}] * len(chunk)
+            outcomes.extend(chunk_outcomes)
+
+        # All successful charts in one multi-row INSERT
+        charts = [outcome["chart"] for outcome in outcomes if "chart" in outcome]
+        chart_ids = await run_in_threadpool(save_charts, [(chart["birth_data"], stored_result(chart)) for chart in charts],
+                                        current_user, db)
+        for chart, chart_id in zip(charts, chart_ids):
+            chart["chart_id"] = chart_id
+            chart["user_id"] = current_user
+
+        results = [{"index": index, **outcome} for index, outcome in enumerate(outcomes)]
+        return chart_response({"results": results, "succeeded": len(charts), "failed": len(results) - len(charts)}, accept)
+    except HTTPException as e:
+        raise e
+    except Exception:
+        # Generic error to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Unexpected error generating charts")
+
+@app.post("/jobs/import", response_model=Dict, status_code=status.HTTP_202_ACCEPTED)
+async def import_charts(
+    request: Request,
+    format: Optional[str] = None,
+    transit_date: Optional[datetime] = None,
+    ayanamsa_type: Optional[List[str]] = Query(None),
+    dasha_level: Optional[int] = 3,
+    include: Optional[List[str]] = Query(None),
+    current_user: int = Depends(get_current_user)
+):
+    # NDJSON by default; CSV when asked for or sent as text/csv
+    fmt = (format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")).lower()
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail=f"Invalid format: {fmt}. Must be 'ndjson' or 'csv'")
+    parse_include(include)  # reject an invalid include= before the upload, not on every row
+    try:
+        ayanamsa_types = [t.strip() for value in ayanamsa_type or [] for t in value.split(",") if t.strip()]
+        options = {"transit_date": transit_date.isoformat() if transit_date else None,
+                   "ayanamsa_type": ayanamsa_types or None, "dasha_level": dasha_level, "include": include}
+        queue = get_job_queue()
+        job_id = new_job_id()
+        await asyncio.to_thread(queue.create_job, job_id, options, current_user)
+        # Chunks are queued, and computed, while the rest of the body is still arriving
+        rows = await enqueue_upload(queue, job_id, request.stream(), fmt)
+        return {"job_id": job_id, "rows": rows, "status_url": f"/jobs/{job_id}"}
+    except redis.RedisError:
+        raise HTTPException(status_code=503, detail="Import queue unavailable. Please try again later.")
+    except HTTPException as e:
+        raise e
+    except Exception:
+        # Generic error to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Unexpected error importing charts")
+
+@app.get("/jobs/{job_id}", response_model=Dict)
+async def get_import_job(job_id: str, current_user: int = Depends(get_current_user)):
+    try:
+        job = await asyncio.to_thread(get_job_queue().get_job, job_id)
+    except redis.RedisError:
+        raise HTTPException(status_code=503, detail="Import queue unavailable. Please try again later.")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Anonymous jobs are reachable by their unguessable id only
+    if job["user_id"] is not None and job["user_id"] != current_user:
+        raise HTTPException(status_code=403, detail="Job doesn't exist")
+    return job_status(job)
+
+@app.get("/charts/{chart_id}", response_model=Dict, response_class=ORJSONResponse)
+async def get_chart_by_id(
+    chart_id: int,
+    include: Optional[List[str]] = Query(None),
+    accept: Optional[str] = Header(None),
+    current_user: int = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        # A chart still queued for writing is served from the queue
+        chart = await get_chart(chart_id, db) or await chart_writer.pending(chart_id)
         if not chart:
             raise HTTPException(status_code=404, detail="Chart not found")
         
@@ -266,12 +471,63 @@ async def get_chart_by_id(chart_id: int, current_user: int = Depends(get_current
 
         if chart_user_id is None or chart["user_id"] != current_user:
             raise HTTPException(status_code=403, detail="Chart doesn't exist")
-        return chart
+
+        if chart["result"].get("storage") == "inputs":
+            # Saved as inputs only: recompute in the pool, natal parts through the chart cache
+            dasha_columns = negotiate(accept) is not None
+            key = flight_key("stored", chart_id, include, dasha_columns)
+            chart["result"] = await chart_flight.run(key, lambda: chart_pool.run(
+                materialize_chart, chart["birth_data"], chart["result"], include, dasha_columns))
+        elif include:
+            # A full row is only filtered, but a level-3 dasha tree is large: keep the walk off the event loop.
+            # The threadpool, not chart_pool: pickling the row to a worker process would cost more than the filter
+            chart["result"] = await run_in_threadpool(materialize_chart, chart["birth_data"], chart["result"], include)
+        return chart_response(chart, accept)
     except HTTPException as e:
         raise e
     except Exception:
         # Generic error to avoid exposing implementation details
         raise HTTPException(status_code=400, detail="Error retrieving chart")
+
+@app.get("/charts/{chart_id}/dasha", response_model=Dict, response_class=ORJSONResponse)
+async def get_chart_dasha_window(
+    chart_id: int,
+    window_start: Optional[datetime] = Query(None, alias="from"),
+    window_end: Optional[datetime] = Query(None, alias="to"),
+    level: int = Query(2, ge=0, le=5),
+    system: str = Query("vimshottari"),
+    accept: Optional[str] = Header(None),
+    current_user: int = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        # A chart still queued for writing is served from the queue
+        chart = await get_chart(chart_id, db) or await chart_writer.pending(chart_id)
+        if not chart:
+            raise HTTPException(status_code=404, detail="Chart not found")
+        if chart["user_id"] is None or chart["user_id"] != current_user:
+            raise HTTPException(status_code=403, detail="Chart doesn't exist")
+
+        # Default window: the year starting now. Aware datetimes are normalized to naive UTC.
+        if window_start is None:
+            window_start = datetime.now(timezone.utc)
+        if window_start.tzinfo is not None:
+            window_start = window_start.astimezone(timezone.utc).replace(tzinfo=None)
+        if window_end is None:
+            window_end = window_start + timedelta(days=365)
+        elif window_end.tzinfo is not None:
+            window_end = window_end.astimezone(timezone.utc).replace(tzinfo=None)
+
+        result = await chart_pool.run(generate_dasha_window, chart["birth_data"], window_start, window_end, level, system)
+        result["chart_id"] = chart_id
+        return chart_response(result, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid dasha window: {str(e)}")
+    except HTTPException as e:
+        raise e
+    except Exception:
+        # Generic error to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Error calculating dasha window")
     
 @app.post("/geocode", response_model=GeocodeResponse)
 async def geocode_location(request: GeocodeRequest):
@@ -321,6 +577,24 @@ async def geocode_location(request: GeocodeRequest):
         # Generic error to avoid exposing implementation details
         raise HTTPException(status_code=500, detail="Geocoding error")
 
+@app.get("/db/stats", dependencies=[Depends(require_stats_token)])
+async def database_pool_stats():
+    # Pool occupancy and connection wait times of this worker, for tuning the DB_POOL_* settings
+    return {"async": pool_stats(async_engine.sync_engine.pool), "sync": pool_stats(engine.pool),
+            "writer": chart_writer.stats()}
+
+@app.get("/cache/stats", dependencies=[Depends(require_stats_token)])
+async def chart_cache_stats():
+    # Totals across workers and each worker's own stats, as last flushed to Redis; takes no chart_pool slot
+    try:
+        totals = {name: int(count) for name, count in (await redis_client.hgetall(STATS_KEY)).items()}
+        workers, stale = worker_cache_stats(await redis_client.hgetall(WORKERS_KEY))
+        if stale:
+            await redis_client.hdel(WORKERS_KEY, *stale)
+    except Exception:
+        totals = workers = None
+    return {"total": totals, "workers": workers}
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
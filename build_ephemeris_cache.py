@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# build_ephemeris_cache.py - Fit the Chebyshev ephemeris and ayanamsa cache that services/planetary.py memory-maps
+"""
+Usage:
+    python build_ephemeris_cache.py
+    python build_ephemeris_cache.py --start 1900-01-01 --end 2100-01-01 --output ephe/chebyshev_cache.npy
+
+The default range is 1800-2200 and the default output is EPHEMERIS_CACHE_PATH
+(./ephe/chebyshev_cache.npy). Instants outside the range keep using Swiss Ephemeris.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from services.ephemeris_cache import (
+    build_cache, ChebyshevEphemeris, body_flags, DEFAULT_CACHE_START, DEFAULT_CACHE_END, EPHEMERIS_CACHE_PATH
+)
+from compatibility import swe, SWE_LOCK
+
+def max_error_arcsec(cache: ChebyshevEphemeris, samples: int = 2000) -> float:
+    """Largest longitude or ayanamsa difference from Swiss Ephemeris over random instants, in arcseconds."""
+    jds = np.random.default_rng(0).uniform(cache.start_jd, cache.end_jd, samples)
+    worst = 0.0
+    for pid in cache.bodies:
+        longitudes, _ = cache.evaluate(pid, jds)
+        exact = np.array([swe.calc_ut(jd, pid, body_flags(pid))[0][0] for jd in jds.tolist()])
+        worst = max(worst, float(np.abs((longitudes - exact + 180) % 360 - 180).max()))
+    for sid_mode in cache.ayanamsas:
+        with SWE_LOCK:
+            swe.set_sid_mode(sid_mode, 0, 0)
+            exact = np.array([swe.get_ayanamsa_ut(jd) for jd in jds.tolist()])
+        worst = max(worst, float(np.abs(cache.ayanamsa(sid_mode, jds) - exact).max()))
+    return worst * 3600
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Precompute Chebyshev coefficients for the chart bodies.")
+    parser.add_argument("--start", default=DEFAULT_CACHE_START.date().isoformat(), help="First covered date (UTC, ISO format).")
+    parser.add_argument("--end", default=DEFAULT_CACHE_END.date().isoformat(), help="End of the covered range (UTC, ISO format, exclusive).")
+    parser.add_argument("--output", default=EPHEMERIS_CACHE_PATH, help="Coefficient file to write.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = build_cache(args.output, datetime.fromisoformat(args.start), datetime.fromisoformat(args.end))
+    elapsed = time.perf_counter() - start
+    cache = ChebyshevEphemeris.load(path)
+    print(f"Wrote {path} ({cache.table.nbytes / 1e6:.1f} MB) in {elapsed:.1f} seconds; "
+          f"max error {max_error_arcsec(cache):.4f} arcsec", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
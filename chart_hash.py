@@ -0,0 +1,58 @@
+# chart_hash.py
+"""
+Canonical digest of chart inputs; standard library only.
+
+input_digest() is the one canonicalization of what a chart is computed from. The chart cache
+keys are built on it: services.chart_cache.cache_key() adds the unit name and
+CHART_ALGORITHM_VERSION. chart_input_hash() is the same digest of a saved chart's inputs, and
+keeps a user's charts unique (see the ux_charts_user_input index). The row hash carries no
+version, since a saved chart stands for the same inputs after an algorithm change. Instead,
+each row records the version it was computed with (charts.algorithm_version), and saving the
+chart again over a row from an older version rewrites its result.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+# Bump whenever a change alters calculated chart output, so stale entries are never served
+CHART_ALGORITHM_VERSION = 2
+
+def input_digest(year: int, month: int, day: int, seconds: float, tz_offset: float, latitude: float,
+                 longitude: float, ayanamsa_type: Optional[str], **options) -> str:
+    """SHA-256 of canonical chart inputs for a UTC birth date and second of day; equal inputs always hash alike."""
+    canonical = {
+        "date": [int(year), int(month), int(day)],
+        "seconds": round(float(seconds), 3),
+        "tz_offset": float(tz_offset),  # echoed in the kundali
+        "latitude": round(float(latitude), 6),
+        "longitude": round(float(longitude), 6),
+        "ayanamsa": ayanamsa_type or "true_chitra",  # case is echoed in the output
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+def chart_input_hash(birth_data: Dict) -> str:
+    """
+    input_digest of a chart's saved birth data: the UTC birth instant (converted the way
+    utils.sanitize_birth_data does it), the time zone offset, the coordinates, the ayanamsas,
+    the dasha level and the requested components. Other keys (a name, say) do not count.
+    Raises ValueError for birth data that cannot be a chart.
+    """
+    try:
+        tz_offset = birth_data.get("tz_offset")
+        tz_offset = round(float(tz_offset if tz_offset is not None else 0.0), 2)
+        if not -12 <= tz_offset <= 14:
+            raise ValueError("Timezone offset must be between -12 and 14 hours")
+        local_dt = datetime(int(birth_data["year"]), int(birth_data["month"]), int(birth_data["day"]),
+                            int(birth_data["hour"]), int(birth_data["minute"]), int(birth_data.get("second") or 0))
+        utc_dt = local_dt - timedelta(hours=tz_offset)
+        ayanamsa_types = [ayanamsa_type or "true_chitra"
+                          for ayanamsa_type in birth_data.get("ayanamsa_types") or [birth_data.get("ayanamsa_type")]]
+        include = birth_data.get("include")
+        return input_digest(utc_dt.year, utc_dt.month, utc_dt.day, (utc_dt.hour * 60 + utc_dt.minute) * 60 + utc_dt.second,
+                            tz_offset, birth_data["latitude"], birth_data["longitude"], ayanamsa_types[0],
+                            ayanamsa_types=ayanamsa_types, dasha_level=birth_data.get("dasha_level"),
+                            include=sorted(include) if include else None)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Incomplete birth data: {str(e)}")
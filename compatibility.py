@@ -3,6 +3,7 @@ Compatibility layer for Swiss Ephemeris.
 This module attempts to use pyswisseph (the proper package) first,
 then falls back to swisseph (placeholder) if needed.
 """
+import threading
 
 try:
     import pyswisseph as swe
@@ -13,5 +14,9 @@ except ImportError:
     # print("Falling back to swisseph placeholder library")
     USING_PYSWISSEPH = False
 
+# swe keeps the sidereal mode in process-global state: hold this lock from
+# set_sid_mode until the dependent call has returned
+SWE_LOCK = threading.Lock()
+
 # Export the swe module for use by other modules
-__all__ = ['swe', 'USING_PYSWISSEPH'] 
\ No newline at end of file
+__all__ = ['swe', 'USING_PYSWISSEPH', 'SWE_LOCK'] 
\ No newline at end of file
@@ -15,6 +15,34 @@ VIMSHOTTARI_DURATIONS = {
     "Rahu": 18, "Jupiter": 16, "Saturn": 19, "Mercury": 17
 }
 
+# Yogini Dasha: eight yoginis (with their ruling planets) over a 36-year cycle
+YOGINI_DASHAS = ["Mangala", "Pingala", "Dhanya", "Bhramari", "Bhadrika", "Ulka", "Siddha", "Sankata"]
+YOGINI_PLANETS = {
+    "Mangala": "Moon", "Pingala": "Sun", "Dhanya": "Jupiter", "Bhramari": "Mars",
+    "Bhadrika": "Mercury", "Ulka": "Saturn", "Siddha": "Venus", "Sankata": "Rahu"
+}
+YOGINI_DURATIONS = {
+    "Mangala": 1, "Pingala": 2, "Dhanya": 3, "Bhramari": 4,
+    "Bhadrika": 5, "Ulka": 6, "Siddha": 7, "Sankata": 8
+}
+
+# Ashtottari Dasha: eight planets over a 108-year cycle
+ASHTOTTARI_PLANETS = ["Sun", "Moon", "Mars", "Mercury", "Saturn", "Jupiter", "Rahu", "Venus"]
+ASHTOTTARI_DURATIONS = {
+    "Sun": 6, "Moon": 15, "Mars": 8, "Mercury": 17,
+    "Saturn": 10, "Jupiter": 19, "Rahu": 12, "Venus": 21
+}
+# Ashtottari lord of each nakshatra (groups of 4/3 starting from Ardra; Abhijit falls inside Saturn's group)
+ASHTOTTARI_NAKSHATRA_LORDS = [
+    "Rahu", "Rahu", "Venus", "Venus", "Venus", "Sun", "Sun", "Sun", "Sun",
+    "Moon", "Moon", "Moon", "Mars", "Mars", "Mars", "Mars", "Mercury", "Mercury",
+    "Mercury", "Saturn", "Saturn", "Saturn", "Jupiter", "Jupiter", "Jupiter", "Rahu", "Rahu"
+]
+
+# Sign lords used by sign-based (Chara) dashas; Scorpio and Aquarius also have the nodes as co-lords
+SIGN_LORDS = ["Mars", "Venus", "Mercury", "Moon", "Sun", "Mercury", "Venus", "Mars", "Jupiter", "Saturn", "Saturn", "Jupiter"]
+SIGN_CO_LORDS = {7: "Ketu", 10: "Rahu"}
+
 NAKSHATRA_SPAN = 13 + 20 / 60  # 13.3333 degrees
 NAKSHATRA_PADA_SPAN = 3 + 20 / 60  # 3.3333 degrees
 DAYS_PER_YEAR = 365.2422  # As specified
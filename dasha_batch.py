@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# dasha_batch.py - Active dasha lords for every stored chart, for the daily notification fan-out
+"""
+Usage:
+    python dasha_batch.py --date 2026-10-15 --level 2 --output current_dasha.csv
+    python dasha_batch.py --input charts.npz --date 2026-10-15
+    python dasha_batch.py --system ashtottari --date 2026-10-15
+
+Without --input, charts are read from the database (DATABASE_URL). An --input .npz
+file must contain the arrays `chart_id`, `moon_longitude` and `birth_jd` (UTC).
+"""
+import argparse
+import csv
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+import numpy as np
+from services.dasha import calculate_current_dasha_batch, DASHA_LEVEL_NAMES, DASHA_SYSTEMS
+from utils import datetime_to_jd
+
+def load_charts_from_db(batch_size: int = 10000) -> Dict[str, np.ndarray]:
+    """Stream chart ids, UTC birth instants and natal Moon longitudes out of the charts table."""
+    from sqlalchemy import func
+    from db import SessionLocal
+    from db_models import Chart
+
+    chart_ids, user_ids, moon_longitudes, birth_jds = [], [], [], []
+    db = SessionLocal()
+    try:
+        # Full results hold the kundali; rows saved in "inputs" storage mode only their positions
+        moon = func.coalesce(Chart.result["kundali"]["planets"]["Moon"]["longitude"].as_float(),
+                             Chart.result["positions"]["Moon"].as_float())
+        query = db.query(Chart.chart_id, Chart.user_id, Chart.birth_data, moon).yield_per(batch_size)
+        for chart_id, user_id, birth_data, moon_longitude in query:
+            if moon_longitude is None:
+                continue
+            local = datetime(birth_data["year"], birth_data["month"], birth_data["day"],
+                             int(birth_data["hour"]), int(birth_data["minute"]), int(birth_data.get("second", 0)))
+            utc = local - timedelta(hours=birth_data.get("tz_offset", 0.0))
+            chart_ids.append(chart_id)
+            user_ids.append(user_id if user_id is not None else -1)
+            moon_longitudes.append(moon_longitude)
+            birth_jds.append(datetime_to_jd(utc))
+    finally:
+        db.close()
+
+    return {
+        "chart_id": np.array(chart_ids, dtype=np.int64),
+        "user_id": np.array(user_ids, dtype=np.int64),
+        "moon_longitude": np.array(moon_longitudes, dtype=np.float64),
+        "birth_jd": np.array(birth_jds, dtype=np.float64)
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compute the active dasha lords for many charts at once.")
+    parser.add_argument("--date", default=None, help="Evaluation date/time in ISO format (UTC). Defaults to now.")
+    parser.add_argument("--level", type=int, default=2, help="Deepest level to resolve (0-5). Defaults to 2 (Pratyantar).")
+    parser.add_argument("--system", default="vimshottari", choices=["vimshottari", "yogini", "ashtottari"],
+                        help="Nakshatra-based dasha system. Defaults to vimshottari.")
+    parser.add_argument("--input", default=None, help=".npz file with chart_id, moon_longitude and birth_jd arrays.")
+    parser.add_argument("--output", default=None, help="CSV file to write. Defaults to stdout.")
+    args = parser.parse_args()
+
+    eval_date = datetime.fromisoformat(args.date) if args.date else datetime.utcnow()
+    charts = dict(np.load(args.input)) if args.input else load_charts_from_db()
+
+    start = time.perf_counter()
+    lords = calculate_current_dasha_batch(charts["moon_longitude"], charts["birth_jd"],
+                                          datetime_to_jd(eval_date), args.level, args.system)
+    elapsed = time.perf_counter() - start
+    print(f"Resolved {len(lords)} charts to level {args.level} in {elapsed:.3f} seconds", file=sys.stderr)
+
+    lord_names = DASHA_SYSTEMS[args.system].lord_names
+    names = lord_names + [""] * (256 - len(lord_names))  # 255 = outside the cycle
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        has_users = "user_id" in charts
+        writer.writerow(["chart_id"] + (["user_id"] if has_users else []) + DASHA_LEVEL_NAMES[:args.level + 1])
+        for i, row in enumerate(lords.tolist()):
+            user = [charts["user_id"][i]] if has_users else []
+            writer.writerow([charts["chart_id"][i]] + user + [names[lord] for lord in row])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,21 @@
 # db.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker, Session
-from db_models import Base, Chart, User, RefreshToken
+from db_models import Base, Chart, ChartAlias, User, RefreshToken
 from sqlalchemy.exc import IntegrityError, OperationalError
 from fastapi import HTTPException, Depends
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 import os
+import base64
+import json
 import secrets
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from models import ChartResponse
+from db_pool import TimedQueuePool, pool_settings
+from chart_hash import chart_input_hash, CHART_ALGORITHM_VERSION
 
 load_dotenv()
 
@@ -24,8 +29,8 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(engine)  # Create tables if they don't exist
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **pool_settings())
+Base.metadata.create_all(engine)  # Create tables if they don't exist; db_migrate.py updates existing ones
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Dependency to provide a session
@@ -74,13 +79,58 @@ def get_user_by_email(email: str, db: Session = Depends(get_db)) -> int:
 def save_chart(birth_data: dict, result: dict, user_id: int = None, db: Session = Depends(get_db)) -> int:
     """
     Save a chart to the database and return its chart_id.
+    A chart the user already saved (same input_hash) is not saved again; its chart_id is returned.
     """
+    return save_charts([(birth_data, result)], user_id, db)[0]
+
+def _saved_chart_ids(user_id: int, input_hashes: List[str], db: Session) -> Dict[str, int]:
+    # One lookup on the (user_id, input_hash) unique index; rows of an older algorithm version are not current
+    rows = db.query(Chart.input_hash, Chart.chart_id).filter(Chart.user_id == user_id, Chart.input_hash.in_(input_hashes),
+                                                             Chart.algorithm_version == CHART_ALGORITHM_VERSION)
+    return dict(rows.all())
+
+def chart_upsert():
+    """
+    INSERT into charts that keeps one chart per user and input_hash: a chart the user saved
+    with an older algorithm version is rewritten in place, keeping its chart_id, and a current
+    one is left alone (and not returned).
+    """
+    statement = pg_insert(Chart)
+    return statement.on_conflict_do_update(
+        index_elements=["user_id", "input_hash"],
+        set_={"birth_data": statement.excluded.birth_data, "result": statement.excluded.result,
+              "algorithm_version": statement.excluded.algorithm_version},
+        where=Chart.algorithm_version.is_distinct_from(statement.excluded.algorithm_version))
+
+def save_charts(charts: List[Tuple[dict, dict]], user_id: int = None, db: Session = Depends(get_db)) -> List[int]:
+    """
+    Save several (birth_data, result) charts with one multi-row INSERT and one commit.
+    Returns their chart_ids in the same order. Charts the user already saved (same input_hash)
+    keep their chart_id and are not inserted again, though one saved by an older algorithm
+    version is rewritten with the new result; charts without a user are always inserted.
+    """
+    if not charts:
+        return []
     try:
-        chart = Chart(birth_data=birth_data, result=result, user_id=user_id)
-        db.add(chart)
+        input_hashes = [chart_input_hash(birth_data) for birth_data, _ in charts]
+        rows = [{"birth_data": birth_data, "result": result, "user_id": user_id, "input_hash": input_hash,
+                 "algorithm_version": CHART_ALGORITHM_VERSION}
+                for (birth_data, result), input_hash in zip(charts, input_hashes)]
+        if user_id is None:
+            statement = insert(Chart).returning(Chart.chart_id, sort_by_parameter_order=True)
+            chart_ids = list(db.scalars(statement, rows))
+            db.commit()
+            return chart_ids
+        saved = _saved_chart_ids(user_id, list(set(input_hashes)), db)
+        new_rows = list({row["input_hash"]: row for row in rows if row["input_hash"] not in saved}.values())
+        if new_rows:
+            # Rows a concurrent request inserted first are skipped, then looked up
+            saved.update(db.execute(chart_upsert().returning(Chart.input_hash, Chart.chart_id), new_rows).all())
+            raced = [row["input_hash"] for row in new_rows if row["input_hash"] not in saved]
+            if raced:
+                saved.update(_saved_chart_ids(user_id, raced, db))
         db.commit()
-        chart_id = chart.chart_id
-        return chart_id
+        return [saved[input_hash] for input_hash in input_hashes]
     except OperationalError as e:
         db.rollback()
         raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
@@ -90,10 +140,13 @@ def save_chart(birth_data: dict, result: dict, user_id: int = None, db: Session
 
 def get_chart(chart_id: int, db: Session = Depends(get_db)) -> dict:
     """
-    Retrieve a chart by its chart_id.
+    Retrieve a chart by its chart_id, or by an alias of it (see db_writer.py).
     """
     try:
         chart = db.query(Chart).filter(Chart.chart_id == chart_id).first()
+        if chart is None:
+            alias = db.query(ChartAlias.target_id).filter(ChartAlias.chart_id == chart_id).scalar()
+            chart = db.query(Chart).filter(Chart.chart_id == alias).first() if alias is not None else None
         if chart:
             return {
                 "chart_id": chart.chart_id,
@@ -106,20 +159,43 @@ def get_chart(chart_id: int, db: Session = Depends(get_db)) -> dict:
     except OperationalError as e:
         raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
 
-def get_charts_by_user_id(user_id: int, db: Session) -> List[ChartResponse]:
+def encode_chart_cursor(created_at: datetime, chart_id: int) -> str:
+    """Opaque cursor pointing just past a chart in the newest-first order."""
+    position = json.dumps([created_at.isoformat(), chart_id]).encode()
+    return base64.urlsafe_b64encode(position).decode().rstrip("=")
+
+def decode_chart_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, chart_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(chart_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def get_charts_by_user_id(user_id: int, db: Session, limit: int = 50,
+                          cursor: Optional[str] = None) -> Tuple[List[ChartResponse], Optional[str]]:
     """
-    Retrieve all charts for a given user_id, ordered by creation date.
+    Retrieve one page of a user's charts, newest first, and the cursor of the next page (None on the last).
+
+    Keyset pagination on (created_at, chart_id), served by ix_charts_user_created, so every page
+    costs the same however deep it is. Only the summary columns are read, never `result`.
     """
     try:
-        charts_db = db.query(Chart).filter(Chart.user_id == user_id).order_by(Chart.created_at.desc()).all()
-        return [
+        query = db.query(Chart.chart_id, Chart.user_id, Chart.birth_data, Chart.created_at).filter(Chart.user_id == user_id)
+        if cursor is not None:
+            query = query.filter(tuple_(Chart.created_at, Chart.chart_id) < decode_chart_cursor(cursor))
+        rows = query.order_by(Chart.created_at.desc(), Chart.chart_id.desc()).limit(limit + 1).all()
+        charts = [
             ChartResponse(
                 chart_id=chart.chart_id,
                 user_id=chart.user_id,
                 birth_data=chart.birth_data,
                 created_at=chart.created_at
-            ) for chart in charts_db
+            ) for chart in rows[:limit]
         ]
+        next_cursor = encode_chart_cursor(rows[limit - 1].created_at, rows[limit - 1].chart_id) if len(rows) > limit else None
+        return charts, next_cursor
+    except HTTPException:
+        raise
     except OperationalError as e:
         db.rollback()
         raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
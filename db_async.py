@@ -0,0 +1,167 @@
+# db_async.py
+"""
+Async database access for the FastAPI endpoints.
+
+An asyncpg engine with the pool settings of db_pool.py, and async versions of the chart,
+user and refresh-token functions of db.py, so queries no longer block the event loop.
+Scripts and worker threads keep using the synchronous db.py, which also creates the tables.
+"""
+from datetime import datetime, timedelta, timezone
+import secrets
+from fastapi import HTTPException, Depends
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from db import DATABASE_URL, chart_upsert
+from db_models import Chart, ChartAlias, User, RefreshToken
+from db_pool import TimedAsyncQueuePool, pool_settings, DB_STATEMENT_CACHE_SIZE
+from chart_hash import chart_input_hash, CHART_ALGORITHM_VERSION
+
+# postgresql://... (normalized by db.py) with the asyncpg driver
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1).replace(
+    "postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=TimedAsyncQueuePool,
+    # SQLAlchemy's and asyncpg's own prepared statement caches
+    connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                  "statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    **pool_settings()
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# asyncpg raises connection failures as OSError, not wrapped in OperationalError
+DATABASE_UNAVAILABLE = (OperationalError, PoolTimeoutError, OSError)
+
+# Dependency to provide an async session
+async def get_async_db() -> AsyncSession:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def _utcnow() -> datetime:
+    # The DateTime columns are naive UTC; asyncpg refuses aware values for them
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+async def saved_chart_id(user_id: int, input_hash: str, db: AsyncSession) -> int:
+    """
+    The chart_id of the chart a user saved with these inputs, or None: one unique-index lookup.
+    A chart saved by an older algorithm version does not count; saving it again rewrites it.
+    """
+    try:
+        return await db.scalar(select(Chart.chart_id).where(Chart.user_id == user_id, Chart.input_hash == input_hash,
+                                                            Chart.algorithm_version == CHART_ALGORITHM_VERSION))
+    except DATABASE_UNAVAILABLE as e:
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+
+async def save_chart(birth_data: dict, result: dict, user_id: int = None, db: AsyncSession = Depends(get_async_db)) -> int:
+    """
+    Save a chart to the database and return its chart_id.
+    A chart the user already saved (same input_hash) is not saved again; its chart_id is returned,
+    and if an older algorithm version computed it, it takes the new result.
+    """
+    try:
+        input_hash = chart_input_hash(birth_data)
+        if user_id is not None:
+            chart_id = await saved_chart_id(user_id, input_hash, db)
+            if chart_id is not None:
+                return chart_id
+        row = {"birth_data": birth_data, "result": result, "user_id": user_id, "input_hash": input_hash,
+               "algorithm_version": CHART_ALGORITHM_VERSION, "created_at": _utcnow()}
+        # A concurrent request saving the same chart first makes this insert a no-op
+        chart_id = await db.scalar(chart_upsert().values(row).returning(Chart.chart_id))
+        await db.commit()
+        if chart_id is None:
+            chart_id = await saved_chart_id(user_id, input_hash, db)
+        return chart_id
+    except DATABASE_UNAVAILABLE as e:
+        await db.rollback()
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid chart data: {str(e)}")
+
+async def get_chart(chart_id: int, db: AsyncSession = Depends(get_async_db)) -> dict:
+    """
+    Retrieve a chart by its chart_id, or by an alias of it (see db_writer.py).
+    """
+    try:
+        chart = await db.get(Chart, chart_id)
+        if chart is None:
+            alias = await db.scalar(select(ChartAlias.target_id).where(ChartAlias.chart_id == chart_id))
+            chart = await db.get(Chart, alias) if alias is not None else None
+        if chart:
+            return {
+                "chart_id": chart.chart_id,
+                "user_id": chart.user_id,
+                "birth_data": chart.birth_data,
+                "result": chart.result,
+                "created_at": chart.created_at.isoformat()
+            }
+        return None
+    except DATABASE_UNAVAILABLE as e:
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+
+async def get_user_by_email(email: str, db: AsyncSession = Depends(get_async_db)) -> dict:
+    """
+    Retrieve a user by email.
+    """
+    try:
+        user = await db.scalar(select(User).where(User.email == email))
+        if user:
+            return {
+                "user_id": user.user_id,
+                "name": user.name,
+                "email": user.email,
+                "password_hash": user.password_hash
+            }
+        return None
+    except DATABASE_UNAVAILABLE as e:
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+
+async def create_refresh_token(user_id: int, db: AsyncSession, expires_delta: timedelta = timedelta(days=30)) -> str:
+    """
+    Create a new refresh token for a user and store it in the database.
+    """
+    try:
+        token = secrets.token_hex(32)
+        now = _utcnow()
+        db.add(RefreshToken(user_id=user_id, token=token, expires_at=now + expires_delta, created_at=now))
+        await db.commit()
+        return token
+    except Exception:
+        await db.rollback()
+        # Use generic error message to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Error creating refresh token")
+
+async def validate_refresh_token(token: str, db: AsyncSession) -> int:
+    """
+    Validate a refresh token and return the associated user_id if valid.
+    """
+    try:
+        user_id = await db.scalar(select(RefreshToken.user_id).where(
+            RefreshToken.token == token,
+            RefreshToken.is_revoked == False,
+            RefreshToken.expires_at > _utcnow()
+        ))
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+        return user_id
+    except HTTPException:
+        raise
+    except Exception:
+        # Use generic error message to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Error validating refresh token")
+
+async def revoke_refresh_token(token: str, db: AsyncSession) -> bool:
+    """
+    Revoke a refresh token (mark it as invalid).
+    """
+    try:
+        result = await db.execute(update(RefreshToken).where(RefreshToken.token == token).values(is_revoked=True))
+        await db.commit()
+        return result.rowcount > 0
+    except Exception:
+        await db.rollback()
+        # Use generic error message to avoid exposing implementation details
+        raise HTTPException(status_code=500, detail="Error revoking refresh token")
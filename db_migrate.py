@@ -0,0 +1,76 @@
+# db_migrate.py
+"""
+Schema changes that create_all cannot make on an existing database.
+
+create_all (run when db.py is imported) creates missing tables together with their indexes,
+but adds neither columns nor indexes to tables that already exist. migrate() adds those:
+indexes are built CONCURRENTLY, so a large charts table keeps taking writes, and every step
+is IF NOT EXISTS, so it is a no-op once done. A Postgres advisory lock lets one process at a
+time run it; workers starting together wait for the first instead of racing it.
+
+Run it once per deploy with `python db_migrate.py`, or let each app worker run it on startup
+(DB_MIGRATE_ON_STARTUP, default: true). Either way a worker checks the result before serving
+(require_schema): chart saves rely on ux_charts_user_input for ON CONFLICT.
+"""
+import os
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+# Arbitrary application-wide key of the migration advisory lock
+MIGRATION_LOCK_ID = 727_100_025
+
+# (name, statement)
+COLUMNS = [
+    ("input_hash", "ALTER TABLE charts ADD COLUMN IF NOT EXISTS input_hash VARCHAR(64)"),
+    ("algorithm_version", "ALTER TABLE charts ADD COLUMN IF NOT EXISTS algorithm_version INTEGER"),
+]
+# (name, statement); CREATE INDEX CONCURRENTLY cannot run inside a transaction
+INDEXES = [
+    ("ix_charts_user_created",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_charts_user_created ON charts (user_id, created_at DESC, chart_id DESC)"),
+    ("ux_charts_user_input",
+     "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_charts_user_input ON charts (user_id, input_hash)"),
+]
+
+def migrate(engine: Engine):
+    """Add the columns and indexes the models define to an existing database."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            for _, statement in COLUMNS:
+                connection.execute(text(statement))
+            for name, statement in INDEXES:
+                # A failed concurrent build leaves an invalid index that IF NOT EXISTS would keep
+                valid = connection.scalar(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                          {"name": name})
+                if valid is False:
+                    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                connection.execute(text(statement))
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+def missing_schema(engine: Engine) -> List[str]:
+    """The columns and indexes migrate() adds that the database lacks, or has left invalid."""
+    with engine.connect() as connection:
+        columns = set(connection.scalars(text("SELECT column_name FROM information_schema.columns "
+                                              "WHERE table_schema = current_schema() AND table_name = 'charts'")))
+        missing = [name for name, _ in COLUMNS if name not in columns]
+        for name, _ in INDEXES:
+            if not connection.scalar(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                     {"name": name}):
+                missing.append(name)
+    return missing
+
+def require_schema(engine: Engine):
+    """Raise RuntimeError unless migrate() has run to completion on this database."""
+    missing = missing_schema(engine)
+    if missing:
+        raise RuntimeError(f"Database schema is out of date (missing {', '.join(missing)}): run `python db_migrate.py`")
+
+if __name__ == "__main__":
+    from db import engine
+    migrate(engine)
+    print("Database schema is up to date")
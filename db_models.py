@@ -1,5 +1,5 @@
 # db_models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timezone
@@ -20,7 +20,24 @@ class Chart(Base):
     user_id = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
     birth_data = Column(JSONB, nullable=False)
     result = Column(JSONB, nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # chart_hash.chart_input_hash of birth_data; NULL on rows saved before it existed
+    input_hash = Column(String(64), nullable=True)
+    # chart_hash.CHART_ALGORITHM_VERSION the result was computed with; NULL on rows saved before it existed
+    algorithm_version = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Keyset pages of a user's charts, newest first (see get_charts_by_user_id)
+        Index("ix_charts_user_created", "user_id", created_at.desc(), chart_id.desc()),
+        # One chart per user and inputs; charts without a user are never deduplicated
+        Index("ux_charts_user_input", "user_id", "input_hash", unique=True),
+    )
+
+class ChartAlias(Base):
+    # A chart_id the write-behind writer handed out for a chart its user had already saved
+    __tablename__ = "chart_aliases"
+    chart_id = Column(Integer, primary_key=True)
+    target_id = Column(Integer, ForeignKey("charts.chart_id", ondelete="CASCADE"), nullable=False)
 
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
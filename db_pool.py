@@ -0,0 +1,112 @@
+# db_pool.py
+"""
+Connection pool settings shared by the sync and async engines, and pool wait-time metrics.
+
+Configuration (environment):
+    DB_POOL_SIZE             connections kept open per engine (default: 5)
+    DB_MAX_OVERFLOW          extra connections opened under load (default: 10)
+    DB_POOL_TIMEOUT          seconds to wait for a connection before failing (default: 30)
+    DB_POOL_RECYCLE          seconds after which a connection is replaced (default: 1800)
+    DB_STATEMENT_CACHE_SIZE  prepared statements cached per asyncpg connection (default: 100;
+                             set 0 behind PgBouncer in transaction mode)
+"""
+import contextvars
+import os
+import threading
+import time
+from typing import Dict
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def pool_settings() -> Dict:
+    """Engine keyword arguments for the configured pool, with pre-ping."""
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,  # replace connections the server or a proxy has closed
+    }
+
+class PoolMetrics:
+    """Checkouts of one pool and how long each waited for a connection."""
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.buckets[next((i for i, bound in enumerate(WAIT_BUCKETS) if wait <= bound), len(WAIT_BUCKETS))] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            labels = [f"<={bound * 1000:g}ms" for bound in WAIT_BUCKETS] + [f">{WAIT_BUCKETS[-1] * 1000:g}ms"]
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "mean_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "wait_histogram": dict(zip(labels, self.buckets)),
+            }
+
+# Set while a checkout is being timed; QueuePool._do_get retries by calling itself
+_timing = contextvars.ContextVar("_timing", default=False)
+
+class _TimedPoolMixin:
+    """Times every connection checkout, including opening a new connection when the pool grows."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        if _timing.get():
+            return super()._do_get()
+        token = _timing.set(True)
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        finally:
+            _timing.reset(token)
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self) -> Pool:
+        # Engine.dispose() swaps in a new pool; carry the counters over
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def pool_stats(pool: Pool) -> Dict:
+    """Current occupancy of a pool plus its wait-time metrics."""
+    stats = {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+    if isinstance(pool, _TimedPoolMixin):
+        stats.update(pool.metrics.snapshot())
+    return stats
@@ -0,0 +1,343 @@
+# db_writer.py
+"""
+Write-behind persistence of the charts created by POST /charts.
+
+CHART_WRITE_MODE picks the durability a deployment needs:
+    sync    each chart is committed before the response is sent (default)
+    redis   a chart is acknowledged once it is queued in Redis, so it survives an app crash
+            (and a Redis restart, with AOF persistence). Whichever worker holds a short
+            lease flushes the shared queue.
+    memory  charts are queued in the worker's memory; a crash loses up to CHART_WRITE_INTERVAL
+            seconds of charts. Reads only find a worker's own unwritten charts.
+
+Queued charts get their chart_id up front, from blocks of CHART_ID_BLOCK values of the charts
+sequence. A background task flushes them in multi-row INSERTs of up to CHART_WRITE_BATCH rows,
+as soon as a batch is full or CHART_WRITE_INTERVAL seconds have passed. Rows whose chart_id
+already exists are skipped, so a batch retried after a crash is written once. Until a chart
+is written, pending() returns it. close() drains the queue on shutdown.
+
+Like save_chart, the writer keeps one chart per user and input hash: a chart the user already
+saved or queued is answered with its chart_id and not queued again. A queued chart can still
+turn out to be a duplicate when it is written (another worker, a synchronous save or a batch
+import saved the same inputs first). Its chart_id was already handed out, so it is written as
+a chart_aliases row pointing at the saved chart, which get_chart follows; if an older
+algorithm version computed the saved chart, it also takes the queued result. With more than
+CHART_WRITE_MAX_PENDING charts waiting in memory (the database is down or slow), new charts
+are committed synchronously instead.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from redis.exceptions import RedisError
+from chart_hash import chart_input_hash, CHART_ALGORITHM_VERSION
+
+logger = logging.getLogger(__name__)
+
+CHART_WRITE_MODE = os.getenv("CHART_WRITE_MODE", "sync").lower()
+CHART_WRITE_BATCH = int(os.getenv("CHART_WRITE_BATCH", "500"))
+CHART_WRITE_INTERVAL = float(os.getenv("CHART_WRITE_INTERVAL", "0.5"))
+CHART_WRITE_MAX_PENDING = int(os.getenv("CHART_WRITE_MAX_PENDING", "20000"))
+CHART_ID_BLOCK = int(os.getenv("CHART_ID_BLOCK", "100"))
+
+QUEUE_KEY = "chart:write-behind"
+ROW_PREFIX = "chart:write-behind:row:"
+HASH_PREFIX = "chart:write-behind:hash:"
+HASH_GRACE_SECONDS = 60  # queued-hash markers outlive their flush, covering lookups that raced it
+LEASE_KEY = "chart:write-behind:lease"
+LEASE_MS = 10000
+
+# Trim a flushed batch only if it is still at the head, i.e. no other flusher trimmed it
+_TRIM_SCRIPT = """
+if redis.call("lindex", KEYS[1], 0) == ARGV[1] then
+    redis.call("ltrim", KEYS[1], tonumber(ARGV[2]), -1)
+    return 1
+end
+return 0
+"""
+# Queue a row unless its user already queued the same inputs; returns {existing chart_id or 0, queue length}
+_QUEUE_SCRIPT = """
+if ARGV[3] == "1" then
+    local existing = redis.call("get", KEYS[3])
+    if existing then
+        return {tonumber(existing), 0}
+    end
+    redis.call("set", KEYS[3], ARGV[2])
+end
+redis.call("set", KEYS[2], ARGV[1])
+return {0, redis.call("rpush", KEYS[1], ARGV[1])}
+"""
+# Take or keep the flush lease
+_LEASE_SCRIPT = """
+local holder = redis.call("get", KEYS[1])
+if holder == false or holder == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[1], "PX", tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+async def _allocate_ids(count: int) -> List[int]:
+    from fastapi import HTTPException
+    from sqlalchemy import text
+    from db_async import AsyncSessionLocal, DATABASE_UNAVAILABLE  # imported lazily: tests run without a database
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = await db.execute(text("SELECT nextval(pg_get_serial_sequence('charts', 'chart_id')) "
+                                         "FROM generate_series(1, :count)"), {"count": count})
+            return [row[0] for row in rows]
+    except DATABASE_UNAVAILABLE as e:
+        raise HTTPException(status_code=503, detail=f"Database unavailable: {str(e)}")
+
+async def _saved_chart_id(user_id: int, input_hash: str, db) -> Optional[int]:
+    from db_async import saved_chart_id
+    return await saved_chart_id(user_id, input_hash, db)
+
+def split_duplicates(rows: List[Dict], saved: Dict[Tuple[int, str], int]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Split queued rows into the charts to insert and the chart_aliases rows of duplicates.
+
+    `saved` maps (user_id, input_hash) to the chart_id already saved for it. A row whose chart_id
+    is the saved one is kept, so a retried batch is skipped on chart_id when inserted. The first
+    of several queued duplicates wins.
+    """
+    winners = dict(saved)
+    charts, aliases = [], []
+    for row in rows:
+        if row["user_id"] is None:
+            charts.append(row)
+            continue
+        winner = winners.setdefault((row["user_id"], row["input_hash"]), row["chart_id"])
+        if winner == row["chart_id"]:
+            charts.append(row)
+        else:
+            aliases.append({"chart_id": row["chart_id"], "target_id": winner})
+    return charts, aliases
+
+async def _insert_rows(rows: List[Dict]):
+    from sqlalchemy import select, tuple_, update
+    from sqlalchemy.dialects.postgresql import insert
+    from db_async import AsyncSessionLocal
+    from db_models import Chart, ChartAlias
+    pairs = {(row["user_id"], row["input_hash"]) for row in rows if row["user_id"] is not None}
+    async with AsyncSessionLocal() as db:
+        saved, stale = {}, {}
+        if pairs:
+            found = await db.execute(select(Chart.user_id, Chart.input_hash, Chart.chart_id, Chart.algorithm_version)
+                                     .where(tuple_(Chart.user_id, Chart.input_hash).in_(pairs)))
+            for user_id, input_hash, chart_id, version in found:
+                saved[(user_id, input_hash)] = chart_id
+                if version != CHART_ALGORITHM_VERSION:
+                    stale[(user_id, input_hash)] = chart_id
+        charts, aliases = split_duplicates(rows, saved)
+        if stale:
+            # Saved by an older algorithm version: the row keeps its chart_id and takes the queued result
+            latest = {(row["user_id"], row["input_hash"]): row for row in rows
+                      if (row["user_id"], row["input_hash"]) in stale}
+            await db.execute(update(Chart), [
+                {"chart_id": stale[pair], "birth_data": row["birth_data"], "result": row["result"],
+                 "algorithm_version": row["algorithm_version"]} for pair, row in latest.items()])
+        # A duplicate saved between the lookup and the insert fails the batch on ux_charts_user_input;
+        # the retry finds it and writes an alias
+        if charts:
+            await db.execute(insert(Chart).values(charts).on_conflict_do_nothing(index_elements=["chart_id"]))
+        if aliases:
+            await db.execute(insert(ChartAlias).values(aliases).on_conflict_do_nothing(index_elements=["chart_id"]))
+        await db.commit()
+
+def _encode_row(row: Dict) -> str:
+    return json.dumps({**row, "created_at": row["created_at"].isoformat()})
+
+def _decode_row(raw: str) -> Dict:
+    row = json.loads(raw)
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    row.setdefault("algorithm_version", None)  # queued before rows carried it
+    return row
+
+def _hash_key(row: Dict) -> str:
+    return f"{HASH_PREFIX}{row['user_id']}:{row['input_hash']}"
+
+class ChartWriter:
+    """Saves charts synchronously or through a write-behind queue, depending on the mode."""
+    def __init__(self, mode: str = CHART_WRITE_MODE, redis_client=None, batch_size: int = CHART_WRITE_BATCH,
+                 interval: float = CHART_WRITE_INTERVAL, max_pending: int = CHART_WRITE_MAX_PENDING,
+                 id_block: int = CHART_ID_BLOCK,
+                 allocate_ids: Callable[[int], Awaitable[List[int]]] = _allocate_ids,
+                 saved_chart_id: Callable[[int, str, Any], Awaitable[Optional[int]]] = _saved_chart_id,
+                 insert_rows: Callable[[List[Dict]], Awaitable[None]] = _insert_rows):
+        if mode not in ("sync", "redis", "memory"):
+            raise ValueError(f"Invalid CHART_WRITE_MODE: {mode}. Must be 'sync', 'redis' or 'memory'")
+        if mode == "redis" and redis_client is None:
+            raise ValueError("CHART_WRITE_MODE=redis needs a Redis client")
+        self.mode = mode
+        self.redis = redis_client
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.id_block = id_block
+        self.allocate_ids = allocate_ids
+        self.saved_chart_id = saved_chart_id
+        self.insert_rows = insert_rows
+        self.written = 0
+        self.batches = 0
+        self._ids: List[int] = []
+        self._id_lock = asyncio.Lock()
+        self._pending: Dict[int, Dict] = {}  # memory mode, in arrival order
+        self._queued: Dict[Tuple[int, str], int] = {}  # memory mode, (user_id, input_hash) -> chart_id
+        self._token = secrets.token_hex(8)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        """Start the background flusher (from the running event loop)."""
+        if self.mode != "sync" and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _take_id(self) -> int:
+        # Callers hold _id_lock
+        if not self._ids:
+            self._ids = list(reversed(await self.allocate_ids(self.id_block)))
+        return self._ids.pop()
+
+    async def save(self, birth_data: dict, result: dict, user_id: Optional[int], db) -> int:
+        """Persist a chart, or queue it, and return its chart_id. `db` is used in sync mode."""
+        if self.mode == "sync":
+            return await self._save_now(birth_data, result, user_id, db)
+        input_hash = chart_input_hash(birth_data)
+        key = (user_id, input_hash)
+        if user_id is not None and key in self._queued:
+            return self._queued[key]
+        if self.mode == "memory" and len(self._pending) >= self.max_pending:
+            return await self._save_now(birth_data, result, user_id, db)
+        if user_id is not None:
+            chart_id = await self.saved_chart_id(user_id, input_hash, db)
+            if chart_id is not None:
+                return chart_id
+        row = {"user_id": user_id, "birth_data": birth_data, "result": result, "input_hash": input_hash,
+               "algorithm_version": CHART_ALGORITHM_VERSION,
+               "created_at": datetime.now(timezone.utc).replace(tzinfo=None)}  # naive UTC, like the column
+        if self.mode == "redis":
+            async with self._id_lock:
+                row["chart_id"] = await self._take_id()
+            encoded = _encode_row(row)
+            try:
+                existing, queued = await self.redis.eval(
+                    _QUEUE_SCRIPT, 3, QUEUE_KEY, ROW_PREFIX + str(row["chart_id"]), _hash_key(row),
+                    encoded, row["chart_id"], "1" if user_id is not None else "0")
+            except RedisError:
+                return await self._save_now(birth_data, result, user_id, db)  # still durable, just slower
+            if existing:
+                # Queued by another worker meanwhile: the unused id goes back to the block
+                async with self._id_lock:
+                    self._ids.append(row["chart_id"])
+                return existing
+        else:
+            async with self._id_lock:
+                # Queued by another request while this one awaited its lookups?
+                if user_id is not None and key in self._queued:
+                    return self._queued[key]
+                row["chart_id"] = await self._take_id()
+                self._pending[row["chart_id"]] = row
+                if user_id is not None:
+                    self._queued[key] = row["chart_id"]
+            queued = len(self._pending)
+        if queued >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return row["chart_id"]
+
+    async def _save_now(self, birth_data: dict, result: dict, user_id: Optional[int], db) -> int:
+        from db_async import save_chart
+        return await save_chart(birth_data, result, user_id, db)
+
+    async def pending(self, chart_id: int) -> Optional[Dict]:
+        """A queued chart that is not written yet, in the form get_chart returns, or None."""
+        if self.mode == "memory":
+            row = self._pending.get(chart_id)
+        elif self.mode == "redis":
+            try:
+                raw = await self.redis.get(ROW_PREFIX + str(chart_id))
+            except RedisError:
+                raw = None
+            row = _decode_row(raw) if raw else None
+        else:
+            row = None
+        if row is None:
+            return None
+        return {"chart_id": row["chart_id"], "user_id": row["user_id"], "birth_data": row["birth_data"],
+                "result": row["result"], "created_at": row["created_at"].isoformat()}
+
+    async def _claim(self) -> List:
+        if self.mode == "memory":
+            return [row for _, row in zip(range(self.batch_size), self._pending.values())]
+        if not await self.redis.eval(_LEASE_SCRIPT, 1, LEASE_KEY, self._token, LEASE_MS):
+            return []  # another worker is flushing
+        return await self.redis.lrange(QUEUE_KEY, 0, self.batch_size - 1)
+
+    async def flush(self) -> int:
+        """Write queued charts until none are left (or, in redis mode, the lease is another worker's)."""
+        written = 0
+        while True:
+            claimed = await self._claim()
+            if not claimed:
+                return written
+            rows = [_decode_row(raw) for raw in claimed] if self.mode == "redis" else claimed
+            await self.insert_rows(rows)
+            if self.mode == "redis":
+                pipeline = self.redis.pipeline()
+                pipeline.eval(_TRIM_SCRIPT, 1, QUEUE_KEY, claimed[0], len(claimed))
+                pipeline.delete(*(ROW_PREFIX + str(row["chart_id"]) for row in rows))
+                for row in rows:
+                    if row["user_id"] is not None:
+                        pipeline.expire(_hash_key(row), HASH_GRACE_SECONDS)
+                await pipeline.execute()
+            else:
+                for row in rows:
+                    self._pending.pop(row["chart_id"], None)
+                    self._queued.pop((row["user_id"], row["input_hash"]), None)
+            written += len(rows)
+            self.written += len(rows)
+            self.batches += 1
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Rows stay queued; retry on the next tick
+                logger.warning("Chart write-behind flush failed, retrying: %s", e)
+
+    async def close(self):
+        """Stop the flusher and write everything still queued (the shutdown drain)."""
+        if self._task is not None:
+            # Stopped by flag rather than cancel(), which wait_for can swallow, after the batch in flight
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self.mode == "sync":
+            return
+        try:
+            await self.flush()
+        except Exception as e:
+            lost = f"{len(self._pending)} charts not written" if self.mode == "memory" else "charts remain queued in Redis"
+            logger.warning("Chart write-behind drain failed, %s: %s", lost, e)
+        if self.mode == "redis":
+            try:
+                await self.redis.eval('if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) end return 0',
+                                      1, LEASE_KEY, self._token)
+            except Exception:
+                pass  # the lease expires on its own
+
+    def stats(self) -> Dict:
+        return {"mode": self.mode, "queued": len(self._pending), "written": self.written,
+                "batches": self.batches, "ids_available": len(self._ids)}
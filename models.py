@@ -1,7 +1,8 @@
 # models.py
 from pydantic import BaseModel, validator, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
+import os
 
 class BirthData(BaseModel):
     year: int
@@ -61,6 +62,20 @@ class BirthData(BaseModel):
             raise ValueError("Longitude must be a number between -180 and 180")
         return round(float(v), 6)  # Round to 6 decimal places for precision
 
+# Largest number of charts accepted by POST /charts/batch
+CHART_BATCH_MAX = int(os.getenv("CHART_BATCH_MAX", "500"))
+
+class ChartBatchRequest(BaseModel):
+    # Items are BirthData fields plus an optional tz_offset; each is validated on its own so
+    # one bad item is reported in its slot instead of failing the whole batch
+    items: List[Dict[str, Any]]
+
+    @validator('items')
+    def validate_items(cls, v):
+        if not 1 <= len(v) <= CHART_BATCH_MAX:
+            raise ValueError(f"A batch must contain between 1 and {CHART_BATCH_MAX} items")
+        return v
+
 class CustomAyanamsaData(BaseModel):
     name: str
     value: float
@@ -1,36 +1,207 @@
-from typing import Dict, Optional
-from datetime import datetime
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from datetime import datetime, timedelta
 from models import BirthData
-from services.planetary import calculate_kundali, calculate_transits
+from services.planetary import calculate_kundali, calculate_kundalis, calculate_transits
 from services.divisional_charts import (
     calculate_hora, calculate_drekkana, calculate_saptamsa,
     calculate_navamsa, calculate_dwadasamsa, calculate_trimsamsa
 )
-from services.dasha import calculate_vimshottari_dasha
+from services.dasha import calculate_vimshottari_dasha, calculate_dasha_window
 from services.bala import calculate_sthana_bala, calculate_dig_bala
-from db import save_chart
 from fastapi import HTTPException
-from utils import sanitize_birth_data
+from pydantic import ValidationError
+from services.chart_cache import get_chart_cache, cache_key, CHART_ALGORITHM_VERSION
+from services.encoding import expand_dasha
+from utils import sanitize_birth_data, get_timezone_offset
+
+# Divisional charts in output order; each is cached on its own
+VARGAS = (
+    ("D-2", calculate_hora),
+    ("D-3", calculate_drekkana),
+    ("D-7", calculate_saptamsa),
+    ("D-9", calculate_navamsa),
+    ("D-12", calculate_dwadasamsa),
+    ("D-30", calculate_trimsamsa),
+)
+
+VARGA_NAMES = tuple(name for name, _ in VARGAS)
+
+# What save_chart persists: "full" results, or "inputs" only (recomputed on read, see stored_result)
+CHART_STORAGE_MODE = os.getenv("CHART_STORAGE_MODE", "full").lower()
+if CHART_STORAGE_MODE not in ("full", "inputs"):
+    raise ValueError(f"Invalid CHART_STORAGE_MODE: {CHART_STORAGE_MODE}. Must be 'full' or 'inputs'")
+
+# Chart components and their prerequisites, in output order. Everything but the dasha and
+# the transits is computed for each requested ayanamsa.
+COMPONENT_DEPENDENCIES = {
+    "kundali": (),
+    "dasha": ("kundali",),
+    "transits": (),
+    **{name: ("kundali",) for name in VARGA_NAMES},
+    "sthana_bala": ("kundali", *VARGA_NAMES),
+    "dig_bala": ("kundali",),
+}
+CHART_COMPONENTS = tuple(COMPONENT_DEPENDENCIES)
+AYANAMSA_COMPONENTS = tuple(c for c in CHART_COMPONENTS if c not in ("dasha", "transits"))
+
+# How each per-ayanamsa component is computed from the ones it depends on
+_AYANAMSA_STEPS = {
+    **{name: (lambda varga: lambda values: varga(values["kundali"]))(varga) for name, varga in VARGAS},
+    "sthana_bala": lambda values: calculate_sthana_bala(values["kundali"], *(values[name] for name in VARGA_NAMES)),
+    "dig_bala": lambda values: calculate_dig_bala(values["kundali"]),
+}
+
+def parse_include(include: Optional[Union[str, List[str]]]) -> Tuple[Tuple[str, ...], Optional[int]]:
+    """
+    Requested components from an `include` value such as "kundali,D-9,dasha:1".
+
+    "vargas" stands for all six divisional charts and "dasha:N" also sets the dasha level.
+    Returns the components in output order (all of them when include is empty) and the
+    dasha level given with "dasha:N", if any.
+    """
+    values = [include] if isinstance(include, str) else include or []
+    tokens = [token.strip() for value in values for token in value.split(",") if token.strip()]
+    if not tokens:
+        return CHART_COMPONENTS, None
+    requested, dasha_level = set(), None
+    for token in tokens:
+        name, _, level = token.partition(":")
+        if name == "vargas":
+            requested.update(VARGA_NAMES)
+        elif name == "dasha" and level:
+            if not level.isdigit() or int(level) > 5:
+                raise HTTPException(status_code=400, detail=f"Invalid dasha level in include: {token}")
+            requested.add(name)
+            dasha_level = int(level)
+        elif name in COMPONENT_DEPENDENCIES and not level:
+            requested.add(name)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown chart component: {token}")
+    return tuple(c for c in CHART_COMPONENTS if c in requested), dasha_level
+
+def resolve_components(requested: Iterable[str]) -> Set[str]:
+    """The requested components plus everything they depend on."""
+    needed = set()
+    pending = list(requested)
+    while pending:
+        component = pending.pop()
+        if component not in needed:
+            needed.add(component)
+            pending.extend(COMPONENT_DEPENDENCIES[component])
+    return needed
+
+def _compute(name: str, compute: Callable[[], Dict]) -> Dict:
+    return compute()
+
+def calculate_ayanamsa_view(kundali: Dict, fetch: Callable[[str, Callable[[], Dict]], Dict] = _compute,
+                            components: Iterable[str] = AYANAMSA_COMPONENTS) -> Dict:
+    """
+    Vargas and bala derived from one sidereal kundali.
+
+    Only `components` are computed, so include their prerequisites (see resolve_components).
+    `fetch(name, compute)` returns the named varga or bala, from a cache or by calling compute().
+    """
+    values = {"kundali": kundali}
+    for component in AYANAMSA_COMPONENTS[1:]:
+        if component in components:
+            values[component] = fetch(component, lambda step=_AYANAMSA_STEPS[component]: step(values))
+    view = {"kundali": kundali, "vargas": {name: values[name] for name in VARGA_NAMES if name in values}}
+    for component in ("sthana_bala", "dig_bala"):
+        if component in values:
+            view[component] = values[component]
+    return view
+
+def _select(view: Dict, requested: Iterable[str]) -> Dict:
+    """The requested per-ayanamsa components of a view, in output order."""
+    selected = {}
+    if "kundali" in requested:
+        selected["kundali"] = view["kundali"]
+    vargas = {name: chart for name, chart in view["vargas"].items() if name in requested}
+    if vargas:
+        selected["vargas"] = vargas
+    for component in ("sthana_bala", "dig_bala"):
+        if component in requested:
+            selected[component] = view[component]
+    return selected
+
+def calculate_natal_chart(utc_data: BirthData, tz_offset: float, ayanamsa_types: List[Optional[str]],
+                          dasha_level: Optional[int], components: Iterable[str] = CHART_COMPONENTS,
+                          dasha_columns: bool = False) -> Dict:
+    """
+    The parts of a chart fixed by the birth instant: kundali, dasha, vargas and bala for each ayanamsa.
+
+    Only `components` and their prerequisites are computed. Each one comes from the chart
+    cache when present (one Redis round trip for all of them on an in-process miss); the rest
+    is computed and stored. With `dasha_columns` the dasha is in columnar form, cached apart
+    from the tree.
+    """
+    needed = resolve_components(components)
+    units = [c for c in AYANAMSA_COMPONENTS if c in needed]
+    if not units:
+        return {}
+    cache = get_chart_cache()
+    keys = {(ayanamsa_type, unit): cache_key(unit, utc_data, tz_offset, ayanamsa_type)
+            for ayanamsa_type in ayanamsa_types for unit in units}
+    dasha_unit = "vimshottari_dasha_columns" if dasha_columns else "vimshottari_dasha"
+    dasha_key = cache_key(dasha_unit, utc_data, tz_offset, ayanamsa_types[0], dasha_level=dasha_level)
+    cached = cache.get_many([*keys.values(), *([dasha_key] if "dasha" in needed else [])])
+    fresh = {}
+
+    def fetch(key: str, compute: Callable[[], Dict]) -> Dict:
+        value = cached.get(key)
+        if value is None:
+            value = fresh[key] = compute()
+        return value
+
+    # Missing kundalis are calculated together, sharing the tropical positions
+    missing = [t for t in ayanamsa_types if keys[(t, "kundali")] not in cached]
+    computed = dict(zip(missing, calculate_kundalis(utc_data, tz_offset, missing))) if missing else {}
+    kundalis = [fetch(keys[(t, "kundali")], lambda t=t: computed[t]) for t in ayanamsa_types]
+    views = [calculate_ayanamsa_view(kundali, lambda name, compute, t=t: fetch(keys[(t, name)], compute), units)
+             for t, kundali in zip(ayanamsa_types, kundalis)]
+    natal = dict(views[0])
+    if "dasha" in needed:
+        natal["vimshottari_dasha"] = fetch(dasha_key, lambda: calculate_vimshottari_dasha(
+            utc_data, kundalis[0]["planets"]["Moon"], max_level=dasha_level, columns=dasha_columns))
+    if len(views) > 1:
+        natal["ayanamsas"] = {view["kundali"]["ayanamsa_type"]: view for view in views[1:]}
+    cache.set_many(fresh)
+    return natal
 
 def generate_chart(data: BirthData, tz_offset: float, transit_date: Optional[datetime], 
-                   ayanamsa_type: Optional[str], user_id: Optional[int], 
-                   dasha_level: Optional[int] = 3, db = None) -> Dict:
+                   ayanamsa_type: Optional[Union[str, List[str]]], user_id: Optional[int], 
+                   dasha_level: Optional[int] = 3, db = None,
+                   include: Optional[Union[str, List[str]]] = None, dasha_columns: bool = False) -> Dict:
     """
     Generate a complete astrological chart with kundali, divisional charts, dasha, transits, and bala.
+
+    The natal parts are served from the chart cache (in-process, then Redis) when the same
+    birth instant and options were calculated before; only the transits are always recomputed.
     
     Args:
         data (BirthData): Birth details including date, time, and location.
         tz_offset (float): Timezone offset in hours.
         transit_date (Optional[datetime]): Date for transit calculations.
-        ayanamsa_type (Optional[str]): Type of ayanamsa to use.
+        ayanamsa_type (Optional[Union[str, List[str]]]): Type of ayanamsa to use. With a list,
+            the chart is built for the first one and the others are added under
+            "ayanamsas" (kundali, vargas and bala), sharing the tropical calculation.
         user_id (Optional[int]): User ID for saving the chart.
         dasha_level (Optional[int]): Maximum level of sub-dashas to calculate (0-5).
         db: Database session.
+        include (Optional[Union[str, List[str]]]): Components to return, e.g. "kundali,D-9,dasha:1"
+            (see parse_include); only they and their prerequisites are computed. Default: all.
+        dasha_columns (bool): Return the dasha in columnar form (for binary responses, see
+            services/encoding.py), built from the dasha arrays without the tree. Default: False.
         
     Returns:
         Dict: Complete chart data including kundali, dashas, transits, etc.
     """
     try:
+        requested, include_dasha_level = parse_include(include)
+        if include_dasha_level is not None:
+            dasha_level = include_dasha_level
+
         # Validate dasha_level
         if dasha_level is not None and (dasha_level < 0 or dasha_level > 5):
             dasha_level = 5  # Default to full calculation if invalid
@@ -44,51 +215,184 @@ def generate_chart(data: BirthData, tz_offset: float, transit_date: Optional[dat
         if transit_date is not None and (transit_date.year < 1 or transit_date.year > 9999):
             raise ValueError("Transit date year must be between 1 and 9999")
         
-        # Calculate all components using UTC data
-        kundali = calculate_kundali(utc_data, tz_offset, ayanamsa_type)
-        D2_hora = calculate_hora(kundali)
-        D3_drekkana = calculate_drekkana(kundali)
-        D7_saptamsa = calculate_saptamsa(kundali)
-        D9_navamsa = calculate_navamsa(kundali)
-        D12_dwadasamsa = calculate_dwadasamsa(kundali)
-        D30_trimsamsa = calculate_trimsamsa(kundali)
-        dasha = calculate_vimshottari_dasha(utc_data, kundali["planets"]["Moon"], max_level=dasha_level)
-        transits = calculate_transits(utc_data, tz_offset, transit_date, ayanamsa_type)
-        sthana_bala = calculate_sthana_bala(kundali, D2_hora, D3_drekkana, D7_saptamsa, D9_navamsa, D12_dwadasamsa, D30_trimsamsa)
-        dig_bala = calculate_dig_bala(kundali)
+        # The first ayanamsa drives the chart; any others are compared against it
+        ayanamsa_types = list(dict.fromkeys(ayanamsa_type)) if isinstance(ayanamsa_type, list) else [ayanamsa_type]
+        if not ayanamsa_types:
+            ayanamsa_types = [None]
+        ayanamsa_type = ayanamsa_types[0]
+
+        # Natal parts depend only on the birth instant and options; repeat requests come from the cache
+        natal = calculate_natal_chart(utc_data, tz_offset, ayanamsa_types, dasha_level, requested, dasha_columns)
 
         # Prepare birth data for storage (using original data)
         birth_data = original_data.dict()
         birth_data["tz_offset"] = tz_offset
         birth_data["ayanamsa_type"] = ayanamsa_type
         birth_data["dasha_level"] = dasha_level
+        if requested != CHART_COMPONENTS:
+            birth_data["include"] = list(requested)
         
-        # Structure the result
-        result = {
-            "kundali": kundali,
-            "vimshottari_dasha": dasha,
-            "transits": transits,
-            "vargas": {
-                "D-2": D2_hora,
-                "D-3": D3_drekkana,
-                "D-7": D7_saptamsa,
-                "D-9": D9_navamsa,
-                "D-12": D12_dwadasamsa,
-                "D-30": D30_trimsamsa
-            },
-            "sthana_bala": sthana_bala,
-            "dig_bala": dig_bala,
-            "birth_data": birth_data
-        }
+        # Structure the result: only the requested components, prerequisites left out
+        selected = _select(natal, requested) if natal else {}
+        result = {}
+        if "kundali" in selected:
+            result["kundali"] = selected["kundali"]
+        if "dasha" in requested:
+            result["vimshottari_dasha"] = natal["vimshottari_dasha"]
+        if "transits" in requested:
+            result["transits"] = calculate_transits(utc_data, tz_offset, transit_date, ayanamsa_type)
+        result.update((name, value) for name, value in selected.items() if name != "kundali")
+        result["birth_data"] = birth_data
+        if "ayanamsas" in natal:
+            birth_data["ayanamsa_types"] = ayanamsa_types
+            result["ayanamsas"] = {name: _select(view, requested) for name, view in natal["ayanamsas"].items()}
 
         # Save to database and attach chart_id and user_id
         if db is not None:
-            chart_id = save_chart(birth_data, result, user_id, db)
+            from db import save_chart  # chart workers compute only and never open a database connection
+            chart_id = save_chart(birth_data, stored_result(result), user_id, db)
             result["chart_id"] = chart_id
             result["user_id"] = user_id
 
         return result
     except ValueError as e:
         raise ValueError(f"Chart generation failed: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error in chart generation: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error in chart generation: {str(e)}")
+
+def build_chart(data: BirthData, tz_offset: Optional[float], transit_date: Optional[datetime],
+                ayanamsa_type: Optional[Union[str, List[str]]], dasha_level: Optional[int] = 3,
+                include: Optional[List[str]] = None, dasha_columns: bool = False) -> Dict:
+    """
+    Compute a chart without saving it; the job the chart worker pool runs for POST /charts.
+
+    When tz_offset is None it is looked up from the birth coordinates, which is CPU-bound too.
+    """
+    if tz_offset is None:
+        tz_offset = get_timezone_offset(data.latitude, data.longitude)
+    return generate_chart(data, tz_offset, transit_date, ayanamsa_type, None, dasha_level, include=include,
+                          dasha_columns=dasha_columns)
+
+def build_charts(items: List[Dict], transit_date: Optional[datetime], ayanamsa_type: Optional[Union[str, List[str]]],
+                 dasha_level: Optional[int] = 3, include: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Compute several charts in one worker job (POST /charts/batch).
+
+    Each item holds BirthData fields and an optional tz_offset. Returns, per item and in order,
+    {"chart": result} or {"error": {"status_code": ..., "detail": ...}}; one bad item never
+    fails the others.
+    """
+    outcomes = []
+    for item in items:
+        try:
+            fields = dict(item)
+            tz_offset = fields.pop("tz_offset", None)
+            data = BirthData(**fields)
+            outcomes.append({"chart": build_chart(data, tz_offset, transit_date, ayanamsa_type, dasha_level, include)})
+        except ValidationError as e:
+            outcomes.append({"error": {"status_code": 422, "detail": [error["msg"] for error in e.errors()]}})
+        except ValueError:
+            outcomes.append({"error": {"status_code": 400, "detail": "Chart generation failed: invalid input"}})
+        except HTTPException as e:
+            outcomes.append({"error": {"status_code": e.status_code, "detail": e.detail}})
+    return outcomes
+
+def stored_result(result: Dict) -> Dict:
+    """
+    What to save in the `result` column for a computed chart.
+
+    In "inputs" storage mode that is not the chart but a small record. The birth data saved
+    alongside it already holds the canonical inputs. The record adds the algorithm version,
+    the natal sidereal longitudes (for queries such as dasha_batch.py) and the transit instant.
+    materialize_chart() recomputes the chart from the pair.
+
+    A full result is saved with its dasha as a tree, expanded here if it was computed columnar.
+    """
+    if CHART_STORAGE_MODE != "inputs":
+        dasha = result.get("vimshottari_dasha")
+        return {**result, "vimshottari_dasha": expand_dasha(dasha)} if isinstance(dasha, dict) else result
+    planets = result.get("kundali", {}).get("planets", {})
+    return {
+        "storage": "inputs",
+        "algorithm_version": CHART_ALGORITHM_VERSION,
+        "positions": {name: round(planet["longitude"], 6) for name, planet in planets.items()},
+        "transit_date": result["transits"]["transit_date"] if "transits" in result else None,
+    }
+
+def select_sections(result: Dict, requested: Iterable[str]) -> Dict:
+    """The requested components (see parse_include) of a computed chart; other keys are kept."""
+    sections = {"vimshottari_dasha": "dasha", **{name: name for name in CHART_COMPONENTS}}
+    selected = {}
+    for key, value in result.items():
+        if key == "vargas":
+            vargas = {name: chart for name, chart in value.items() if name in requested}
+            if vargas:
+                selected[key] = vargas
+        elif key == "ayanamsas":
+            selected[key] = {name: select_sections(view, requested) for name, view in value.items()}
+        elif key not in sections or sections[key] in requested:
+            selected[key] = value
+    return selected
+
+def materialize_chart(birth_data: Dict, stored: Dict, include: Optional[List[str]] = None,
+                      dasha_columns: bool = False) -> Dict:
+    """
+    The chart a saved row stands for, limited to the `include` components if given.
+
+    A row saved in "inputs" storage mode is recomputed from its birth data, through the chart
+    cache, with transits at the instant the chart was created (and its dasha columnar with
+    `dasha_columns`). A full row is only filtered, so a dasha level in `include` cannot deepen
+    its stored dasha.
+    """
+    if stored.get("storage") != "inputs":
+        return select_sections(stored, parse_include(include)[0]) if include else stored
+    tz_offset = birth_data.get("tz_offset", 0.0)
+    transit_date = None
+    if stored.get("transit_date"):
+        # Saved in UTC; generate_chart takes the transit date in the chart's time zone
+        transit_date = datetime.strptime(stored["transit_date"], "%Y-%m-%d %H:%M:%S") + timedelta(hours=tz_offset)
+    data = BirthData(**birth_data)  # extra stored keys are ignored
+    result = generate_chart(data, tz_offset, transit_date, birth_data.get("ayanamsa_types") or birth_data.get("ayanamsa_type"),
+                            None, birth_data.get("dasha_level", 3), include=include or birth_data.get("include"),
+                            dasha_columns=dasha_columns)
+    result["birth_data"] = birth_data
+    return result
+
+def generate_dasha_window(stored_birth_data: Dict, start: datetime, end: datetime, level: int = 2,
+                          system: str = "vimshottari") -> Dict:
+    """
+    Recompute the dasha periods overlapping [start, end) for a saved chart.
+
+    The chart positions are recomputed from the stored birth data; the dasha tree
+    itself is walked lazily, so nothing outside the window is built.
+
+    Args:
+        stored_birth_data (Dict): Birth data as saved with the chart (local time plus tz_offset and ayanamsa_type).
+        start (datetime): Window start (naive UTC).
+        end (datetime): Window end (naive UTC).
+        level (int): Dasha level to return (0 = Mahadasha ... 5 = Deha).
+        system (str): Dasha system (vimshottari, yogini, ashtottari or chara).
+
+    Returns:
+        Dict: The window bounds and the flat list of overlapping periods.
+    """
+    try:
+        tz_offset = stored_birth_data.get("tz_offset", 0.0)
+        ayanamsa_type = stored_birth_data.get("ayanamsa_type")
+        data = BirthData(**stored_birth_data)  # extra stored keys are ignored
+        utc_data = sanitize_birth_data(data, tz_offset)["utc"]
+
+        kundali = calculate_kundali(utc_data, tz_offset, ayanamsa_type)
+        periods = calculate_dasha_window(utc_data, kundali["planets"]["Moon"], start, end, level,
+                                         system=system, kundali=kundali)
+        return {
+            "system": system,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "level": level,
+            "periods": periods
+        }
+    except ValueError as e:
+        raise ValueError(f"Dasha window calculation failed: {str(e)}")
@@ -0,0 +1,270 @@
+"""
+Two-tier content-addressed cache of natal chart calculations.
+
+Everything in a chart except the transits and the echoed birth data depends only on the UTC
+birth instant, the time zone offset, the coordinates, the ayanamsa and the dasha level. Each
+cached unit (a kundali, one varga, sthana bala or the dasha tree) is keyed on its name,
+CHART_ALGORITHM_VERSION and the chart_hash.input_digest of those inputs, the digest saved
+charts are deduplicated by. Bumping the version invalidates every entry in both tiers.
+
+L1 is a per-process LRU bounded by bytes, measured as the size of the JSON encoding. A hit
+returns the cached object itself: no Redis round trip and no deserialization. Cached values
+are shared, so treat them as read-only. L2 is Redis, shared by all workers. It stores
+zlib-compressed JSON with a TTL, and a last-access sorted set evicts the least recently used
+keys past CHART_CACHE_MAX_ENTRIES. A request fetches all its units from Redis in one MGET.
+
+L2 is optional. If Redis is unreachable, lookups miss and stores are skipped, and Redis is not
+retried for RETRY_SECONDS. Hit and miss counters per tier are kept per process. They are
+added to a Redis hash every STATS_FLUSH_SECONDS, so the totals cover all workers, and each
+process stores a snapshot of its own stats next to them (see worker_cache_stats).
+
+Configuration (environment): the REDIS_* settings used by app.py, plus
+    CHART_CACHE_ENABLED      "false" disables the Redis tier (default: true)
+    CHART_CACHE_TTL          seconds a Redis entry lives after it is stored (default: 7 days)
+    CHART_CACHE_MAX_ENTRIES  Redis entries kept before LRU eviction (default: 100000)
+    CHART_CACHE_MAX_BYTES    compressed entries larger than this are not stored (default: 1 MB)
+    CHART_L1_MAX_BYTES       in-process tier size per worker (default: 64 MB, 0 disables it)
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import redis
+from models import BirthData
+from chart_hash import CHART_ALGORITHM_VERSION, input_digest
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chart:"
+INDEX_KEY = "chart:natal-index"
+STATS_KEY = "chart:cache-stats"
+WORKERS_KEY = "chart:cache-stats:workers"
+WORKER_STATS_MAX_AGE = 3600  # snapshots of workers silent for this long are dropped
+RETRY_SECONDS = 30
+STATS_FLUSH_SECONDS = 10
+
+CHART_CACHE_ENABLED = os.getenv("CHART_CACHE_ENABLED", "true").lower() == "true"
+CHART_CACHE_TTL = int(os.getenv("CHART_CACHE_TTL", str(7 * 24 * 3600)))
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "100000"))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(1024 * 1024)))
+CHART_L1_MAX_BYTES = int(os.getenv("CHART_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def cache_key(unit: str, utc_data: BirthData, tz_offset: float, ayanamsa_type: Optional[str], **options) -> str:
+    """Key of one cached unit (e.g. "kundali", "D-9") for a UTC birth instant; equal inputs always hash alike."""
+    seconds = (utc_data.hour * 60 + utc_data.minute) * 60 + utc_data.second
+    digest = input_digest(utc_data.year, utc_data.month, utc_data.day, seconds, tz_offset,
+                          utc_data.latitude, utc_data.longitude, ayanamsa_type, **options)
+    return f"{KEY_PREFIX}{unit}:v{CHART_ALGORITHM_VERSION}:{digest}"
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+class MemoryLRU:
+    """In-process LRU of decoded values, bounded by the total size of their JSON encodings."""
+    def __init__(self, max_bytes: int = CHART_L1_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()  # thread-mode chart workers share the process
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: Any, size: int):
+        # A single entry may not take more than a quarter of the tier
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+class ChartCache:
+    """Compressed values in Redis with TTL and LRU-bounded size."""
+    def __init__(self, client: redis.Redis, ttl: int = CHART_CACHE_TTL, max_entries: int = CHART_CACHE_MAX_ENTRIES,
+                 max_bytes: int = CHART_CACHE_MAX_BYTES):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._retry_at = 0.0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._retry_at
+
+    def _failed(self, e: Exception):
+        logger.warning("Chart cache unavailable, retrying in %ss: %s", RETRY_SECONDS, e)
+        self._retry_at = time.monotonic() + RETRY_SECONDS
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[Any, int]]:
+        """(value, JSON size) of each key found, in one round trip."""
+        keys = list(keys)
+        if not keys or not self.available():
+            return {}
+        now = time.time()
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.mget(keys)
+            for key in keys:
+                pipeline.zadd(INDEX_KEY, {key: now}, xx=True)
+            blobs = pipeline.execute()[0]
+        except redis.RedisError as e:
+            self._failed(e)
+            return {}
+        found = {}
+        for key, blob in zip(keys, blobs):
+            if blob is None:
+                continue
+            try:
+                encoded = zlib.decompress(blob)
+                found[key] = (json.loads(encoded), len(encoded))
+            except (zlib.error, ValueError):
+                continue
+        return found
+
+    def set_many(self, encoded: Dict[str, bytes]):
+        """Store JSON-encoded values, evicting the least recently used keys past max_entries."""
+        if not encoded or not self.available():
+            return
+        now = time.time()
+        try:
+            pipeline = self.client.pipeline()
+            for key, payload in encoded.items():
+                blob = zlib.compress(payload, 6)
+                if len(blob) <= self.max_bytes:
+                    pipeline.set(key, blob, ex=self.ttl)
+                    pipeline.zadd(INDEX_KEY, {key: now})
+            # Index entries untouched for a whole TTL belong to keys Redis has already expired
+            pipeline.zremrangebyscore(INDEX_KEY, 0, now - self.ttl)
+            pipeline.zcard(INDEX_KEY)
+            size = pipeline.execute()[-1]
+            if size > self.max_entries:
+                evicted = [k for k, _ in self.client.zpopmin(INDEX_KEY, size - self.max_entries)]
+                if evicted:
+                    self.client.delete(*evicted)
+        except redis.RedisError as e:
+            self._failed(e)
+
+    def add_stats(self, counts: Dict[str, int], snapshot: Dict[str, int]):
+        if not self.available():
+            return
+        try:
+            pipeline = self.client.pipeline()
+            for name, count in counts.items():
+                if count:
+                    pipeline.hincrby(STATS_KEY, name, count)
+            pipeline.hset(WORKERS_KEY, f"{socket.gethostname()}:{os.getpid()}",
+                          json.dumps({**snapshot, "flushed_at": time.time()}))
+            pipeline.execute()
+        except redis.RedisError as e:
+            self._failed(e)
+
+class TieredCache:
+    """L1 MemoryLRU in front of an optional L2 ChartCache, with hit and miss counters per tier."""
+    COUNTERS = ("l1_hits", "l1_misses", "l2_hits", "l2_misses")
+
+    def __init__(self, l1: MemoryLRU, l2: Optional[ChartCache] = None):
+        self.l1 = l1
+        self.l2 = l2
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self._unflushed = dict.fromkeys(self.COUNTERS, 0)
+        self._flushed_at = time.monotonic()
+
+    def _count(self, name: str, n: int):
+        self.counts[name] += n
+        self._unflushed[name] += n
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Cached values of `keys`; missing keys are absent from the result."""
+        found = {}
+        misses = []
+        for key in keys:
+            value = self.l1.get(key)
+            if value is None:
+                misses.append(key)
+            else:
+                found[key] = value
+        self._count("l1_hits", len(found))
+        self._count("l1_misses", len(misses))
+        if misses and self.l2 is not None:
+            remote = self.l2.get_many(misses)
+            for key, (value, size) in remote.items():
+                self.l1.put(key, value, size)
+                found[key] = value
+            self._count("l2_hits", len(remote))
+            self._count("l2_misses", len(misses) - len(remote))
+        self._flush_stats()
+        return found
+
+    def set_many(self, values: Dict[str, Any]):
+        encoded = {key: _encode(value) for key, value in values.items()}
+        for key, value in values.items():
+            self.l1.put(key, value, len(encoded[key]))
+        if self.l2 is not None:
+            self.l2.set_many(encoded)
+
+    def _flush_stats(self):
+        if self.l2 is None or time.monotonic() - self._flushed_at < STATS_FLUSH_SECONDS:
+            return
+        self._flushed_at = time.monotonic()
+        self.l2.add_stats(self._unflushed, self.stats())
+        self._unflushed = dict.fromkeys(self.COUNTERS, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process, plus the current size of its L1 tier."""
+        return {**self.counts, "l1_entries": len(self.l1), "l1_bytes": self.l1.bytes, "l1_evictions": self.l1.evictions}
+
+_cache: Optional[TieredCache] = None
+
+def get_chart_cache() -> TieredCache:
+    """The process-wide chart cache; the Redis tier is left out when disabled."""
+    global _cache
+    if _cache is None:
+        l2 = None
+        if CHART_CACHE_ENABLED:
+            l2 = ChartCache(redis.Redis(
+                host=os.getenv("REDIS_HOST", "localhost"),
+                port=int(os.getenv("REDIS_PORT", "6379")),
+                db=int(os.getenv("REDIS_DB", "0")),
+                password=os.getenv("REDIS_PASSWORD", None),
+                ssl=os.getenv("REDIS_SSL", "false").lower() == "true",
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5,
+            ))
+        _cache = TieredCache(MemoryLRU(CHART_L1_MAX_BYTES), l2)
+    return _cache
+
+def worker_cache_stats(snapshots: Dict[str, str]) -> Tuple[Dict[str, Dict], List[str]]:
+    """
+    The per-process stats in the WORKERS_KEY hash, by "host:pid", and the names of the
+    snapshots older than WORKER_STATS_MAX_AGE (exited or idle workers), which are left out.
+    """
+    now = time.time()
+    workers, stale = {}, []
+    for name, raw in snapshots.items():
+        stats = json.loads(raw)
+        if now - stats["flushed_at"] < WORKER_STATS_MAX_AGE:
+            workers[name] = stats
+        else:
+            stale.append(name)
+    return workers, stale
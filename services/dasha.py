@@ -1,247 +1,788 @@
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime, timedelta
-import functools
-from models import BirthData
-from constants import VIMSHOTTARI_PLANETS, VIMSHOTTARI_DURATIONS, NAKSHATRA_SPAN, DAYS_PER_YEAR, NAKSHATRA_TO_PLANET, NAKSHATRA_BOUNDARIES
-
-# LRU Cache for dasha calculations - will store up to 128 results
-@functools.lru_cache(maxsize=128)
-def cached_dasha_periods(birth_year: int, birth_month: int, birth_day: int, 
-                         moon_longitude: float, max_level: int) -> List:
-    """
-    Cached version of the dasha calculation that uses hashable parameters.
-    
-    Args:
-        birth_year, birth_month, birth_day: Birth date components
-        moon_longitude: Moon's longitude at birth
-        max_level: Maximum level of sub-dashas to calculate
-        
-    Returns:
-        List of dasha periods
-    """
-    # Create a datetime object from the components
-    birth_date = datetime(birth_year, birth_month, birth_day)
-    
-    # Find nakshatra information
-    nakshatra_index = None
-    for i, (start, end) in enumerate(NAKSHATRA_BOUNDARIES):
-        if start <= moon_longitude < end:
-            nakshatra_index = i
-            break
-    if nakshatra_index is None:
-        nakshatra_index = 26  # Revati (last Nakshatra) if at 360°
-    
-    nakshatra_deg = moon_longitude - NAKSHATRA_BOUNDARIES[nakshatra_index][0]
-    
-    # Map Nakshatra to starting Dasha planet
-    starting_planet = NAKSHATRA_TO_PLANET[(nakshatra_index+1)%9-1]
-    starting_planet_index = VIMSHOTTARI_PLANETS.index(starting_planet)
-    
-    # Calculate balance of the first Dasha
-    remaining_deg = NAKSHATRA_SPAN - nakshatra_deg
-    proportion = remaining_deg / NAKSHATRA_SPAN
-    total_duration = VIMSHOTTARI_DURATIONS[starting_planet]
-    balance_years = proportion * total_duration
-    
-    # Calculate elapsed time and start of first Mahadasha
-    elapsed_years = total_duration - balance_years
-    elapsed_days = elapsed_years * DAYS_PER_YEAR
-    first_mahadasha_start = birth_date - timedelta(days=elapsed_days)
-    
-    # Generate the dasha timeline using optimized methods
-    return generate_dasha_timeline(
-        first_mahadasha_start, 
-        starting_planet_index,
-        max_level
-    )
-
-def generate_dasha_timeline(start_date: datetime, planet_index: int, max_level: int) -> List:
-    """
-    Generates the complete dasha timeline starting from the given date and planet.
-    
-    Args:
-        start_date: The start date for the first mahadasha
-        planet_index: The index of the first mahadasha lord
-        max_level: Maximum dasha level to calculate
-        
-    Returns:
-        List of dasha periods
-    """
-    dasha_timeline = []
-    current_date = start_date
-    remaining_years = 120  # Total Vimshottari cycle
-    current_planet_index = planet_index
-    
-    # Pre-calculate actual end dates for better performance
-    while remaining_years > 0:
-        planet = VIMSHOTTARI_PLANETS[current_planet_index]
-        duration = VIMSHOTTARI_DURATIONS[planet]
-        if duration > remaining_years:
-            duration = remaining_years
-        
-        # Calculate this Mahadasha and its sub-periods
-        mahadasha_end = current_date + timedelta(days=duration * 365.25)
-        
-        # Use optimized recursive calculation
-        mahadasha = calculate_dasha_period(
-            planet, 
-            current_date,
-            mahadasha_end,
-            current_planet_index,
-            0,
-            max_level
-        )
-        
-        dasha_timeline.append(mahadasha)
-        
-        # Update for next iteration
-        current_date = mahadasha_end
-        remaining_years -= duration
-        current_planet_index = (current_planet_index + 1) % len(VIMSHOTTARI_PLANETS)
-    
-    return dasha_timeline
-
-def calculate_dasha_period(planet: str, start_date: datetime, end_date: datetime, 
-                          planet_index: int, level: int, max_level: int) -> Dict:
-    """
-    Optimized function to calculate a dasha period and its sub-periods.
-    
-    Args:
-        planet: The dasha lord planet
-        start_date: Period start date
-        end_date: Period end date
-        planet_index: Index of the planet in the Vimshottari sequence
-        level: Current dasha level (0=Mahadasha, etc.)
-        max_level: Maximum level to calculate
-        
-    Returns:
-        Dict with dasha period information
-    """
-    # Base result with essential data only
-    result = {
-        "planet": planet,
-        "start_date": start_date.strftime("%Y-%m-%d"),
-        "end_date": end_date.strftime("%Y-%m-%d")
-    }
-    
-    # No sub-periods if at max level or only calculating Mahadashas
-    if level >= max_level or max_level == 0:
-        return result
-    
-    # Determine the key for this level's sub-periods
-    sub_keys = [
-        "antardashas", 
-        "pratyantar_dashas", 
-        "sookshma_dashas", 
-        "prana_dashas", 
-        "deha_dashas"
-    ]
-    
-    sub_key = sub_keys[level]
-    result[sub_key] = []
-    
-    # Calculate duration in days and years
-    duration_days = (end_date - start_date).total_seconds() / 86400
-    duration_years = duration_days / 365.25
-    
-    # Iterate through the sub-periods
-    sub_start = start_date
-    for i in range(9):
-        sub_planet_index = (planet_index + i) % 9
-        sub_planet = VIMSHOTTARI_PLANETS[sub_planet_index]
-        
-        # Calculate sub-period duration
-        sub_duration_years = (duration_years * VIMSHOTTARI_DURATIONS[sub_planet]) / 120
-        sub_duration_days = sub_duration_years * 365.25
-        sub_end = sub_start + timedelta(days=sub_duration_days)
-        
-        # Create the sub-period recursively
-        sub_period = calculate_dasha_period(
-            sub_planet,
-            sub_start,
-            sub_end,
-            sub_planet_index,
-            level + 1,
-            max_level
-        )
-        
-        result[sub_key].append(sub_period)
-        sub_start = sub_end
-    
-    return result
-
-def calculate_vimshottari_dasha(birth_data: BirthData, moon_data: Dict, max_level: int = 2) -> list:
-    """
-    Calculate the Vimshottari Dasha periods based on the Moon's position at birth.
-    
-    Args:
-        birth_data (BirthData): Birth details including date, time, and location.
-        moon_data (Dict): Moon's position data including longitude.
-        max_level (int, optional): Maximum level of sub-dashas to calculate.
-                                  0 = Only Mahadasha
-                                  1 = Mahadasha + Antardasha
-                                  2 = Mahadasha + Antardasha + Pratyantar
-                                  3 = Adding Sookshma
-                                  4 = Adding Prana
-                                  5 = Adding Deha (full calculation)
-                                  Defaults to 2 (up to Pratyantar).
-    
-    Returns:
-        list: A hierarchical list of dasha periods.
-    """
-    try:
-        # Ensure max_level is valid
-        if max_level < 0 or max_level > 5:
-            max_level = 2  # Default to Pratyantar level if invalid
-        
-        # Extract the key values for caching
-        moon_longitude = moon_data["longitude"]
-        
-        # Use the cached function
-        return cached_dasha_periods(
-            birth_data.year,
-            birth_data.month,
-            birth_data.day,
-            moon_longitude,
-            max_level
-        )
-    except KeyError as e:
-        raise ValueError(f"Missing required moon data: {str(e)}")
-    except ValueError as e:
-        raise ValueError(f"Dasha calculation failed: {str(e)}")
-    except TypeError as e:
-        raise ValueError(f"Invalid data type in dasha calculation: {str(e)}")
-    except Exception as e:
-        raise ValueError(f"Unexpected error in dasha calculation: {str(e)}")
-
-# For backward compatibility
-def calculate_sub_dasha_periods(start_date, duration_years, planet_index, level=0, max_level=2):
-    """
-    Helper function to recursively calculate sub-dasha periods based on the level.
-    Maintained for backward compatibility.
-    
-    Args:
-        start_date (datetime): Start date of the parent dasha
-        duration_years (float): Duration of the parent dasha in years
-        planet_index (int): Index of the starting planet for this dasha
-        level (int): Current dasha level (0=Mahadasha, 1=Antardasha, etc.)
-        max_level (int): Maximum dasha level to calculate (5 would include Deha Dasha)
-        
-    Returns:
-        dict: Nested dictionary of dasha periods
-    """
-    if level > max_level:
-        return None
-    
-    duration_days = duration_years * 365.25
-    end_date = start_date + timedelta(days=duration_days)
-    planet = VIMSHOTTARI_PLANETS[planet_index % 9]
-    
-    return calculate_dasha_period(
-        planet,
-        start_date,
-        end_date,
-        planet_index,
-        level,
-        max_level
-    )
\ No newline at end of file
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from datetime import date, datetime
+from bisect import bisect_right
+import functools
+from abc import ABC, abstractmethod
+from itertools import islice
+import numpy as np
+from models import BirthData
+from constants import (
+    VIMSHOTTARI_PLANETS, VIMSHOTTARI_DURATIONS, NAKSHATRA_TO_PLANET,
+    YOGINI_DASHAS, YOGINI_DURATIONS, ASHTOTTARI_PLANETS, ASHTOTTARI_DURATIONS, ASHTOTTARI_NAKSHATRA_LORDS,
+    ZODIAC_SIGNS, SIGN_LORDS, SIGN_CO_LORDS, NAKSHATRA_SPAN, DAYS_PER_YEAR
+)
+from utils import datetime_to_jd, jd_to_datetime, jd_to_date_string, JD_ORDINAL_OFFSET
+
+# Dasha periods are laid out on a 365.25-day year, while the balance of the
+# first Mahadasha is converted with DAYS_PER_YEAR (kept for output compatibility).
+DASHA_YEAR_DAYS = 365.25
+VIMSHOTTARI_CYCLE_YEARS = 120
+MAX_DASHA_LEVEL = 5
+MAX_DASHA_WINDOW_PERIODS = 5000
+
+DASHA_LEVEL_NAMES = ["mahadasha", "antardasha", "pratyantar_dasha", "sookshma_dasha", "prana_dasha", "deha_dasha"]
+SUB_DASHA_KEYS = ["antardashas", "pratyantar_dashas", "sookshma_dashas", "prana_dashas", "deha_dashas"]
+
+class DashaSystem:
+    """
+    Data tables describing one dasha system.
+
+    Every lord has a fixed list of sub-period lords and the share of its span each
+    of them takes; the engine below only ever reads these tables, so a new system
+    is a new set of tables rather than new code. Nakshatra-based systems also carry
+    the lord of every nakshatra, which decides the starting lord and the balance of
+    the first Mahadasha.
+    """
+
+    def __init__(self, name: str, lord_names: Sequence[str], sub_lords: Sequence[Sequence[int]],
+                 sub_shares: Sequence[Sequence[float]], cycle_years: float, lord_key: str = "planet",
+                 lord_years: Optional[Sequence[float]] = None, nakshatra_lords: Optional[Sequence[int]] = None,
+                 max_level: int = MAX_DASHA_LEVEL, rounds: int = 1):
+        self.name = name
+        self.lord_names = list(lord_names)
+        self.lord_key = lord_key
+        self.cycle_years = cycle_years
+        # Short cycles (Yogini) repeat to cover a lifetime; the engine treats the rounds as one span
+        self.rounds = rounds
+        self.span_years = cycle_years * rounds
+        self.max_level = max_level
+
+        self.sub_lords = np.array(sub_lords, dtype=np.uint8)
+        self.sub_count = self.sub_lords.shape[1]
+        cumulative = np.zeros((len(self.lord_names), self.sub_count + 1), dtype=np.float64)
+        cumulative[:, 1:] = np.cumsum(np.array(sub_shares, dtype=np.float64), axis=1)
+        cumulative[:, -1] = 1.0
+        self.sub_cumulative = cumulative
+        self.sub_lords.flags.writeable = False
+        self.sub_cumulative.flags.writeable = False
+        # Plain lists for the scalar bisect in the lazy engine
+        self.sub_lord_lists = self.sub_lords.tolist()
+        self.sub_cumulative_lists = cumulative.tolist()
+
+        self.lord_years = None if lord_years is None else np.array(lord_years, dtype=np.float64)
+        self.nakshatra_lords = None
+        if nakshatra_lords is not None:
+            # A lord may rule a run of consecutive nakshatras (Ashtottari); the balance at
+            # birth is measured over the whole run, so record each nakshatra's place in it.
+            lords = list(nakshatra_lords)
+            offsets, run_lengths = [0] * 27, [0] * 27
+            for i in range(27):
+                offset = 0
+                while offset < 26 and lords[(i - offset - 1) % 27] == lords[i]:
+                    offset += 1
+                length = offset + 1
+                while length < 27 and lords[(i + length - offset) % 27] == lords[i]:
+                    length += 1
+                offsets[i], run_lengths[i] = offset, length
+            self.nakshatra_lords = np.array(lords, dtype=np.uint8)
+            self.nakshatra_offsets = np.array(offsets, dtype=np.float64)
+            self.nakshatra_runs = np.array(run_lengths, dtype=np.float64)
+
+    @classmethod
+    def rotating(cls, name: str, lord_names: Sequence[str], durations: Dict[str, float],
+                 nakshatra_lords: Sequence[str], lord_key: str = "planet", rounds: int = 1) -> "DashaSystem":
+        """
+        Nakshatra-based system whose sub-periods begin with the parent lord and follow
+        the main sequence, each taking the same share of the parent as it does of the cycle.
+        """
+        count = len(lord_names)
+        years = [durations[lord] for lord in lord_names]
+        cycle_years = sum(years)
+        sub_lords = [[(lord + i) % count for i in range(count)] for lord in range(count)]
+        sub_shares = [[years[sub_lord] / cycle_years for sub_lord in row] for row in sub_lords]
+        return cls(name, lord_names, sub_lords, sub_shares, cycle_years, lord_key=lord_key, lord_years=years,
+                   nakshatra_lords=[list(lord_names).index(lord) for lord in nakshatra_lords], rounds=rounds)
+
+    def starting_lord(self, moon_longitude: float) -> Tuple[int, float]:
+        """Starting lord index and the years of its Mahadasha already elapsed at birth."""
+        moon_longitude = moon_longitude % 360
+        nakshatra_index = min(int(moon_longitude / NAKSHATRA_SPAN), 26)
+        nakshatra_deg = moon_longitude - nakshatra_index * NAKSHATRA_SPAN
+        lord_index = int(self.nakshatra_lords[nakshatra_index])
+        offset, run = self.nakshatra_offsets[nakshatra_index], self.nakshatra_runs[nakshatra_index]
+        elapsed_years = self.lord_years[lord_index] * (offset * NAKSHATRA_SPAN + nakshatra_deg) / (run * NAKSHATRA_SPAN)
+        return lord_index, float(elapsed_years)
+
+    def starting_lords(self, moon_longitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized `starting_lord` over an array of Moon longitudes."""
+        moon_longitudes = np.mod(np.asarray(moon_longitudes, dtype=np.float64), 360)
+        nakshatra_index = np.minimum((moon_longitudes / NAKSHATRA_SPAN).astype(np.int64), 26)
+        nakshatra_deg = moon_longitudes - nakshatra_index * NAKSHATRA_SPAN
+        lords = self.nakshatra_lords[nakshatra_index]
+        offset, run = self.nakshatra_offsets[nakshatra_index], self.nakshatra_runs[nakshatra_index]
+        elapsed_years = self.lord_years[lords] * (offset * NAKSHATRA_SPAN + nakshatra_deg) / (run * NAKSHATRA_SPAN)
+        return lords, elapsed_years
+
+    def __repr__(self) -> str:
+        return f"DashaSystem({self.name})"
+
+VIMSHOTTARI = DashaSystem.rotating("vimshottari", VIMSHOTTARI_PLANETS, VIMSHOTTARI_DURATIONS, NAKSHATRA_TO_PLANET * 3)
+# Yogini: the yogini of the n-th nakshatra (1-based) is the ((n + 3) mod 8)-th in sequence
+YOGINI = DashaSystem.rotating("yogini", YOGINI_DASHAS, YOGINI_DURATIONS,
+                              [YOGINI_DASHAS[(i + 3) % 8] for i in range(27)], lord_key="yogini", rounds=4)
+ASHTOTTARI = DashaSystem.rotating("ashtottari", ASHTOTTARI_PLANETS, ASHTOTTARI_DURATIONS, ASHTOTTARI_NAKSHATRA_LORDS)
+
+# Chara dasha runs through the signs, forward or backward depending on the chart. Its lords
+# are the 12 signs twice over (0-11 counted forward, 12-23 backward) so that the direction
+# is carried down to the sub-periods: each Antardasha starts from the sign after its parent.
+CHARA_CYCLE_YEARS = 144  # both cycles: the second gives each sign 12 minus its first-cycle years
+_SAVYA_SIGNS = {0, 1, 2, 6, 7, 8}  # Aries-Gemini and Libra-Sagittarius are counted forward
+CHARA = DashaSystem(
+    "chara", ZODIAC_SIGNS * 2,
+    [[(sign + 1 + i) % 12 for i in range(12)] for sign in range(12)]
+    + [[12 + (sign - 1 - i) % 12 for i in range(12)] for sign in range(12)],
+    [[1 / 12] * 12] * 24, CHARA_CYCLE_YEARS, lord_key="sign", max_level=2
+)
+
+DASHA_SYSTEMS = {system.name: system for system in (VIMSHOTTARI, YOGINI, ASHTOTTARI, CHARA)}
+
+def _expand_level(system: DashaSystem, boundaries: np.ndarray, lords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Split every period of one level into its sub-periods."""
+    parent_starts = boundaries[:-1]
+    parent_spans = np.diff(boundaries)
+    # Children start at parent_start + parent_span * cumulative share of each sub-lord
+    cumulative = system.sub_cumulative[lords]
+    starts = parent_starts[:, None] + parent_spans[:, None] * cumulative[:, :system.sub_count]
+    child_lords = system.sub_lords[lords].ravel()
+    child_boundaries = np.append(starts.ravel(), 1.0)
+    child_boundaries.flags.writeable = False
+    child_lords.flags.writeable = False
+    return child_boundaries, child_lords
+
+@functools.lru_cache(maxsize=None)
+def dasha_template(starting_lord_index: int, level: int, system: DashaSystem = VIMSHOTTARI) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Relative shape of a nakshatra dasha cycle at one dasha level.
+
+    Every chart whose Moon falls in a nakshatra of the same lord shares this shape;
+    only the absolute cycle start differs. Templates are built once per
+    (system, starting lord, level) and reused for the lifetime of the process.
+
+    Returns:
+        Tuple of (boundaries, lords): `boundaries` holds n**(level+1) + 1 float64
+        offsets as fractions of the cycle, `lords` the uint8 lord index of each of
+        the n**(level+1) periods in between (n = 9 for Vimshottari).
+    """
+    if level == 0:
+        # The Mahadashas of every round, each round taking an equal share of the span
+        rounds = system.rounds
+        starts = (np.arange(rounds)[:, None] + system.sub_cumulative[starting_lord_index, :-1]) / rounds
+        boundaries = np.append(starts.ravel(), 1.0)
+        lords = np.tile(system.sub_lords[starting_lord_index], rounds)
+        boundaries.flags.writeable = False
+        lords.flags.writeable = False
+        return boundaries, lords
+    return _expand_level(system, *dasha_template(starting_lord_index, level - 1, system))
+
+def _format_jd_dates(jds: np.ndarray) -> List[str]:
+    """Format Julian Days as YYYY-MM-DD, formatting each distinct calendar day once."""
+    ordinals = np.floor(jds - JD_ORDINAL_OFFSET).astype(np.int64)
+    unique_ordinals, inverse = np.unique(ordinals, return_inverse=True)
+    labels = [date.fromordinal(int(ordinal)).isoformat() for ordinal in unique_ordinals]
+    return [labels[i] for i in inverse.ravel()]
+
+Instant = Union[datetime, float]
+
+def _to_jd(value: Instant) -> float:
+    """Accept either a naive UTC datetime or a Julian Day."""
+    return datetime_to_jd(value) if isinstance(value, datetime) else float(value)
+
+class DashaPeriod:
+    """A single dasha period; its sub-periods are only computed when asked for."""
+    __slots__ = ("lord_index", "level", "start_jd", "end_jd", "parent", "system")
+
+    def __init__(self, lord_index: int, level: int, start_jd: float, end_jd: float,
+                 parent: Optional["DashaPeriod"] = None, system: DashaSystem = VIMSHOTTARI):
+        self.lord_index = lord_index
+        self.level = level
+        self.start_jd = start_jd
+        self.end_jd = end_jd
+        self.parent = parent
+        self.system = system
+
+    @property
+    def planet(self) -> str:
+        """Name of the period's lord (a planet, yogini or sign depending on the system)."""
+        return self.system.lord_names[self.lord_index]
+
+    @property
+    def start(self) -> datetime:
+        return jd_to_datetime(self.start_jd)
+
+    @property
+    def end(self) -> datetime:
+        return jd_to_datetime(self.end_jd)
+
+    def lineage(self) -> List[str]:
+        """Lords from the Mahadasha down to this period."""
+        lords = []
+        node = self
+        while node is not None:
+            lords.append(node.planet)
+            node = node.parent
+        return lords[::-1]
+
+    def to_dict(self) -> Dict:
+        return {
+            self.system.lord_key: self.planet,
+            "start_date": jd_to_date_string(self.start_jd),
+            "end_date": jd_to_date_string(self.end_jd)
+        }
+
+    def __repr__(self) -> str:
+        return f"DashaPeriod({DASHA_LEVEL_NAMES[self.level]}, {'/'.join(self.lineage())}, {self.start_jd:.4f}-{self.end_jd:.4f})"
+
+class DashaEngine(ABC):
+    """
+    Query-driven dasha engine shared by every system.
+
+    Nothing is materialized up front: the whole cycle is treated as a root period whose
+    children are the Mahadashas, and every query walks down from it, computing only the
+    children of the periods on its path. Looking up the active period at any depth is
+    therefore O(depth). The system's tables decide the sub-period lords and shares.
+    """
+    system: DashaSystem = VIMSHOTTARI
+
+    def __init__(self, cycle_start_jd: float, root_lords: Sequence[int], root_cumulative: Sequence[float]):
+        self.cycle_start_jd = cycle_start_jd
+        self.cycle_end_jd = cycle_start_jd + self.system.span_years * DASHA_YEAR_DAYS
+        self.root_lords = list(root_lords)
+        self.root_cumulative = list(root_cumulative)
+        self._templates = {}
+
+    @property
+    def max_level(self) -> int:
+        return self.system.max_level
+
+    def template(self, level: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Relative (boundaries, lords) of every period at `level`, as fractions of the cycle."""
+        if level not in self._templates:
+            if level == 0:
+                boundaries = np.array(self.root_cumulative, dtype=np.float64)
+                lords = np.array(self.root_lords, dtype=np.uint8)
+                boundaries.flags.writeable = False
+                lords.flags.writeable = False
+                self._templates[level] = boundaries, lords
+            else:
+                self._templates[level] = _expand_level(self.system, *self.template(level - 1))
+        return self._templates[level]
+
+    def boundaries(self, level: int) -> np.ndarray:
+        """Julian Days of every period boundary at `level`: one affine shift of the template."""
+        template, _ = self.template(level)
+        return self.cycle_start_jd + template * (self.cycle_end_jd - self.cycle_start_jd)
+
+    def lords(self, level: int) -> np.ndarray:
+        """Lord index of every period at `level`, in chronological order."""
+        return self.template(level)[1]
+
+    def _children(self, lords: List[int], cumulative: List[float], level: int, start_jd: float, end_jd: float,
+                  parent: Optional[DashaPeriod]) -> List[DashaPeriod]:
+        span = end_jd - start_jd
+        return [
+            DashaPeriod(lord, level, start_jd + span * cumulative[i], start_jd + span * cumulative[i + 1],
+                        parent, self.system)
+            for i, lord in enumerate(lords)
+        ]
+
+    def mahadashas(self) -> List[DashaPeriod]:
+        """The Mahadashas of the cycle, in order."""
+        return self._children(self.root_lords, self.root_cumulative, 0, self.cycle_start_jd, self.cycle_end_jd, None)
+
+    def children(self, period: DashaPeriod) -> List[DashaPeriod]:
+        """The sub-periods of `period` (empty below the system's deepest level)."""
+        if period.level >= self.max_level:
+            return []
+        return self._children(self.system.sub_lord_lists[period.lord_index],
+                              self.system.sub_cumulative_lists[period.lord_index],
+                              period.level + 1, period.start_jd, period.end_jd, period)
+
+    def active_at(self, when: Instant, level: int = MAX_DASHA_LEVEL) -> List[DashaPeriod]:
+        """
+        Periods active at `when`, from Mahadasha down to `level`.
+
+        Returns an empty list if `when` falls outside the cycle.
+        """
+        jd = _to_jd(when)
+        if not self.cycle_start_jd <= jd < self.cycle_end_jd:
+            return []
+
+        path = []
+        parent = None
+        lords, cumulative = self.root_lords, self.root_cumulative
+        start_jd, end_jd = self.cycle_start_jd, self.cycle_end_jd
+        for depth in range(min(level, self.max_level) + 1):
+            span = end_jd - start_jd
+            i = min(bisect_right(cumulative, (jd - start_jd) / span) - 1, len(lords) - 1)
+            lord_index = lords[i]
+            start_jd, end_jd = start_jd + span * cumulative[i], start_jd + span * cumulative[i + 1]
+            parent = DashaPeriod(lord_index, depth, start_jd, end_jd, parent, self.system)
+            path.append(parent)
+            lords, cumulative = self.system.sub_lord_lists[lord_index], self.system.sub_cumulative_lists[lord_index]
+        return path
+
+    def periods_between(self, start: Instant, end: Instant, level: int = 0) -> Iterator[DashaPeriod]:
+        """
+        Yield every period at `level` overlapping [start, end), in chronological order.
+
+        Only the branches that overlap the window are expanded, so the cost is
+        proportional to the number of periods returned plus the depth.
+        """
+        start_jd, end_jd = _to_jd(start), _to_jd(end)
+        level = min(level, self.max_level)
+
+        def walk(periods: List[DashaPeriod]) -> Iterator[DashaPeriod]:
+            for period in periods:
+                if period.end_jd <= start_jd or period.start_jd >= end_jd:
+                    continue
+                if period.level == level:
+                    yield period
+                else:
+                    yield from walk(self.children(period))
+
+        return walk(self.mahadashas())
+
+    def subtree(self, period: DashaPeriod, max_level: int) -> Dict:
+        """Serialize `period` and its descendants down to `max_level` as nested dicts."""
+        result = period.to_dict()
+        if period.level < max_level:
+            result[SUB_DASHA_KEYS[period.level]] = [self.subtree(child, max_level) for child in self.children(period)]
+        return result
+
+    def timeline(self, max_level: int) -> "DashaTimeline":
+        """Compact array-backed timeline for every level down to `max_level`."""
+        max_level = min(max_level, self.max_level)
+        return DashaTimeline(
+            [self.boundaries(level) for level in range(max_level + 1)],
+            [self.lords(level) for level in range(max_level + 1)],
+            self.system
+        )
+
+    def to_tree(self, max_level: int) -> List[Dict]:
+        """Materialize the nested dict structure down to `max_level` (legacy response format)."""
+        return self.timeline(max_level).to_tree()
+
+    @classmethod
+    @abstractmethod
+    def for_chart(cls, birth: Instant, kundali: Dict) -> "DashaEngine":
+        """Anchor the cycle on a calculated chart."""
+
+class NakshatraDasha(DashaEngine):
+    """
+    Dasha system anchored on the Moon's nakshatra at birth.
+
+    The cycle is the starting lord's sub-period layout scaled up to the whole cycle,
+    so every chart with the same starting lord shares one cached template per level.
+    """
+
+    def __init__(self, cycle_start_jd: float, starting_lord_index: int):
+        self.starting_lord_index = starting_lord_index
+        boundaries, lords = dasha_template(starting_lord_index, 0, self.system)
+        super().__init__(cycle_start_jd, lords.tolist(), boundaries.tolist())
+
+    def template(self, level: int) -> Tuple[np.ndarray, np.ndarray]:
+        return dasha_template(self.starting_lord_index, level, self.system)
+
+    @classmethod
+    def from_moon_longitude(cls, birth: Instant, moon_longitude: float) -> "NakshatraDasha":
+        """
+        Anchor the cycle on the Moon's nakshatra at birth.
+
+        Args:
+            birth: Birth instant (naive UTC datetime or Julian Day).
+            moon_longitude: Sidereal longitude of the Moon in degrees.
+        """
+        starting_lord_index, elapsed_years = cls.system.starting_lord(moon_longitude)
+        return cls(_to_jd(birth) - elapsed_years * DAYS_PER_YEAR, starting_lord_index)
+
+    @classmethod
+    def for_chart(cls, birth: Instant, kundali: Dict) -> "NakshatraDasha":
+        return cls.from_moon_longitude(birth, kundali["planets"]["Moon"]["longitude"])
+
+class VimshottariDasha(NakshatraDasha):
+    """Vimshottari dasha: nine planets over a 120-year cycle."""
+    system = VIMSHOTTARI
+
+class YoginiDasha(NakshatraDasha):
+    """Yogini dasha: eight yoginis over a 36-year cycle."""
+    system = YOGINI
+
+class AshtottariDasha(NakshatraDasha):
+    """Ashtottari dasha: eight planets over a 108-year cycle, each ruling a run of three or four nakshatras."""
+    system = ASHTOTTARI
+
+def _chara_dasha_lord_sign(sign: int, planet_signs: Dict[str, int]) -> int:
+    """
+    Sign of the lord that measures `sign`'s Chara dasha.
+
+    Scorpio and Aquarius have two lords: a lord placed in the sign itself yields to
+    the other one, otherwise the lord joined by more planets is taken.
+    """
+    lord = SIGN_LORDS[sign]
+    co_lord = SIGN_CO_LORDS.get(sign)
+    if co_lord is None:
+        return planet_signs[lord]
+    lord_sign, co_lord_sign = planet_signs[lord], planet_signs[co_lord]
+    if lord_sign == sign and co_lord_sign != sign:
+        return co_lord_sign
+    if co_lord_sign == sign and lord_sign != sign:
+        return lord_sign
+    occupants = list(planet_signs.values())
+    return co_lord_sign if occupants.count(co_lord_sign) > occupants.count(lord_sign) else lord_sign
+
+def chara_dasha_years(lagna_sign: int, planet_signs: Dict[str, int]) -> List[Tuple[int, int]]:
+    """
+    Jaimini Chara dasha Mahadashas for both cycles, as (lord index, years) pairs.
+
+    The sequence starts from the Lagna and runs forward when the 9th sign from it is
+    counted forward (savya), backward otherwise. Each sign lasts as many years as its
+    lord is signs away from it (counted in the sign's own direction), 12 if the lord is
+    in the sign; the second cycle gives each sign the remainder of 12 years.
+    """
+    forward = (lagna_sign + 8) % 12 in _SAVYA_SIGNS
+    sequence = [(lagna_sign + i) % 12 if forward else (lagna_sign - i) % 12 for i in range(12)]
+    first_cycle = []
+    for sign in sequence:
+        lord_sign = _chara_dasha_lord_sign(sign, planet_signs)
+        years = (lord_sign - sign) % 12 if sign in _SAVYA_SIGNS else (sign - lord_sign) % 12
+        first_cycle.append(years or 12)
+
+    direction = 0 if forward else 12
+    periods = [(sign + direction, years) for sign, years in zip(sequence, first_cycle)]
+    periods += [(sign + direction, 12 - years) for sign, years in zip(sequence, first_cycle) if years < 12]
+    return periods
+
+class CharaDasha(DashaEngine):
+    """
+    Jaimini Chara (sign) dasha.
+
+    The Mahadasha layout depends on the whole chart rather than on one nakshatra, so
+    it is computed per chart; below it the sub-period tables work like any other system.
+    The cycle starts at birth.
+    """
+    system = CHARA
+
+    @classmethod
+    def from_signs(cls, birth: Instant, lagna_sign: int, planet_signs: Dict[str, int]) -> "CharaDasha":
+        """
+        Args:
+            birth: Birth instant (naive UTC datetime or Julian Day).
+            lagna_sign: Sign index (0 = Aries) of the ascendant.
+            planet_signs: Sign index of each of the nine grahas, keyed by name.
+        """
+        periods = chara_dasha_years(lagna_sign, planet_signs)
+        cumulative = np.cumsum([0] + [years for _, years in periods]) / CHARA_CYCLE_YEARS
+        return cls(_to_jd(birth), [lord for lord, _ in periods], cumulative.tolist())
+
+    @classmethod
+    def for_chart(cls, birth: Instant, kundali: Dict) -> "CharaDasha":
+        planet_signs = {
+            name: int(kundali["planets"][name]["longitude"] % 360 // 30)
+            for name in VIMSHOTTARI_PLANETS
+        }
+        return cls.from_signs(birth, int(kundali["ascendant"]["longitude"] % 360 // 30), planet_signs)
+
+DASHA_ENGINES = {engine.system.name: engine for engine in (VimshottariDasha, YoginiDasha, AshtottariDasha, CharaDasha)}
+
+class DashaTimeline:
+    """
+    Array-backed dasha timeline.
+
+    Each level is one contiguous float64 array of boundary Julian Days plus one uint8
+    array of lord indices, so even a Deha-level timeline is only a few MB. Lookups are
+    binary searches over the boundaries, and date strings are produced only for the
+    rows that are actually serialized.
+    """
+
+    def __init__(self, boundaries: List[np.ndarray], lords: List[np.ndarray], system: DashaSystem = VIMSHOTTARI):
+        self.boundaries = boundaries
+        self.lords = lords
+        self.system = system
+
+    @property
+    def max_level(self) -> int:
+        return len(self.lords) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.boundaries) + sum(l.nbytes for l in self.lords)
+
+    def index_at(self, when: Instant, level: int) -> int:
+        """Index of the period active at `when` on `level`, or -1 outside the timeline."""
+        boundaries = self.boundaries[level]
+        index = int(np.searchsorted(boundaries, _to_jd(when), side="right")) - 1
+        return index if 0 <= index < len(boundaries) - 1 else -1
+
+    def row(self, level: int, index: int) -> Dict:
+        """Serialize a single period."""
+        start_date, end_date = _format_jd_dates(self.boundaries[level][index:index + 2])
+        return {
+            self.system.lord_key: self.system.lord_names[self.lords[level][index]],
+            "start_date": start_date,
+            "end_date": end_date
+        }
+
+    def active_at(self, when: Instant) -> List[Dict]:
+        """Serialized periods active at `when`, one per level (empty outside the timeline)."""
+        rows = []
+        for level in range(self.max_level + 1):
+            index = self.index_at(when, level)
+            if index < 0:
+                return []
+            rows.append(self.row(level, index))
+        return rows
+
+    def active_lords(self, jds: np.ndarray) -> np.ndarray:
+        """
+        Lord indices active at each Julian Day in `jds`, shape (len(jds), max_level + 1).
+
+        Instants outside the timeline get 255.
+        """
+        jds = np.asarray(jds, dtype=np.float64)
+        result = np.full((jds.size, self.max_level + 1), 255, dtype=np.uint8)
+        for level, (boundaries, lords) in enumerate(zip(self.boundaries, self.lords)):
+            index = np.searchsorted(boundaries, jds, side="right") - 1
+            inside = (index >= 0) & (index < len(lords))
+            result[inside, level] = lords[index[inside]]
+        return result
+
+    def rows(self, level: int, start: Optional[Instant] = None, end: Optional[Instant] = None) -> List[Dict]:
+        """Serialize the periods on `level` that overlap [start, end)."""
+        boundaries, lords = self.boundaries[level], self.lords[level]
+        first = 0 if start is None else max(int(np.searchsorted(boundaries, _to_jd(start), side="right")) - 1, 0)
+        last = len(lords) if end is None else min(int(np.searchsorted(boundaries, _to_jd(end), side="left")), len(lords))
+        if first >= last:
+            return []
+        dates = _format_jd_dates(boundaries[first:last + 1])
+        names, key = self.system.lord_names, self.system.lord_key
+        return [
+            {key: names[lord], "start_date": dates[i], "end_date": dates[i + 1]}
+            for i, lord in enumerate(lords[first:last].tolist())
+        ]
+
+    def to_tree(self) -> List[Dict]:
+        """
+        Nested dict structure (legacy response format).
+
+        Built bottom-up: every boundary of a level is also a boundary of the deepest
+        level, so dates are formatted once per boundary there.
+        """
+        max_level = self.max_level
+        names, key, fanout = self.system.lord_names, self.system.lord_key, self.system.sub_count
+        dates = _format_jd_dates(self.boundaries[max_level])
+        nodes = None
+        for level in range(max_level, -1, -1):
+            step = fanout ** (max_level - level)
+            level_nodes = [
+                {
+                    key: names[lord],
+                    "start_date": dates[i * step],
+                    "end_date": dates[(i + 1) * step]
+                }
+                for i, lord in enumerate(self.lords[level].tolist())
+            ]
+            if nodes is not None:
+                sub_key = SUB_DASHA_KEYS[level]
+                for i, node in enumerate(level_nodes):
+                    node[sub_key] = nodes[i * fanout:(i + 1) * fanout]
+            nodes = level_nodes
+        return nodes
+
+    def to_columns(self) -> Dict:
+        """
+        Columnar form of the tree (the binary response format, see services/encoding.py),
+        straight from the arrays: lord indices as they are and boundaries as days since the
+        first one, taken from the deepest level like to_tree() so both agree on every date.
+        """
+        max_level = self.max_level
+        fanout = self.system.sub_count
+        days = np.floor(self.boundaries[max_level] - JD_ORDINAL_OFFSET).astype(np.int64)
+        epoch = int(days[0])
+        days -= epoch
+        return {
+            "encoding": "columnar",
+            "lord_key": self.system.lord_key,
+            "lords": list(self.system.lord_names),
+            "epoch": date.fromordinal(epoch).isoformat(),
+            "fanout": fanout if max_level > 0 else 0,
+            "levels": [{"lords": self.lords[level].tolist(), "boundaries": days[::fanout ** (max_level - level)].tolist()}
+                       for level in range(max_level + 1)],
+        }
+
+def vimshottari_dasha_for(birth_data: BirthData, moon_data: Dict) -> VimshottariDasha:
+    """Build the dasha engine for a chart, anchored on the birth date (midnight UTC)."""
+    birth_date = datetime(birth_data.year, birth_data.month, birth_data.day)
+    return VimshottariDasha.from_moon_longitude(birth_date, moon_data["longitude"])
+
+def dasha_for(birth_data: BirthData, kundali: Dict, system: str = "vimshottari") -> DashaEngine:
+    """
+    Build the engine of any supported dasha system for a chart.
+
+    Nakshatra systems are anchored on the birth date (midnight UTC) like
+    `vimshottari_dasha_for`; only the Moon entry of `kundali` is required for them.
+    """
+    if system not in DASHA_ENGINES:
+        raise ValueError(f"Unknown dasha system '{system}'. Choose from: {', '.join(DASHA_ENGINES)}")
+    birth_date = datetime(birth_data.year, birth_data.month, birth_data.day)
+    return DASHA_ENGINES[system].for_chart(birth_date, kundali)
+
+def calculate_vimshottari_dasha(birth_data: BirthData, moon_data: Dict, max_level: int = 2,
+                                columns: bool = False) -> Union[list, Dict]:
+    """
+    Calculate the Vimshottari Dasha periods based on the Moon's position at birth.
+
+    Args:
+        birth_data (BirthData): Birth details including date, time, and location.
+        moon_data (Dict): Moon's position data including longitude.
+        max_level (int, optional): Maximum level of sub-dashas to calculate.
+                                  0 = Only Mahadasha
+                                  1 = Mahadasha + Antardasha
+                                  2 = Mahadasha + Antardasha + Pratyantar
+                                  3 = Adding Sookshma
+                                  4 = Adding Prana
+                                  5 = Adding Deha (full calculation)
+                                  Defaults to 2 (up to Pratyantar).
+        columns (bool, optional): Return the periods in columnar form (DashaTimeline.to_columns)
+                                  instead of the tree. Defaults to False.
+
+    Returns:
+        list: A hierarchical list of dasha periods, or with `columns` their columnar dict.
+    """
+    try:
+        # Ensure max_level is valid
+        if max_level < 0 or max_level > MAX_DASHA_LEVEL:
+            max_level = 2  # Default to Pratyantar level if invalid
+
+        timeline = vimshottari_dasha_for(birth_data, moon_data).timeline(max_level)
+        return timeline.to_columns() if columns else timeline.to_tree()
+    except KeyError as e:
+        raise ValueError(f"Missing required moon data: {str(e)}")
+    except ValueError as e:
+        raise ValueError(f"Dasha calculation failed: {str(e)}")
+    except TypeError as e:
+        raise ValueError(f"Invalid data type in dasha calculation: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"Unexpected error in dasha calculation: {str(e)}")
+
+def calculate_dasha_window(birth_data: BirthData, moon_data: Dict, start: datetime, end: datetime,
+                           level: int = 2, max_periods: int = MAX_DASHA_WINDOW_PERIODS,
+                           system: str = "vimshottari", kundali: Optional[Dict] = None) -> List[Dict]:
+    """
+    Calculate only the dasha periods at `level` that overlap the window [start, end).
+
+    Only the branches of the dasha tree that overlap the window are expanded, so the
+    cost is proportional to the number of periods returned rather than 9**level.
+
+    Args:
+        birth_data (BirthData): UTC birth details.
+        moon_data (Dict): Moon's position data including longitude.
+        start (datetime): Window start (naive UTC).
+        end (datetime): Window end (naive UTC).
+        level (int): Dasha level to return (0 = Mahadasha ... 5 = Deha).
+        max_periods (int): Upper bound on the number of periods returned.
+        system (str): Dasha system name (vimshottari, yogini, ashtottari or chara).
+        kundali (Optional[Dict]): Full chart, required by sign-based systems (chara).
+
+    Returns:
+        list: Flat, chronological list of periods with their level and lineage.
+    """
+    if start >= end:
+        raise ValueError("Window start must be before window end")
+    try:
+        if kundali is None:
+            if system == "chara":
+                raise ValueError("Chara dasha needs the full chart, not only the Moon")
+            kundali = {"planets": {"Moon": moon_data}}
+        dasha = dasha_for(birth_data, kundali, system)
+        if not 0 <= level <= dasha.max_level:
+            raise ValueError(f"Dasha level must be between 0 and {dasha.max_level}")
+        periods = list(islice(dasha.periods_between(start, end, level), max_periods + 1))
+    except KeyError as e:
+        raise ValueError(f"Missing required chart data: {str(e)}")
+    if len(periods) > max_periods:
+        raise ValueError(f"Window contains more than {max_periods} periods; narrow it or lower the level")
+
+    rows = []
+    for period in periods:
+        row = period.to_dict()
+        row["level"] = DASHA_LEVEL_NAMES[period.level]
+        row["lineage"] = period.lineage()
+        rows.append(row)
+    return rows
+
+def calculate_current_dasha_batch(moon_longitudes: np.ndarray, birth_jds: np.ndarray,
+                                  eval_jd: Union[float, np.ndarray], max_level: int = 2,
+                                  system: str = "vimshottari") -> np.ndarray:
+    """
+    Active dasha lords for many charts at once, in a single vectorized pass.
+
+    Uses the same conventions as `calculate_vimshottari_dasha` (timeline anchored on the
+    UTC birth date), so results agree with the per-chart API.
+
+    Args:
+        moon_longitudes (np.ndarray): Sidereal Moon longitude at birth for each chart, shape (N,).
+        birth_jds (np.ndarray): UTC birth instant of each chart as a Julian Day, shape (N,).
+        eval_jd (float | np.ndarray): Julian Day to evaluate at (scalar or per chart).
+        max_level (int): Deepest level to resolve (0 = Mahadasha ... 5 = Deha).
+        system (str): Nakshatra-based dasha system (vimshottari, yogini or ashtottari).
+
+    Returns:
+        np.ndarray: uint8 lord indices into the system's lord names (VIMSHOTTARI_PLANETS
+                    by default), shape (N, max_level + 1). Charts whose cycle does not
+                    contain eval_jd get 255.
+    """
+    dasha_system = DASHA_SYSTEMS.get(system)
+    if dasha_system is None or dasha_system.nakshatra_lords is None:
+        raise ValueError(f"Batch lookup supports nakshatra-based dasha systems only, not '{system}'")
+    if not 0 <= max_level <= dasha_system.max_level:
+        raise ValueError(f"Dasha level must be between 0 and {dasha_system.max_level}")
+    birth_jds = np.asarray(birth_jds, dtype=np.float64)
+    lords, elapsed_years = dasha_system.starting_lords(moon_longitudes)
+
+    # Midnight UTC of the birth date, minus the elapsed part of the first Mahadasha
+    cycle_start = np.floor(birth_jds - 0.5) + 0.5 - elapsed_years * DAYS_PER_YEAR
+    position = (eval_jd - cycle_start) / (dasha_system.span_years * DASHA_YEAR_DAYS)
+    outside = (position < 0) | (position >= 1)
+    if dasha_system.rounds > 1:
+        # Position within the current round of the cycle
+        position = position * dasha_system.rounds
+        position = position - np.floor(position)
+
+    result = np.empty((lords.size, max_level + 1), dtype=np.uint8)
+    for level in range(max_level + 1):
+        # Which sub-period of the current lord holds `position`
+        cumulative = dasha_system.sub_cumulative[lords]
+        offset = np.zeros(lords.shape, dtype=np.intp)
+        for k in range(1, dasha_system.sub_count):
+            offset += position >= cumulative[:, k]
+        rows = np.arange(lords.size)
+        lower = cumulative[rows, offset]
+        upper = cumulative[rows, offset + 1]
+        position = (position - lower) / (upper - lower)
+        lords = dasha_system.sub_lords[lords, offset]
+        result[:, level] = lords
+    result[outside] = 255
+    return result
+
+# For backward compatibility
+def calculate_sub_dasha_periods(start_date, duration_years, planet_index, level=0, max_level=2):
+    """
+    Helper function to recursively calculate sub-dasha periods based on the level.
+    Maintained for backward compatibility.
+
+    Args:
+        start_date (datetime): Start date of the parent dasha
+        duration_years (float): Duration of the parent dasha in years
+        planet_index (int): Index of the starting planet for this dasha
+        level (int): Current dasha level (0=Mahadasha, 1=Antardasha, etc.)
+        max_level (int): Maximum dasha level to calculate (5 would include Deha Dasha)
+
+    Returns:
+        dict: Nested dictionary of dasha periods
+    """
+    if level > max_level:
+        return None
+
+    start_jd = _to_jd(start_date)
+    period = DashaPeriod(planet_index % 9, level, start_jd, start_jd + duration_years * DASHA_YEAR_DAYS)
+    return VimshottariDasha(start_jd, planet_index % 9).subtree(period, max_level)
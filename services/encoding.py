@@ -0,0 +1,150 @@
+"""
+Compact binary encodings of chart responses, selected by the Accept header.
+
+Clients sending `Accept: application/msgpack` (or application/cbor) get the response in that
+encoding instead of JSON. The dasha tree is most of a chart and repeats the same keys in every
+period, so binary responses send it columnar. For each level there is the lord of every period,
+as an index into `lords`, and the period boundaries, as days since `epoch`. Period i of a level
+runs from boundaries[i] to boundaries[i + 1]. Its sub-periods are periods i * fanout to
+(i + 1) * fanout - 1 of the next level. expand_dasha() rebuilds the nested tree.
+
+A chart computed for a binary response has its dasha in this form already (generate_chart's
+dasha_columns, from DashaTimeline.to_columns()); columnar_dasha() converts the trees of saved
+charts.
+"""
+from datetime import date
+from typing import Any, Dict, List, Optional
+import cbor2
+import msgpack
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from services.dasha import SUB_DASHA_KEYS
+
+BINARY_ENCODERS = {
+    "application/msgpack": lambda content: msgpack.packb(content, use_bin_type=True),
+    "application/x-msgpack": lambda content: msgpack.packb(content, use_bin_type=True),
+    "application/cbor": cbor2.dumps,
+}
+# Response keys holding a nested dasha tree
+DASHA_TREE_KEYS = ("vimshottari_dasha",)
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    The binary media type to answer with, or None for JSON.
+
+    A binary type must be named explicitly and rank above any explicit application/json;
+    wildcards and ties keep the JSON default.
+    """
+    if not accept:
+        return None
+    best, best_q, json_q = None, 0.0, 0.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        media_type = media_type.lower()
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in BINARY_ENCODERS and q > best_q:
+            best, best_q = media_type, q
+        elif media_type == "application/json":
+            json_q = max(json_q, q)
+    return best if best is not None and best_q > json_q else None
+
+def columnar_dasha(tree: List[Dict]) -> Optional[Dict]:
+    """
+    Columnar form of a nested dasha tree, or None if the tree is not one this format can hold
+    (periods that are not contiguous or an uneven number of sub-periods).
+    """
+    if not tree:
+        return None
+    lord_key = next((key for key, value in tree[0].items()
+                     if key not in ("start_date", "end_date") and not isinstance(value, list)), None)
+    if lord_key is None:
+        return None
+    epoch = date.fromisoformat(tree[0]["start_date"]).toordinal()
+    days: Dict[str, int] = {}
+
+    def day(label: str) -> int:
+        offset = days.get(label)
+        if offset is None:
+            offset = days[label] = date.fromisoformat(label).toordinal() - epoch
+        return offset
+
+    lords: Dict[str, int] = {}
+    levels, nodes, fanout = [], tree, None
+    for level in range(len(SUB_DASHA_KEYS) + 1):
+        boundaries = [day(node["start_date"]) for node in nodes] + [day(nodes[-1]["end_date"])]
+        if any(day(node["end_date"]) != end for node, end in zip(nodes, boundaries[1:])):
+            return None
+        levels.append({"lords": [lords.setdefault(node[lord_key], len(lords)) for node in nodes],
+                       "boundaries": boundaries})
+        if level == len(SUB_DASHA_KEYS) or SUB_DASHA_KEYS[level] not in nodes[0]:
+            break
+        children = [node.get(SUB_DASHA_KEYS[level]) for node in nodes]
+        counts = {len(sub_periods) if sub_periods is not None else -1 for sub_periods in children}
+        if len(counts) != 1 or (fanout is not None and counts != {fanout}) or counts == {-1}:
+            return None
+        fanout = counts.pop()
+        if fanout == 0:
+            break
+        nodes = [child for sub_periods in children for child in sub_periods]
+    return {
+        "encoding": "columnar",
+        "lord_key": lord_key,
+        "lords": list(lords),
+        "epoch": date.fromordinal(epoch).isoformat(),
+        "fanout": fanout or 0,
+        "levels": levels,
+    }
+
+def expand_dasha(columns: Dict) -> List[Dict]:
+    """The nested dasha tree a columnar_dasha() result was made from."""
+    epoch = date.fromisoformat(columns["epoch"]).toordinal()
+    names, key, fanout = columns["lords"], columns["lord_key"], columns["fanout"]
+    labels: Dict[int, str] = {}
+
+    def label(day: int) -> str:
+        text = labels.get(day)
+        if text is None:
+            text = labels[day] = date.fromordinal(epoch + day).isoformat()
+        return text
+
+    nodes = None
+    for level in range(len(columns["levels"]) - 1, -1, -1):
+        boundaries = columns["levels"][level]["boundaries"]
+        level_nodes = [{key: names[lord], "start_date": label(boundaries[i]), "end_date": label(boundaries[i + 1])}
+                       for i, lord in enumerate(columns["levels"][level]["lords"])]
+        if nodes is not None:
+            for i, node in enumerate(level_nodes):
+                node[SUB_DASHA_KEYS[level]] = nodes[i * fanout:(i + 1) * fanout]
+        nodes = level_nodes
+    return nodes
+
+def _columnar(content: Any) -> Any:
+    if isinstance(content, dict):
+        return {key: ((columnar_dasha(value) or value) if isinstance(value, list) else value) if key in DASHA_TREE_KEYS
+                else _columnar(value) for key, value in content.items()}
+    if isinstance(content, list):
+        return [_columnar(value) for value in content]
+    return content
+
+def encode_binary(content: Any, media_type: str) -> bytes:
+    """`content` in a binary media type, with its dasha trees columnar."""
+    return BINARY_ENCODERS[media_type](_columnar(content))
+
+def chart_response(content: Any, accept: Optional[str]) -> Response:
+    """
+    Response in the encoding the client asked for: JSON (orjson, without response_model
+    validation) by default, MessagePack or CBOR when preferred.
+    """
+    media_type = negotiate(accept)
+    if media_type is None:
+        response = ORJSONResponse(content)
+    else:
+        response = Response(encode_binary(content, media_type), media_type=media_type)
+    response.headers["Vary"] = "Accept"
+    return response
@@ -0,0 +1,246 @@
+"""
+Precomputed Chebyshev ephemeris.
+
+Tropical longitudes of the chart bodies are fitted once, per body, with fixed-length
+Chebyshev segments and written to a single .npy file, together with every supported
+ayanamsa. At runtime the file is memory-mapped read-only, so every worker process shares
+the same physical pages, and positions are evaluated with NumPy alone: no Swiss Ephemeris
+call, no file seek and no global sidereal mode. Speeds come from the derivative of the
+same polynomials. Instants outside the fitted range fall back to `swe.calc_ut`.
+
+File layout (float64, shape (rows, degree + 1)):
+    row 0:            [format version, start JD, end JD, degree, body count, ayanamsa count, 0...]
+    next body count:  [swe body id, segment days, first coefficient row, segment count, 0...]
+    next ayanamsa count: [swe sidereal mode, segment days, first coefficient row, segment count, 0...]
+    remaining rows:   one row of Chebyshev coefficients per segment, series back to back
+"""
+import os
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+import numpy as np
+from compatibility import swe, SWE_LOCK
+from constants import AYANAMSA_TYPES
+from utils import datetime_to_jd, get_sid_mode
+
+swe.set_ephe_path('./ephe')
+
+CACHE_FORMAT_VERSION = 2
+CHEBYSHEV_DEGREE = 13
+DEFAULT_CACHE_START = datetime(1800, 1, 1)
+DEFAULT_CACHE_END = datetime(2200, 1, 1)
+EPHEMERIS_CACHE_PATH = os.getenv("EPHEMERIS_CACHE_PATH", "./ephe/chebyshev_cache.npy")
+
+# Segment length in days per swe body id, chosen so the fit error stays well below 0.1"
+SEGMENT_DAYS = {0: 16, 1: 4, 2: 8, 3: 16, 4: 8, 5: 8, 6: 8, 10: 16}
+# True Chitrapaksha follows Spica's apparent position, nutation included; the others are smooth
+AYANAMSA_SEGMENT_DAYS = {swe.SIDM_TRUE_CITRA: 16}
+DEFAULT_AYANAMSA_SEGMENT_DAYS = 366
+
+def body_flags(pid: int) -> int:
+    """Swiss Ephemeris flags used for a chart body."""
+    flags = swe.FLG_SWIEPH | swe.FLG_SPEED
+    if pid == 10:  # True node for Rahu
+        flags |= swe.FLG_TRUEPOS
+    return flags
+
+def _chebyshev_nodes(degree: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Chebyshev nodes on [-1, 1] and the matrix turning samples there into coefficients."""
+    count = degree + 1
+    angles = np.pi * (np.arange(count) + 0.5) / count
+    transform = np.cos(np.outer(np.arange(count), angles)) * 2 / count
+    transform[0] /= 2
+    return np.cos(angles), transform
+
+def fit_series(sample: Callable[[float], float], start_jd: float, end_jd: float, segment_days: float,
+               degree: int = CHEBYSHEV_DEGREE) -> np.ndarray:
+    """
+    Fit an angle-valued function of JD over [start_jd, end_jd).
+
+    Returns:
+        np.ndarray: Coefficients of shape (segments, degree + 1); segment k covers
+                    [start_jd + k * segment_days, start_jd + (k + 1) * segment_days).
+    """
+    nodes, transform = _chebyshev_nodes(degree)
+    segments = int(np.ceil((end_jd - start_jd) / segment_days))
+    sample_jds = start_jd + segment_days * (np.arange(segments)[:, None] + (nodes + 1) / 2)
+    samples = np.array([sample(jd) for jd in sample_jds.ravel().tolist()])
+    # Longitudes wrap at 360°; the polynomials need them continuous within a segment
+    samples = np.unwrap(samples.reshape(segments, degree + 1), period=360, axis=1)
+    return samples @ transform.T
+
+def fit_body(pid: int, start_jd: float, end_jd: float, segment_days: float,
+             degree: int = CHEBYSHEV_DEGREE) -> np.ndarray:
+    """Fit one body's tropical longitude over [start_jd, end_jd)."""
+    flags = body_flags(pid)
+    return fit_series(lambda jd: swe.calc_ut(jd, pid, flags)[0][0], start_jd, end_jd, segment_days, degree)
+
+def fit_ayanamsa(sid_mode: int, start_jd: float, end_jd: float, segment_days: float,
+                 degree: int = CHEBYSHEV_DEGREE) -> np.ndarray:
+    """Fit one sidereal mode's ayanamsa over [start_jd, end_jd)."""
+    with SWE_LOCK:
+        swe.set_sid_mode(sid_mode, 0, 0)
+        return fit_series(swe.get_ayanamsa_ut, start_jd, end_jd, segment_days, degree)
+
+def build_cache(path: str, start: datetime = DEFAULT_CACHE_START, end: datetime = DEFAULT_CACHE_END,
+                bodies: Sequence[int] = tuple(SEGMENT_DAYS), degree: int = CHEBYSHEV_DEGREE) -> str:
+    """Fit every body and ayanamsa over [start, end) and write the coefficient file to `path`."""
+    start_jd, end_jd = datetime_to_jd(start), datetime_to_jd(end)
+    if start_jd >= end_jd:
+        raise ValueError("Cache start must be before cache end")
+
+    sid_modes = sorted(set(AYANAMSA_TYPES.values()))
+    header = np.zeros((1 + len(bodies) + len(sid_modes), degree + 1), dtype=np.float64)
+    header[0, :6] = [CACHE_FORMAT_VERSION, start_jd, end_jd, degree, len(bodies), len(sid_modes)]
+    series = [(pid, SEGMENT_DAYS[pid], fit_body) for pid in bodies]
+    series += [(mode, AYANAMSA_SEGMENT_DAYS.get(mode, DEFAULT_AYANAMSA_SEGMENT_DAYS), fit_ayanamsa) for mode in sid_modes]
+    coefficients = []
+    first_row = len(header)
+    for i, (key, segment_days, fit) in enumerate(series):
+        series_coefficients = fit(key, start_jd, end_jd, segment_days, degree)
+        header[1 + i, :4] = [key, segment_days, first_row, len(series_coefficients)]
+        coefficients.append(series_coefficients)
+        first_row += len(series_coefficients)
+
+    # Write to a temporary file first so running workers never map a half-written cache
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.concatenate([header] + coefficients))
+    os.replace(tmp_path, path)
+    return path
+
+class ChebyshevEphemeris:
+    """Evaluator over a memory-mapped coefficient file."""
+
+    def __init__(self, table: np.ndarray):
+        version = int(table[0, 0])
+        if version != CACHE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported ephemeris cache version {version}")
+        _, start_jd, end_jd, degree, body_count, ayanamsa_count = table[0, :6]
+        self.table = table
+        self.start_jd = float(start_jd)
+        self.end_jd = float(end_jd)
+        self.degree = int(degree)
+        body_count, ayanamsa_count = int(body_count), int(ayanamsa_count)
+        self.bodies = self._index(table[1:1 + body_count])
+        self.ayanamsas = self._index(table[1 + body_count:1 + body_count + ayanamsa_count])
+
+    @staticmethod
+    def _index(rows: np.ndarray) -> Dict[int, Tuple[float, int, int]]:
+        """Series key (swe body id or sidereal mode) -> (segment days, first row, segment count)."""
+        return {
+            int(key): (float(segment_days), int(first_row), int(segments))
+            for key, segment_days, first_row, segments in rows[:, :4]
+        }
+
+    @classmethod
+    def load(cls, path: str) -> "ChebyshevEphemeris":
+        """Memory-map a cache file read-only; pages are shared between processes."""
+        return cls(np.load(path, mmap_mode="r"))
+
+    def covers(self, jds: np.ndarray) -> np.ndarray:
+        """Mask of the instants inside the fitted range."""
+        return (jds >= self.start_jd) & (jds < self.end_jd)
+
+    def evaluate(self, pid: int, jds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tropical longitude (degrees) and speed (degrees/day) of one body.
+
+        All of `jds` must lie inside the fitted range (see `covers`).
+        """
+        longitude, derivative = self._series(self.bodies[pid], jds)
+        return longitude % 360, derivative
+
+    def ayanamsa(self, sid_mode: int, jds: np.ndarray) -> np.ndarray:
+        """Ayanamsa (degrees) of a sidereal mode; `jds` must lie inside the fitted range."""
+        return self._series(self.ayanamsas[sid_mode], jds)[0]
+
+    def _series(self, entry: Tuple[float, int, int], jds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Value and derivative (per day) of one fitted series."""
+        segment_days, first_row, segments = entry
+        position = (jds - self.start_jd) / segment_days
+        segment = np.minimum(position.astype(np.int64), segments - 1)
+        x = 2 * (position - segment) - 1
+        coefficients = self.table[first_row + segment]
+
+        # T_k(x) and its derivative k * U_{k-1}(x), built up by the usual recurrences
+        t_prev, t_curr = np.ones_like(x), x
+        u_prev, u_curr = np.zeros_like(x), np.ones_like(x)
+        value = coefficients[:, 0] + coefficients[:, 1] * x
+        derivative = coefficients[:, 1].copy()
+        for k in range(2, self.degree + 1):
+            t_prev, t_curr = t_curr, 2 * x * t_curr - t_prev
+            u_prev, u_curr = u_curr, 2 * x * u_curr - u_prev
+            value += coefficients[:, k] * t_curr
+            derivative += k * coefficients[:, k] * u_curr
+        return value, derivative * 2 / segment_days
+
+_cache: Optional[ChebyshevEphemeris] = None
+_cache_loaded = False
+
+def get_ephemeris_cache() -> Optional[ChebyshevEphemeris]:
+    """The process-wide cache, mapped on first use; None when no cache file has been built."""
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        _cache_loaded = True
+        if os.path.exists(EPHEMERIS_CACHE_PATH):
+            try:
+                _cache = ChebyshevEphemeris.load(EPHEMERIS_CACHE_PATH)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable ephemeris cache {EPHEMERIS_CACHE_PATH}: {str(e)}")
+    return _cache
+
+def tropical_positions(pids: Sequence[int], jds: np.ndarray,
+                       cache: Optional[ChebyshevEphemeris] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tropical longitude and speed of each body in `pids` at every instant, shape (len(jds), len(pids)).
+
+    Uses the Chebyshev cache where it covers the instant and `swe.calc_ut` elsewhere.
+    """
+    if cache is None:
+        cache = get_ephemeris_cache()
+    longitudes = np.empty((jds.size, len(pids)), dtype=np.float64)
+    speeds = np.empty_like(longitudes)
+    covered = cache.covers(jds) if cache is not None else np.zeros(jds.shape, dtype=bool)
+    for column, pid in enumerate(pids):
+        if cache is not None and pid in cache.bodies and covered.any():
+            longitudes[covered, column], speeds[covered, column] = cache.evaluate(pid, jds[covered])
+            fallback = np.flatnonzero(~covered)
+        else:
+            fallback = np.arange(jds.size)
+        flags = body_flags(pid)
+        for row in fallback.tolist():
+            position = swe.calc_ut(float(jds[row]), pid, flags)[0]
+            longitudes[row, column] = position[0]
+            speeds[row, column] = position[3]
+    return longitudes, speeds
+
+def ayanamsa_values(jds: np.ndarray, ayanamsa_type: Optional[str],
+                    cache: Optional[ChebyshevEphemeris] = None) -> np.ndarray:
+    """
+    Ayanamsa at every instant in `jds` for an ayanamsa type (True Chitrapaksha by default).
+
+    Inside the cached range this is a pure lookup that never touches the global sidereal
+    mode, so concurrent requests with different ayanamsas cannot interfere. Elsewhere it
+    falls back to Swiss Ephemeris while holding SWE_LOCK.
+    """
+    sid_mode = get_sid_mode(ayanamsa_type)
+    if cache is None:
+        cache = get_ephemeris_cache()
+    jds = np.asarray(jds, dtype=np.float64)
+    values = np.empty(jds.shape, dtype=np.float64)
+    covered = np.zeros(jds.shape, dtype=bool)
+    if cache is not None and sid_mode in cache.ayanamsas:
+        covered = cache.covers(jds)
+        if covered.any():
+            values[covered] = cache.ayanamsa(sid_mode, jds[covered])
+    fallback = np.flatnonzero(~covered)
+    if fallback.size:
+        with SWE_LOCK:
+            swe.set_sid_mode(sid_mode, 0, 0)
+            for i in fallback.tolist():
+                values.flat[i] = swe.get_ayanamsa_ut(float(jds.flat[i]))
+    return values
+
+def ayanamsa_value(jd: float, ayanamsa_type: Optional[str]) -> float:
+    """Scalar `ayanamsa_values`."""
+    return float(ayanamsa_values(np.array([jd]), ayanamsa_type)[0])
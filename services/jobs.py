@@ -0,0 +1,486 @@
+"""
+Bulk chart import jobs.
+
+An upload (NDJSON or CSV, one birth record per row) is parsed as it streams in and split into
+chunks of JOB_CHUNK_ROWS rows, which are pushed to a queue straight away. Consumers pop
+chunks, compute them in the chart worker pool and commit each chunk's charts in one INSERT.
+Progress, throughput and per-row errors are kept with the job in the same store.
+
+Two interchangeable stores implement the queue: Redis (the default, shared by every app
+instance) and SQLite, for local runs and tests. Select one with IMPORT_QUEUE_URL: "redis"
+or "sqlite:///path/to/jobs.db".
+
+A popped chunk is held for its consumer (a processing list per consumer, in Redis) until its
+outcome is recorded. A consumer that fails mid-chunk takes the same chunk up again; one that
+dies leaves its heartbeat to expire, and the next consumer to start puts the chunk back on
+the queue. A chunk is thus processed at least once: charts are deduplicated per user when
+saved, but the counters of a chunk processed twice count its rows twice.
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import redis
+from fastapi import HTTPException
+from services.workers import RETRY_AFTER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+IMPORT_QUEUE_URL = os.getenv("IMPORT_QUEUE_URL", "redis")
+JOB_CHUNK_ROWS = int(os.getenv("JOB_CHUNK_ROWS", "200"))
+MAX_JOB_ERRORS = 1000  # per-row errors kept per job; the count covers all of them
+CONSUMER_TTL = 60  # seconds a consumer's heartbeat lasts; it is refreshed every third of that
+MAX_BACKOFF_SECONDS = 60  # longest wait between retries while the queue store is unreachable
+
+# CSV cells are strings; BirthData wants numbers
+_INT_FIELDS = ("year", "month", "day")
+_FLOAT_FIELDS = ("hour", "minute", "second", "latitude", "longitude", "tz_offset")
+
+class JobQueue:
+    """Job records and their chunk queue; see RedisJobQueue and SQLiteJobQueue."""
+    def create_job(self, job_id: str, options: Dict, user_id: Optional[int]): ...
+    def push_chunk(self, job_id: str, rows: List[Tuple[int, Dict]]): ...
+    def add_errors(self, job_id: str, errors: List[Dict]): ...
+    def finish_upload(self, job_id: str, total_rows: int): ...
+    def pop_chunk(self, consumer: str, timeout: float = 1.0) -> Optional[Tuple[str, List[Tuple[int, Dict]]]]:
+        """The chunk `consumer` holds, else the next one, held for it until ack_chunk()."""
+    def ack_chunk(self, consumer: str): ...
+    def heartbeat(self, consumer: str, ttl: float = CONSUMER_TTL): ...
+    def requeue_orphans(self) -> int:
+        """Put chunks held by consumers whose heartbeat expired back on the queue; returns how many."""
+    def record_chunk(self, job_id: str, succeeded: int, errors: List[Dict]): ...
+    def get_job(self, job_id: str) -> Optional[Dict]: ...
+
+def job_status(job: Dict) -> Dict:
+    """Public view of a job record, with status and throughput derived from its counters."""
+    processed = job["succeeded"] + job["failed"]
+    uploaded = job["total_rows"] is not None
+    if uploaded and processed >= job["total_rows"]:
+        status = "completed"
+    elif job["succeeded"] or job["failed"] or uploaded:
+        status = "running"
+    else:
+        status = "uploading"
+    end = job["finished_at"] if status == "completed" and job["finished_at"] else time.time()
+    elapsed = max(end - job["created_at"], 1e-9)
+    return {
+        "job_id": job["job_id"],
+        "status": status,
+        "user_id": job["user_id"],
+        "total_rows": job["total_rows"],
+        "processed": processed,
+        "succeeded": job["succeeded"],
+        "failed": job["failed"],
+        "rows_per_second": round(processed / elapsed, 2),
+        "created_at": job["created_at"],
+        "errors": job["errors"],
+    }
+
+class RedisJobQueue(JobQueue):
+    """
+    Jobs as hashes and chunks on one list, shared by every app instance using the same Redis.
+    A consumer BLMOVEs a chunk into its own processing list (Redis 6.2+).
+    """
+    QUEUE_KEY = "import:queue"
+    PROCESSING_PREFIX = "import:processing:"
+    CONSUMER_PREFIX = "import:consumer:"
+    JOB_TTL = 7 * 24 * 3600
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    def _job_key(self, job_id: str) -> str:
+        return f"import:job:{job_id}"
+
+    def create_job(self, job_id: str, options: Dict, user_id: Optional[int]):
+        key = self._job_key(job_id)
+        pipeline = self.client.pipeline()
+        pipeline.hset(key, mapping={"options": json.dumps(options), "user_id": json.dumps(user_id),
+                                    "created_at": time.time(), "succeeded": 0, "failed": 0})
+        pipeline.expire(key, self.JOB_TTL)
+        pipeline.execute()
+
+    def push_chunk(self, job_id: str, rows: List[Tuple[int, Dict]]):
+        self.client.lpush(self.QUEUE_KEY, json.dumps({"job_id": job_id, "rows": rows}))
+
+    def add_errors(self, job_id: str, errors: List[Dict]):
+        if not errors:
+            return
+        key = self._job_key(job_id)
+        pipeline = self.client.pipeline()
+        pipeline.hincrby(key, "failed", len(errors))
+        pipeline.rpush(f"{key}:errors", *(json.dumps(error) for error in errors))
+        pipeline.ltrim(f"{key}:errors", 0, MAX_JOB_ERRORS - 1)
+        pipeline.expire(f"{key}:errors", self.JOB_TTL)
+        pipeline.execute()
+        self._maybe_finish(job_id)
+
+    def finish_upload(self, job_id: str, total_rows: int):
+        self.client.hset(self._job_key(job_id), "total_rows", total_rows)
+        self._maybe_finish(job_id)
+
+    def pop_chunk(self, consumer: str, timeout: float = 1.0) -> Optional[Tuple[str, List[Tuple[int, Dict]]]]:
+        processing = self.PROCESSING_PREFIX + consumer
+        payload = self.client.lindex(processing, -1)
+        if payload is None:
+            payload = self.client.blmove(self.QUEUE_KEY, processing, timeout, "RIGHT", "LEFT")
+            if payload is None:
+                return None
+        chunk = json.loads(payload)
+        return chunk["job_id"], [tuple(row) for row in chunk["rows"]]
+
+    def ack_chunk(self, consumer: str):
+        self.client.delete(self.PROCESSING_PREFIX + consumer)
+
+    def heartbeat(self, consumer: str, ttl: float = CONSUMER_TTL):
+        self.client.set(self.CONSUMER_PREFIX + consumer, 1, ex=int(ttl))
+
+    def requeue_orphans(self) -> int:
+        requeued = 0
+        for key in self.client.scan_iter(match=self.PROCESSING_PREFIX + "*"):
+            consumer = (key.decode() if isinstance(key, bytes) else key)[len(self.PROCESSING_PREFIX):]
+            if self.client.exists(self.CONSUMER_PREFIX + consumer):
+                continue
+            # One LMOVE per chunk: consumers starting together never requeue a chunk twice.
+            # The right end is where chunks are popped, so orphans go first.
+            while self.client.lmove(key, self.QUEUE_KEY, "RIGHT", "RIGHT") is not None:
+                requeued += 1
+        return requeued
+
+    def record_chunk(self, job_id: str, succeeded: int, errors: List[Dict]):
+        self.client.hincrby(self._job_key(job_id), "succeeded", succeeded)
+        self.add_errors(job_id, errors)
+        self._maybe_finish(job_id)
+
+    def _maybe_finish(self, job_id: str):
+        key = self._job_key(job_id)
+        succeeded, failed, total = self.client.hmget(key, "succeeded", "failed", "total_rows")
+        if total is not None and int(succeeded) + int(failed) >= int(total):
+            self.client.hsetnx(key, "finished_at", time.time())
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        key = self._job_key(job_id)
+        fields = self.client.hgetall(key)
+        if not fields:
+            return None
+        fields = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                  for k, v in fields.items()}
+        if "options" not in fields:
+            return None  # counters recreated by a chunk recorded after the job expired
+        errors = [json.loads(error) for error in self.client.lrange(f"{key}:errors", 0, -1)]
+        return {
+            "job_id": job_id,
+            "options": json.loads(fields["options"]),
+            "user_id": json.loads(fields["user_id"]),
+            "created_at": float(fields["created_at"]),
+            "finished_at": float(fields["finished_at"]) if "finished_at" in fields else None,
+            "total_rows": int(fields["total_rows"]) if "total_rows" in fields else None,
+            "succeeded": int(fields["succeeded"]),
+            "failed": int(fields["failed"]),
+            "errors": errors,
+        }
+
+class SQLiteJobQueue(JobQueue):
+    """The same queue in one SQLite file (or ":memory:"), for single-host runs and tests."""
+    def __init__(self, path: str = ":memory:"):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS import_jobs (
+                    job_id TEXT PRIMARY KEY, options TEXT NOT NULL, user_id TEXT NOT NULL,
+                    created_at REAL NOT NULL, finished_at REAL, total_rows INTEGER,
+                    succeeded INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS import_errors (
+                    job_id TEXT NOT NULL, error TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS import_chunks (
+                    chunk_id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, rows TEXT NOT NULL,
+                    consumer TEXT);
+                CREATE TABLE IF NOT EXISTS import_consumers (
+                    consumer TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+            """)
+            try:
+                self._connection.execute("ALTER TABLE import_chunks ADD COLUMN consumer TEXT")
+            except sqlite3.OperationalError:
+                pass  # created with the column
+
+    def _execute(self, sql: str, parameters: Tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def create_job(self, job_id: str, options: Dict, user_id: Optional[int]):
+        self._execute("INSERT INTO import_jobs (job_id, options, user_id, created_at) VALUES (?, ?, ?, ?)",
+                      (job_id, json.dumps(options), json.dumps(user_id), time.time()))
+
+    def push_chunk(self, job_id: str, rows: List[Tuple[int, Dict]]):
+        self._execute("INSERT INTO import_chunks (job_id, rows) VALUES (?, ?)", (job_id, json.dumps(rows)))
+
+    def add_errors(self, job_id: str, errors: List[Dict]):
+        if not errors:
+            return
+        with self._lock:
+            kept = self._connection.execute("SELECT COUNT(*) FROM import_errors WHERE job_id = ?", (job_id,)).fetchone()[0]
+            self._connection.executemany("INSERT INTO import_errors (job_id, error) VALUES (?, ?)",
+                                         [(job_id, json.dumps(error)) for error in errors[:max(MAX_JOB_ERRORS - kept, 0)]])
+            self._connection.execute("UPDATE import_jobs SET failed = failed + ? WHERE job_id = ?", (len(errors), job_id))
+        self._maybe_finish(job_id)
+
+    def finish_upload(self, job_id: str, total_rows: int):
+        self._execute("UPDATE import_jobs SET total_rows = ? WHERE job_id = ?", (total_rows, job_id))
+        self._maybe_finish(job_id)
+
+    def pop_chunk(self, consumer: str, timeout: float = 1.0) -> Optional[Tuple[str, List[Tuple[int, Dict]]]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                row = self._connection.execute("SELECT job_id, rows FROM import_chunks WHERE consumer = ?",
+                                               (consumer,)).fetchone()
+                if row is None:
+                    row = self._connection.execute(
+                        "UPDATE import_chunks SET consumer = ? WHERE chunk_id = "
+                        "(SELECT MIN(chunk_id) FROM import_chunks WHERE consumer IS NULL) "
+                        "RETURNING job_id, rows", (consumer,)).fetchone()
+            if row is not None:
+                return row[0], [tuple(item) for item in json.loads(row[1])]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    def ack_chunk(self, consumer: str):
+        self._execute("DELETE FROM import_chunks WHERE consumer = ?", (consumer,))
+
+    def heartbeat(self, consumer: str, ttl: float = CONSUMER_TTL):
+        self._execute("INSERT OR REPLACE INTO import_consumers (consumer, expires_at) VALUES (?, ?)",
+                      (consumer, time.time() + ttl))
+
+    def requeue_orphans(self) -> int:
+        return self._execute("UPDATE import_chunks SET consumer = NULL WHERE consumer IS NOT NULL AND consumer NOT IN "
+                             "(SELECT consumer FROM import_consumers WHERE expires_at > ?)", (time.time(),)).rowcount
+
+    def record_chunk(self, job_id: str, succeeded: int, errors: List[Dict]):
+        self._execute("UPDATE import_jobs SET succeeded = succeeded + ? WHERE job_id = ?", (succeeded, job_id))
+        self.add_errors(job_id, errors)
+        self._maybe_finish(job_id)
+
+    def _maybe_finish(self, job_id: str):
+        self._execute("UPDATE import_jobs SET finished_at = ? WHERE job_id = ? AND finished_at IS NULL "
+                      "AND total_rows IS NOT NULL AND succeeded + failed >= total_rows", (time.time(), job_id))
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self._execute("SELECT options, user_id, created_at, finished_at, total_rows, succeeded, failed "
+                            "FROM import_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        errors = self._execute("SELECT error FROM import_errors WHERE job_id = ? ORDER BY rowid", (job_id,)).fetchall()
+        return {
+            "job_id": job_id,
+            "options": json.loads(row[0]),
+            "user_id": json.loads(row[1]),
+            "created_at": row[2],
+            "finished_at": row[3],
+            "total_rows": row[4],
+            "succeeded": row[5],
+            "failed": row[6],
+            "errors": [json.loads(error) for (error,) in errors],
+        }
+
+_queue: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    """The process-wide import queue selected by IMPORT_QUEUE_URL."""
+    global _queue
+    if _queue is None:
+        if IMPORT_QUEUE_URL.startswith("sqlite:///"):
+            _queue = SQLiteJobQueue(IMPORT_QUEUE_URL[len("sqlite:///"):])
+        elif IMPORT_QUEUE_URL == "redis":
+            _queue = RedisJobQueue(redis.Redis(
+                host=os.getenv("REDIS_HOST", "localhost"),
+                port=int(os.getenv("REDIS_PORT", "6379")),
+                db=int(os.getenv("REDIS_DB", "0")),
+                password=os.getenv("REDIS_PASSWORD", None),
+                ssl=os.getenv("REDIS_SSL", "false").lower() == "true",
+            ))
+        else:
+            raise ValueError(f"Invalid IMPORT_QUEUE_URL: {IMPORT_QUEUE_URL}. Use 'redis' or 'sqlite:///path'")
+    return _queue
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+def new_consumer_id() -> str:
+    """Unique per consumer task, and tells which host and process it ran in."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _coerce_csv_row(row: Dict[str, str]) -> Dict[str, Any]:
+    item = {}
+    for name, value in row.items():
+        if name is None or value is None or value.strip() == "":
+            continue
+        name = name.strip()
+        value = value.strip()
+        if name in _INT_FIELDS:
+            item[name] = int(value)
+        elif name in _FLOAT_FIELDS:
+            item[name] = float(value)
+        else:
+            item[name] = value
+    return item
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decoded lines of a byte stream, without holding more than one partial line."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+async def stream_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """(row number, item, parse error) for every record in an uploaded NDJSON or CSV stream."""
+    header = None
+    number = 0
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        if fmt == "csv" and header is None:
+            header = [name.strip() for name in next(csv.reader([line]))]
+            continue
+        number += 1
+        try:
+            if fmt == "csv":
+                item = _coerce_csv_row(dict(zip(header, next(csv.reader([line])))))
+            else:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("Each line must be a JSON object")
+            yield number, item, None
+        except ValueError as e:
+            yield number, None, f"Unparseable row: {str(e)}"
+
+async def enqueue_upload(queue: JobQueue, job_id: str, chunks: AsyncIterator[bytes], fmt: str,
+                         chunk_rows: int = JOB_CHUNK_ROWS) -> int:
+    """
+    Parse an upload as it arrives and queue its rows in chunks; returns the number of rows.
+
+    Unparseable rows are recorded as errors straight away. If the upload breaks off, the rows
+    received so far still form the job.
+    """
+    rows: List[Tuple[int, Dict]] = []
+    errors: List[Dict] = []
+    total = 0
+    try:
+        async for number, item, error in stream_rows(chunks, fmt):
+            total = number
+            if error is not None:
+                errors.append({"row": number, "status_code": 400, "detail": error})
+            else:
+                rows.append((number, item))
+            if len(rows) >= chunk_rows:
+                await asyncio.to_thread(queue.push_chunk, job_id, rows)
+                rows = []
+            if len(errors) >= chunk_rows:
+                await asyncio.to_thread(queue.add_errors, job_id, errors)
+                errors = []
+    finally:
+        if rows:
+            await asyncio.to_thread(queue.push_chunk, job_id, rows)
+        await asyncio.to_thread(queue.add_errors, job_id, errors)
+        await asyncio.to_thread(queue.finish_upload, job_id, total)
+    return total
+
+def save_job_charts(charts: List[Tuple[dict, dict]], user_id: Optional[int]) -> List[int]:
+    """Commit one chunk's charts in a session of its own."""
+    from db import SessionLocal, save_charts  # imported lazily: the database is only needed to save
+    db = SessionLocal()
+    try:
+        return save_charts(charts, user_id, db)
+    finally:
+        db.close()
+
+async def process_chunk(queue: JobQueue, pool, job_id: str, rows: List[Tuple[int, Dict]],
+                        save: Callable = save_job_charts):
+    """Compute one chunk in the worker pool, commit its charts and record the outcome."""
+    from services.chart import build_charts, stored_result
+    job = await asyncio.to_thread(queue.get_job, job_id)
+    if job is None:
+        # Expired (after JOB_TTL in Redis) or deleted: no options to compute with, nobody to report to
+        logger.warning("Import job %s no longer exists, dropping a chunk of %d rows", job_id, len(rows))
+        return
+    options = job["options"]
+    transit_date = datetime.fromisoformat(options["transit_date"]) if options["transit_date"] else None
+    while True:
+        try:
+            outcomes = await pool.run(build_charts, [item for _, item in rows], transit_date,
+                                      options["ayanamsa_type"], options["dasha_level"], options["include"])
+            break
+        except HTTPException as e:
+            if e.status_code != 503:
+                outcomes = [{"error": {"status_code": e.status_code, "detail": e.detail}}] * len(rows)
+                break
+            # The pool is full with interactive requests; they go first
+            await asyncio.sleep(RETRY_AFTER_SECONDS)
+
+    errors = [{"row": number, **outcome["error"]} for (number, _), outcome in zip(rows, outcomes) if "error" in outcome]
+    charts = [outcome["chart"] for outcome in outcomes if "chart" in outcome]
+    try:
+        await asyncio.to_thread(save, [(chart["birth_data"], stored_result(chart)) for chart in charts], job["user_id"])
+        succeeded = len(charts)
+    except HTTPException as e:
+        errors += [{"row": number, "status_code": e.status_code, "detail": e.detail}
+                   for (number, _), outcome in zip(rows, outcomes) if "chart" in outcome]
+        errors.sort(key=lambda error: error["row"])
+        succeeded = 0
+    await asyncio.to_thread(queue.record_chunk, job_id, succeeded, errors)
+
+async def _heartbeat(queue: JobQueue, consumer: str):
+    """Keep `consumer` alive in the queue store; a failed beat is retried on the next one."""
+    while True:
+        try:
+            await asyncio.to_thread(queue.heartbeat, consumer, CONSUMER_TTL)
+        except Exception:
+            pass  # the consumer loop reports an unreachable store
+        await asyncio.sleep(CONSUMER_TTL / 3)
+
+async def run_consumer(queue: JobQueue, pool, save: Callable = save_job_charts, timeout: float = 1.0):
+    """
+    Process queued chunks until cancelled; run one per pool worker to keep the pool busy.
+
+    On its first pass a consumer requeues the chunks of dead consumers (requeue_orphans). While
+    the queue store is unreachable it retries with exponential backoff, up to MAX_BACKOFF_SECONDS.
+    """
+    consumer = new_consumer_id()
+    heartbeat = asyncio.create_task(_heartbeat(queue, consumer))
+    recovered = False
+    failures = 0
+    try:
+        while True:
+            try:
+                if not recovered:
+                    requeued = await asyncio.to_thread(queue.requeue_orphans)
+                    if requeued:
+                        logger.warning("Requeued %d import chunks of stopped consumers", requeued)
+                    recovered = True
+                chunk = await asyncio.to_thread(queue.pop_chunk, consumer, timeout)
+                if chunk is not None:
+                    await process_chunk(queue, pool, *chunk, save=save)
+                    await asyncio.to_thread(queue.ack_chunk, consumer)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(2 ** min(failures - 1, 16), MAX_BACKOFF_SECONDS)
+                logger.warning("Import consumer error, retrying in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+    finally:
+        heartbeat.cancel()
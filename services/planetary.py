@@ -1,107 +1,136 @@
 from compatibility import swe
-from typing import Dict, Optional
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 from datetime import datetime, timezone, timedelta
+import functools
+import threading
+import time
+import numpy as np
 from models import BirthData
-from constants import ZODIAC_SIGNS, NAKSHATRAS, NAKSHATRA_SPAN, NAKSHATRA_PADA_SPAN
-from utils import decimal_to_dms, get_ayanamsa_value
+from constants import ZODIAC_SIGNS, NAKSHATRAS, NAKSHATRA_SPAN, NAKSHATRA_PADA_SPAN, AYANAMSA_TYPES
+from utils import decimal_to_dms, datetime_to_jd
+from services.ephemeris_cache import tropical_positions, ayanamsa_values, ayanamsa_value
 
 swe.set_ephe_path('./ephe')
 
+# Swiss Ephemeris body ids; Ketu is derived from Rahu (true node)
+PLANET_BODIES = [(0, "Sun"), (1, "Moon"), (2, "Mercury"), (3, "Venus"), (4, "Mars"),
+                 (5, "Jupiter"), (6, "Saturn"), (10, "Rahu")]
+BATCH_BODIES = [name for _, name in PLANET_BODIES] + ["Ketu"]
+
+def _tropical_positions(jds: np.ndarray) -> Sequence[np.ndarray]:
+    """Tropical longitude and daily speed of every body in PLANET_BODIES, shape (len(jds), 8) each."""
+    return tropical_positions([pid for pid, _ in PLANET_BODIES], jds)
+
+def sidereal_derivations(sid_longitudes: np.ndarray) -> Dict[str, np.ndarray]:
+    """Sign index (0 = Aries), nakshatra index (0 = Ashwini) and pada (1-4) of sidereal longitudes, elementwise."""
+    sid_longitudes = np.asarray(sid_longitudes, dtype=np.float64)
+    nakshatra_index = np.minimum((sid_longitudes / NAKSHATRA_SPAN).astype(np.int64), 26)
+    return {
+        "sign_index": np.minimum((sid_longitudes / 30).astype(np.int64), 11),
+        "nakshatra_index": nakshatra_index,
+        "pada": np.minimum(((sid_longitudes % NAKSHATRA_SPAN) / NAKSHATRA_PADA_SPAN).astype(np.int64), 3) + 1
+    }
+
+def house_numbers(sign_index: np.ndarray, lagna_sign_index: np.ndarray) -> np.ndarray:
+    """Whole-sign house (1-12) of each sign index counted from the Lagna sign; broadcasts."""
+    return (np.asarray(sign_index) - np.asarray(lagna_sign_index) + 12) % 12 + 1
+
+@functools.lru_cache(maxsize=1024)
+def tropical_bodies(jd: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Tropical longitudes and speeds of PLANET_BODIES at one instant (read-only); shared by every place."""
+    trop_longitudes, speeds = _tropical_positions(np.array([jd], dtype=np.float64))
+    trop_longitudes, speeds = trop_longitudes[0], speeds[0]
+    trop_longitudes.flags.writeable = False
+    speeds.flags.writeable = False
+    return trop_longitudes, speeds
+
+@functools.lru_cache(maxsize=1024)
+def tropical_houses(jd: float, latitude: float, longitude: float) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    """Placidus cusps and angles (ascmc) for one instant and place."""
+    cusps, ascmc = swe.houses(jd, latitude, longitude, b'P')
+    return tuple(cusps), tuple(ascmc)
+
+def tropical_chart(jd: float, latitude: float, longitude: float) -> Tuple[Tuple[float, ...], Tuple[float, ...], np.ndarray, np.ndarray]:
+    """
+    Tropical house cusps, angles and body positions for one instant and place.
+
+    Nothing here depends on the ayanamsa, so every ayanamsa of a request is derived from
+    the same result. Bodies are cached per JD and houses per (JD, place).
+
+    Returns:
+        Tuple of (cusps, ascmc, longitudes, speeds); the arrays hold PLANET_BODIES in order
+        and are read-only.
+    """
+    return (*tropical_houses(jd, latitude, longitude), *tropical_bodies(jd))
+
+def _sidereal_positions(trop_longitudes: np.ndarray, speeds: np.ndarray, ayanamsas: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Sidereal positions of BATCH_BODIES, shape (len(ayanamsas), 9) per array.
+
+    Row i subtracts ayanamsas[i] from row i of the tropical arrays (shape (n, 8), or (8,)
+    to derive several ayanamsas from one instant).
+    """
+    trop_longitudes = np.broadcast_to(trop_longitudes, (ayanamsas.size, len(PLANET_BODIES)))
+    speeds = np.broadcast_to(speeds, (ayanamsas.size, len(PLANET_BODIES)))
+    sid_longitudes = np.empty((ayanamsas.size, len(BATCH_BODIES)), dtype=np.float64)
+    sid_longitudes[:, :-1] = (trop_longitudes - ayanamsas[:, None]) % 360
+    sid_longitudes[:, -1] = (sid_longitudes[:, -2] + 180) % 360  # Ketu (180° opposite Rahu)
+    speeds = np.concatenate([speeds, speeds[:, -1:]], axis=1)
+    positions = {"longitude": sid_longitudes, "speed": speeds}
+    positions.update(sidereal_derivations(sid_longitudes))
+    return positions
+
+def calculate_positions_batch(jd_array: np.ndarray, ayanamsa_type: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Sidereal positions of the nine grahas at many instants at once.
+
+    Longitudes come from the precomputed Chebyshev cache where it covers the instants
+    (Swiss Ephemeris otherwise), and everything derived from them (signs, nakshatras,
+    padas) is computed on whole arrays; no per-planet dicts or DMS strings are built.
+
+    Args:
+        jd_array (np.ndarray): UT Julian Days, shape (n_times,).
+        ayanamsa_type (Optional[str]): Type of ayanamsa to use (defaults to True Chitrapaksha).
+
+    Returns:
+        Dict: `longitude` and `speed` (float64) plus `sign_index`, `nakshatra_index` and
+              `pada` (int64), each of shape (n_times, n_bodies) with columns in BATCH_BODIES
+              order, and the per-instant `ayanamsa` of shape (n_times,).
+    """
+    jds = np.atleast_1d(np.asarray(jd_array, dtype=np.float64))
+    try:
+        ayanamsas = ayanamsa_values(jds, ayanamsa_type)
+        positions = _sidereal_positions(*_tropical_positions(jds), ayanamsas)
+    except swe.Error as e:
+        raise ValueError(f"Swiss Ephemeris calculation failed: {str(e)}")
+    positions["ayanamsa"] = ayanamsas
+    positions["bodies"] = BATCH_BODIES
+    return positions
+
 def calculate_planet_positions(data: BirthData, jd: float, ayanamsa: float, ayanamsa_type: Optional[str]) -> Dict:
     """
     Calculate sidereal positions for planets and lagna given a Julian Day and ayanamsa.
     Returns a dictionary with planetary data (longitude, sign, nakshatra, pada).
     """
-    try:
-        cusps, ascmc = swe.houses(jd, data.latitude, data.longitude, b'P')
-        sidereal_cusps = [(c - ayanamsa) % 360 for c in cusps]
-        sidereal_asc = (cusps[0] - ayanamsa) % 360
-        sidereal_mc = (ascmc[1] - ayanamsa) % 360
-        
-        planets = {}
-        planet_list = [(0, "Sun"), (1, "Moon"), (2, "Mercury"), (3, "Venus"), (4, "Mars"),
-                    (5, "Jupiter"), (6, "Saturn"), (10, "Rahu")]  # Ketu computed from Rahu
-
-        # Lagna(Ascendant)
-        lagna_sign_index = int(sidereal_asc / 30)
-        lagna_nakshatra_index = int(sidereal_asc / NAKSHATRA_SPAN)
-        lagna_pada = int((sidereal_asc % NAKSHATRA_SPAN) / NAKSHATRA_PADA_SPAN) + 1
-        planets["Lagna"] = {
-            "longitude": float(sidereal_asc),
-            "longitude_dms": decimal_to_dms(sidereal_asc),
-            "sign": ZODIAC_SIGNS[lagna_sign_index],
-            "house": 1,
-            "degrees_in_sign": float(sidereal_asc % 30),
-            "degrees_in_sign_dms": decimal_to_dms(sidereal_asc % 30),
-            "nakshatra": NAKSHATRAS[lagna_nakshatra_index],
-            "pada": int(lagna_pada),
-            "retrograde": "no"
-        }
+    return calculate_planet_positions_multi(data, jd, [ayanamsa], [ayanamsa_type])[0]
 
-        for pid, name in planet_list:
-            flags = swe.FLG_SWIEPH | swe.FLG_SPEED
-            if pid == 10:  # True node for Rahu
-                flags |= swe.FLG_TRUEPOS
-            
-            calc_result = swe.calc_ut(jd, pid, flags)
-            trop_longitude = calc_result[0][0]
-            longitude_speed = calc_result[0][3]
-
-            is_retrograde = "yes" if longitude_speed < 0 else "no"
-
-            sid_longitude = (trop_longitude - ayanamsa) % 360
-            sign_index = int(sid_longitude / 30)
-            house_number = (sign_index - lagna_sign_index + 12) % 12 + 1
-            nakshatra_deg = sid_longitude % 360
-            nakshatra_index = int(nakshatra_deg / NAKSHATRA_SPAN)
-            nakshatra_name = NAKSHATRAS[nakshatra_index]
-            pada = int((nakshatra_deg % NAKSHATRA_SPAN) / NAKSHATRA_PADA_SPAN) + 1
-
-            planets[name] = {
-                "longitude": float(sid_longitude),
-                "longitude_dms": decimal_to_dms(sid_longitude),
-                "sign": ZODIAC_SIGNS[sign_index],
-                "house": house_number,
-                "degrees_in_sign": float(sid_longitude % 30),
-                "degrees_in_sign_dms": decimal_to_dms(sid_longitude % 30),
-                "nakshatra": nakshatra_name,
-                "pada": int(pada),
-                "retrograde": is_retrograde
-            }
-
-        # Compute Ketu (180° opposite Rahu)
-        ketu_long = (planets["Rahu"]["longitude"] + 180) % 360
-        ketu_sign_index = int(ketu_long / 30)
-        ketu_house_number = (ketu_sign_index - lagna_sign_index + 12) % 12 + 1
-        ketu_nakshatra_index = int(ketu_long / NAKSHATRA_SPAN)
-        ketu_pada = int((ketu_long % NAKSHATRA_SPAN) / NAKSHATRA_PADA_SPAN) + 1
-        planets["Ketu"] = {
-            "longitude": float(ketu_long),
-            "longitude_dms": decimal_to_dms(ketu_long),
-            "sign": ZODIAC_SIGNS[ketu_sign_index],
-            "house": ketu_house_number,
-            "degrees_in_sign": float(ketu_long % 30),
-            "degrees_in_sign_dms": decimal_to_dms(ketu_long % 30),
-            "nakshatra": NAKSHATRAS[ketu_nakshatra_index],
-            "pada": int(ketu_pada),
-            "retrograde": "yes"
-        }
+def calculate_planet_positions_multi(data: BirthData, jd: float, ayanamsas: Sequence[float],
+                                     ayanamsa_types: Sequence[Optional[str]]) -> List[Dict]:
+    """
+    Sidereal charts for several ayanamsas at one instant.
 
-        # Update Lagna with retrograde field (always "no")
-        planets["Lagna"]["retrograde"] = "no"
-
-        return {
-                "ayanamsa": float(ayanamsa),
-                "ayanamsa_type": ayanamsa_type if ayanamsa_type else "true_chitra",
-                "ascendant": {
-                    "longitude": float(sidereal_asc),
-                    "longitude_dms": decimal_to_dms(sidereal_asc),
-                    "sign": ZODIAC_SIGNS[int(sidereal_asc / 30)]
-                },
-                "midheaven": float(sidereal_mc),
-                "midheaven_dms": decimal_to_dms(sidereal_mc),
-                "planets": planets
-            }
+    The tropical houses and positions are computed (or fetched from cache) once; each
+    ayanamsa only adds a vectorized subtraction and the sign/nakshatra re-derivation.
+    Returns one chart per ayanamsa, in the same format as `calculate_planet_positions`.
+    """
+    try:
+        cusps, ascmc, trop_longitudes, speeds = tropical_chart(jd, data.latitude, data.longitude)
+        ayanamsas = np.asarray(ayanamsas, dtype=np.float64)
+        positions = _sidereal_positions(trop_longitudes, speeds, ayanamsas)
+        return [
+            _sidereal_chart(cusps, ascmc, positions, row, float(ayanamsa), ayanamsa_type)
+            for row, (ayanamsa, ayanamsa_type) in enumerate(zip(ayanamsas.tolist(), ayanamsa_types))
+        ]
     except swe.Error as e:
         raise ValueError(f"Swiss Ephemeris calculation failed: {str(e)}")
     except IndexError as e:
@@ -109,40 +138,168 @@ def calculate_planet_positions(data: BirthData, jd: float, ayanamsa: float, ayan
     except Exception as e:
         raise ValueError(f"Unexpected error in position calculation: {str(e)}")
 
+def _sidereal_chart(cusps: Sequence[float], ascmc: Sequence[float], positions: Dict[str, np.ndarray], row: int,
+                    ayanamsa: float, ayanamsa_type: Optional[str]) -> Dict:
+    """Chart dictionary for one row of `_sidereal_positions` output."""
+    sidereal_cusps = [(c - ayanamsa) % 360 for c in cusps]
+    sidereal_asc = (cusps[0] - ayanamsa) % 360
+    sidereal_mc = (ascmc[1] - ayanamsa) % 360
+
+    planets = {}
+
+    # Lagna(Ascendant)
+    lagna_sign_index = int(sidereal_asc / 30)
+    lagna_nakshatra_index = int(sidereal_asc / NAKSHATRA_SPAN)
+    lagna_pada = int((sidereal_asc % NAKSHATRA_SPAN) / NAKSHATRA_PADA_SPAN) + 1
+    planets["Lagna"] = {
+        "longitude": float(sidereal_asc),
+        "longitude_dms": decimal_to_dms(sidereal_asc),
+        "sign": ZODIAC_SIGNS[lagna_sign_index],
+        "house": 1,
+        "degrees_in_sign": float(sidereal_asc % 30),
+        "degrees_in_sign_dms": decimal_to_dms(sidereal_asc % 30),
+        "nakshatra": NAKSHATRAS[lagna_nakshatra_index],
+        "pada": int(lagna_pada),
+        "retrograde": "no"
+    }
+
+    houses = house_numbers(positions["sign_index"][row], lagna_sign_index)
+    for column, name in enumerate(BATCH_BODIES):
+        sid_longitude = float(positions["longitude"][row, column])
+        planets[name] = {
+            "longitude": sid_longitude,
+            "longitude_dms": decimal_to_dms(sid_longitude),
+            "sign": ZODIAC_SIGNS[positions["sign_index"][row, column]],
+            "house": int(houses[column]),
+            "degrees_in_sign": float(sid_longitude % 30),
+            "degrees_in_sign_dms": decimal_to_dms(sid_longitude % 30),
+            "nakshatra": NAKSHATRAS[positions["nakshatra_index"][row, column]],
+            "pada": int(positions["pada"][row, column]),
+            # Ketu is always reported retrograde
+            "retrograde": "yes" if name == "Ketu" or positions["speed"][row, column] < 0 else "no"
+        }
+
+    return {
+        "ayanamsa": float(ayanamsa),
+        "ayanamsa_type": ayanamsa_type if ayanamsa_type else "true_chitra",
+        "ascendant": {
+            "longitude": float(sidereal_asc),
+            "longitude_dms": decimal_to_dms(sidereal_asc),
+            "sign": ZODIAC_SIGNS[int(sidereal_asc / 30)]
+        },
+        "midheaven": float(sidereal_mc),
+        "midheaven_dms": decimal_to_dms(sidereal_mc),
+        "planets": planets
+    }
+
 def calculate_kundali(data: BirthData, tz_offset: float, ayanamsa_type: Optional[str]) -> Dict:
     """Calculate the birth chart (Kundali) with planetary positions."""
+    return calculate_kundalis(data, tz_offset, [ayanamsa_type])[0]
+
+def calculate_kundalis(data: BirthData, tz_offset: float, ayanamsa_types: Sequence[Optional[str]]) -> List[Dict]:
+    """Calculate the birth chart (Kundali) once per ayanamsa, sharing the tropical calculation."""
     try:
         # Convert birth time to Julian Day
         jd = swe.julday(data.year, data.month, data.day, 
                        data.hour + data.minute / 60.0 + data.second / 3600.0)
         
-        # Get ayanamsa value
-        ayanamsa = get_ayanamsa_value(jd, ayanamsa_type)
+        # Get ayanamsa values
+        ayanamsas = [ayanamsa_value(jd, ayanamsa_type) for ayanamsa_type in ayanamsa_types]
         
         # Calculate planetary positions
-        kundali = calculate_planet_positions(data, jd, ayanamsa, ayanamsa_type)
+        kundalis = calculate_planet_positions_multi(data, jd, ayanamsas, ayanamsa_types)
         
         # Add timezone offset to result
-        kundali["tz_offset"] = tz_offset
+        for kundali in kundalis:
+            kundali["tz_offset"] = tz_offset
         
-        return kundali
+        return kundalis
     except Exception as e:
         raise ValueError(f"Kundali calculation failed: {str(e)}")
 
+# "Now" transits are taken at the start of the current minute, so all requests share one snapshot
+TRANSIT_QUANTUM_SECONDS = 60
+
+class TransitSnapshot(NamedTuple):
+    """Tropical bodies and every supported ayanamsa at one transit instant."""
+    jd: float
+    longitudes: np.ndarray
+    speeds: np.ndarray
+    ayanamsas: Dict[str, float]
+
+    def ayanamsa(self, ayanamsa_type: Optional[str]) -> float:
+        value = self.ayanamsas.get((ayanamsa_type or "true_chitra").lower())
+        return value if value is not None else ayanamsa_value(self.jd, ayanamsa_type)
+
+def transit_instant(now: Optional[datetime] = None) -> datetime:
+    """The current transit instant: naive UTC, floored to TRANSIT_QUANTUM_SECONDS."""
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is not None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    epoch = datetime(1970, 1, 1)
+    seconds = (now - epoch) // timedelta(seconds=1)
+    return epoch + timedelta(seconds=seconds - seconds % TRANSIT_QUANTUM_SECONDS)
+
+@functools.lru_cache(maxsize=8)
+def transit_snapshot(jd: float) -> TransitSnapshot:
+    """Positions and ayanamsas at a transit instant; computed once per instant and process."""
+    trop_longitudes, speeds = tropical_bodies(jd)
+    return TransitSnapshot(jd, trop_longitudes, speeds,
+                           {name: ayanamsa_value(jd, name) for name in AYANAMSA_TYPES})
+
+class TransitTicker:
+    """Background thread that builds the snapshot of each transit instant before requests need it."""
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def warm(self, now: Optional[datetime] = None):
+        instant = transit_instant(now)
+        for moment in (instant, instant + timedelta(seconds=TRANSIT_QUANTUM_SECONDS)):
+            transit_snapshot(datetime_to_jd(moment))
+
+    def _run(self):
+        while True:
+            try:
+                self.warm()
+            except Exception as e:
+                print(f"Transit snapshot failed: {str(e)}")
+            # Wake half way through each quantum, well before the next instant is needed
+            quantum = TRANSIT_QUANTUM_SECONDS
+            delay = (quantum / 2 - time.time() % quantum) % quantum or quantum
+            if self._stop.wait(delay):
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="transit-ticker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+transit_ticker = TransitTicker()
+
 def calculate_transits(data: BirthData, tz_offset: float, date_time: Optional[datetime] = None, ayanamsa_type: Optional[str] = None) -> Dict:
-    """Calculate transit positions for a given date/time."""
+    """
+    Calculate transit positions for a given date/time.
+
+    Without a date_time the shared snapshot of the current minute is used, so only the
+    houses of the birth place are computed per request.
+    """
     try:
         if date_time is None:
-            date_time = datetime.now(timezone.utc)
+            date_time = transit_instant()
+            jd = datetime_to_jd(date_time)
+            ayanamsa = transit_snapshot(jd).ayanamsa(ayanamsa_type)
         else:
             # Convert transit_date to UTC if it's not
             date_time = date_time - timedelta(hours=tz_offset)
-        # Convert transit time to Julian Day
-        jd = swe.julday(date_time.year, date_time.month, date_time.day,
-                       date_time.hour + date_time.minute / 60.0 + date_time.second / 3600.0)
-        
-        # Get ayanamsa value
-        ayanamsa = get_ayanamsa_value(jd, ayanamsa_type)
+            # Convert transit time to Julian Day
+            jd = swe.julday(date_time.year, date_time.month, date_time.day,
+                           date_time.hour + date_time.minute / 60.0 + date_time.second / 3600.0)
+            # Get ayanamsa value
+            ayanamsa = ayanamsa_value(jd, ayanamsa_type)
         
         # Calculate planetary positions
         transits = calculate_planet_positions(data, jd, ayanamsa, ayanamsa_type)
@@ -0,0 +1,78 @@
+"""
+Single-flight coalescing of identical concurrent computations.
+
+Within a process, the first caller for a key starts the computation and later callers await
+the same task. Across processes and hosts, a short Redis lease (SET NX PX) elects one
+computing worker. The others wait until the lease is released or expires and then compute
+too, by which time the natal parts are in the shared chart cache. A herd of identical
+requests therefore costs one full calculation.
+
+Without Redis (or when it fails) coalescing is per process only.
+"""
+import asyncio
+import hashlib
+import json
+import secrets
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+LEASE_PREFIX = "chart:lease:"
+LEASE_MS = 30000
+LEASE_POLL_SECONDS = 0.05
+
+# Delete the lease only if it is still ours; it may have expired and been taken over
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def flight_key(*parts: Any) -> str:
+    """Stable hash of JSON-serializable inputs (datetimes are taken as ISO strings)."""
+    canonical = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; concurrent callers share its result."""
+    def __init__(self, redis_client=None, lease_ms: int = LEASE_MS):
+        self.redis = redis_client
+        self.lease_ms = lease_ms
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        The result of compute() for `key`, shared with every concurrent caller of the same key.
+
+        The result object is shared too: copy it before modifying it. Exceptions reach every caller.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_leased(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A caller that disconnects must not cancel the computation the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _run_leased(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        if self.redis is None:
+            return await compute()
+        lease = LEASE_PREFIX + key
+        token = secrets.token_hex(8)
+        try:
+            acquired = await self.redis.set(lease, token, nx=True, px=self.lease_ms)
+            if not acquired:
+                # Another worker is computing; wait for it, then compute from the warm cache
+                deadline = asyncio.get_running_loop().time() + self.lease_ms / 1000
+                while await self.redis.exists(lease) and asyncio.get_running_loop().time() < deadline:
+                    await asyncio.sleep(LEASE_POLL_SECONDS)
+        except Exception:
+            # Without Redis, coalesce within this process only
+            return await compute()
+        try:
+            return await compute()
+        finally:
+            if acquired:
+                try:
+                    await self.redis.eval(_RELEASE_SCRIPT, 1, lease, token)
+                except Exception:
+                    pass  # the lease expires on its own
@@ -0,0 +1,92 @@
+"""
+Worker pool for CPU-bound chart calculations.
+
+Swiss Ephemeris, the dasha tree and bala hold the GIL for the whole request, so running
+them on the event loop thread stalls every other connection. Jobs are sent to a pool of
+worker processes (or threads, with CHART_WORKER_MODE=thread) instead. At most
+CHART_QUEUE_SIZE jobs may be running or waiting at once; beyond that, requests are
+rejected with 503 and a Retry-After header rather than queued without bound.
+
+Configuration (environment):
+    CHART_WORKERS      number of workers (default: CPU count)
+    CHART_WORKER_MODE  "process" (default) or "thread"
+    CHART_QUEUE_SIZE   running plus waiting jobs allowed (default: 4 per worker)
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from fastapi import HTTPException
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "0")) or os.cpu_count() or 1
+CHART_WORKER_MODE = os.getenv("CHART_WORKER_MODE", "process").lower()
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", "0")) or 4 * CHART_WORKERS
+RETRY_AFTER_SECONDS = 1
+
+class ChartJobError(Exception):
+    """An HTTPException raised inside a worker, in a form that survives pickling."""
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _init_worker():
+    # Map the Chebyshev ephemeris once per worker process instead of on its first job,
+    # and keep this worker's transit snapshot ahead of the clock
+    from services.ephemeris_cache import get_ephemeris_cache
+    from services.planetary import transit_ticker
+    get_ephemeris_cache()
+    transit_ticker.start()
+
+def _run_job(fn: Callable, *args) -> Any:
+    try:
+        return fn(*args)
+    except HTTPException as e:
+        raise ChartJobError(e.status_code, e.detail) from None
+
+class ChartWorkerPool:
+    """Bounded executor for chart jobs, awaited from the event loop."""
+    def __init__(self, workers: int = CHART_WORKERS, mode: str = CHART_WORKER_MODE,
+                 queue_size: int = CHART_QUEUE_SIZE):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Invalid CHART_WORKER_MODE: {mode}. Must be 'process' or 'thread'")
+        self.workers = workers
+        self.mode = mode
+        self.queue_size = max(queue_size, workers)
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                # spawn: forking a process that already runs the event loop and its threads is unsafe
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="chart")
+        return self._executor
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        Run fn(*args) in the pool and return its result.
+
+        `fn` and its arguments must be picklable in process mode. HTTPExceptions raised by
+        `fn` are re-raised unchanged; a full queue raises HTTPException 503.
+        """
+        if self.pending >= self.queue_size:
+            raise HTTPException(status_code=503, detail="Chart service busy. Please try again later.",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, _run_job, fn, *args)
+        except ChartJobError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
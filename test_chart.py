@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import time
+from typing import Dict
+import cbor2
+import msgpack
+import pytest
+import redis
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from models import BirthData
+from services.chart import generate_chart, build_charts, calculate_natal_chart, parse_include, resolve_components, VARGA_NAMES
+from services.chart import stored_result, materialize_chart
+from services.encoding import chart_response, columnar_dasha, expand_dasha, negotiate
+from services.chart_cache import ChartCache, MemoryLRU, TieredCache, cache_key
+from utils import sanitize_birth_data
+from chart_hash import chart_input_hash, CHART_ALGORITHM_VERSION
+from datetime import datetime, timezone
+
+NATAL_KEYS = ("kundali", "vimshottari_dasha", "vargas", "sthana_bala", "dig_bala", "ayanamsas")
+
+def test_chart_cache_key_is_canonical():
+    """The same UTC instant and options hash alike however they were entered; any change gives a new key."""
+    ist = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    utc = BirthData(year=1990, month=5, day=15, hour=1, minute=30, second=0, latitude=13.0827, longitude=80.2707)
+    utc_data = sanitize_birth_data(ist, 5.5)["utc"]
+    key = cache_key("kundali", utc_data, 5.5, None)
+    assert key == cache_key("kundali", sanitize_birth_data(utc, 0.0)["utc"], 5.5, "true_chitra")
+    assert key != cache_key("kundali", utc_data, 5.5, "lahiri")
+    assert key != cache_key("kundali", utc_data, 0.0, None)  # tz_offset is echoed in the kundali
+    assert key != cache_key("D-9", utc_data, 5.5, None)
+    assert cache_key("dasha", utc_data, 5.5, None, dasha_level=2) != cache_key("dasha", utc_data, 5.5, None, dasha_level=3)
+
+def test_saved_chart_hash_is_the_cache_digest_without_version(monkeypatch):
+    """A saved chart's input_hash is the digest its cache key is built on; only the key carries the version."""
+    import services.chart_cache
+    birth_data = dict(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707,
+                      tz_offset=5.5, ayanamsa_type=None, dasha_level=3, include=None)
+    utc_data = sanitize_birth_data(BirthData(**birth_data), 5.5)["utc"]
+    options = dict(ayanamsa_types=["true_chitra"], dasha_level=3, include=None)
+    key = cache_key("chart", utc_data, 5.5, None, **options)
+    assert key == f"chart:chart:v{CHART_ALGORITHM_VERSION}:{chart_input_hash(birth_data)}"
+    monkeypatch.setattr(services.chart_cache, "CHART_ALGORITHM_VERSION", CHART_ALGORITHM_VERSION + 1)
+    assert cache_key("chart", utc_data, 5.5, None, **options).endswith(chart_input_hash(birth_data)) and \
+        cache_key("chart", utc_data, 5.5, None, **options) != key
+
+def test_memory_lru_is_bounded_by_bytes():
+    """The in-process tier evicts least recently used entries once their total size exceeds the bound."""
+    lru = MemoryLRU(max_bytes=100)
+    for key in "abcde":
+        lru.put(key, key.upper(), 20)
+    assert lru.get("a") == "A"
+    lru.put("f", "F", 20)
+    assert lru.get("b") is None and lru.get("a") == "A" and lru.get("f") == "F"
+    lru.put("huge", "H", 30)  # over a quarter of the tier
+    assert lru.get("huge") is None and lru.bytes == 100 and lru.evictions == 1
+
+def test_tiered_cache_serves_repeat_charts_in_process():
+    """A repeat natal calculation is answered from L1; an unreachable Redis tier is a miss, never an error."""
+    cache = TieredCache(MemoryLRU(), ChartCache(redis.Redis(port=1, socket_connect_timeout=0.1)))
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    utc_data = sanitize_birth_data(data, 5.5)["utc"]
+
+    import services.chart_cache
+    previous, services.chart_cache._cache = services.chart_cache._cache, cache
+    try:
+        first = calculate_natal_chart(utc_data, 5.5, ["lahiri", "raman"], 2)
+        assert cache.counts["l1_hits"] == 0 and cache.counts["l2_hits"] == 0
+        misses = cache.counts["l1_misses"]
+        again = calculate_natal_chart(utc_data, 5.5, ["lahiri", "raman"], 2)
+        assert cache.counts["l1_hits"] == misses and cache.counts["l1_misses"] == misses
+        assert again["kundali"] is first["kundali"] and again == first
+        # Another dasha depth reuses the kundalis, vargas and bala
+        calculate_natal_chart(utc_data, 5.5, ["raman"], 3)
+        assert cache.counts["l1_misses"] == misses + 1
+    finally:
+        services.chart_cache._cache = previous
+
+    chart = generate_chart(data, 5.5, None, ["lahiri", "raman"], None, 2)
+    assert set(first) == set(NATAL_KEYS)
+    assert all(chart[name] == first[name] for name in NATAL_KEYS)
+
+def test_workers_publish_cache_stats_snapshots(monkeypatch):
+    """Each process flushes its counters with a snapshot of its stats; /cache/stats reads them without the pool."""
+    import json
+    import time
+    import services.chart_cache
+    from services.chart_cache import worker_cache_stats, WORKER_STATS_MAX_AGE
+
+    class RecordingTier:
+        flushed = []
+        def get_many(self, keys):
+            return {}
+        def add_stats(self, counts, snapshot):
+            self.flushed.append((dict(counts), snapshot))
+
+    monkeypatch.setattr(services.chart_cache, "STATS_FLUSH_SECONDS", 0)
+    cache = TieredCache(MemoryLRU(), RecordingTier())
+    cache.get_many(["a", "b"])
+    (counts, snapshot), = RecordingTier.flushed
+    assert counts["l2_misses"] == 2 and snapshot["l2_misses"] == 2 and "l1_bytes" in snapshot
+
+    now = time.time()
+    workers, stale = worker_cache_stats({"web-1:10": json.dumps({**snapshot, "flushed_at": now}),
+                                         "web-1:9": json.dumps({**snapshot, "flushed_at": now - WORKER_STATS_MAX_AGE - 1})})
+    assert list(workers) == ["web-1:10"] and workers["web-1:10"]["l2_misses"] == 2 and stale == ["web-1:9"]
+
+def test_include_computes_requested_components_only():
+    """include= returns just the requested components and computes only them and their prerequisites."""
+    data = BirthData(year=1984, month=2, day=29, hour=21, minute=15, second=0, latitude=28.6139, longitude=77.2090)
+    full = generate_chart(data, 5.5, None, ["lahiri", "raman"], None, 3)
+
+    partial = generate_chart(data, 5.5, None, ["lahiri", "raman"], None, 3, include="kundali,D-9,dasha:1")
+    assert list(partial) == ["kundali", "vimshottari_dasha", "vargas", "birth_data", "ayanamsas"]
+    assert partial["kundali"] == full["kundali"] and partial["vargas"] == {"D-9": full["vargas"]["D-9"]}
+    assert partial["birth_data"]["dasha_level"] == 1 and partial["birth_data"]["include"] == ["kundali", "dasha", "D-9"]
+    assert all("pratyantardashas" not in antardasha for mahadasha in partial["vimshottari_dasha"]
+               for antardasha in mahadasha["antardashas"])
+    assert partial["ayanamsas"]["raman"] == {"kundali": full["ayanamsas"]["raman"]["kundali"],
+                                             "vargas": {"D-9": full["ayanamsas"]["raman"]["vargas"]["D-9"]}}
+
+    bala = generate_chart(data, 5.5, None, "lahiri", None, 3, include=["sthana_bala"])
+    assert list(bala) == ["sthana_bala", "birth_data"] and bala["sthana_bala"] == full["sthana_bala"]
+    assert resolve_components(["sthana_bala"]) == {"sthana_bala", "kundali", *VARGA_NAMES}
+    assert resolve_components(["dig_bala"]) == {"dig_bala", "kundali"}
+    assert parse_include("vargas,transits") == (("transits", *VARGA_NAMES), None)
+    with pytest.raises(HTTPException):
+        parse_include("kundali,D-60")
+
+def test_build_charts_reports_errors_per_item():
+    """A batch job returns one outcome per item, in order; invalid items do not fail the others."""
+    good = dict(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    outcomes = build_charts([dict(good, tz_offset=5.5), dict(good, month=13), dict(good, latitude=13.0827)],
+                            None, "lahiri", 1, ["kundali"])
+    assert [list(outcome) for outcome in outcomes] == [["chart"], ["error"], ["chart"]]
+    assert outcomes[1]["error"]["status_code"] == 422
+    assert outcomes[0]["chart"]["birth_data"]["tz_offset"] == 5.5 and list(outcomes[0]["chart"]) == ["kundali", "birth_data"]
+    assert outcomes[0]["chart"]["kundali"] == generate_chart(BirthData(**good), 5.5, None, "lahiri", None, 1)["kundali"]
+
+    unknown = build_charts([good], None, "sidereal", 1, None)
+    assert unknown[0]["error"]["status_code"] == 400
+
+def test_inputs_storage_rematerializes_saved_charts(monkeypatch):
+    """In "inputs" storage mode a saved row is a few hundred bytes and recomputes to the same chart, transits included."""
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    chart = generate_chart(data, 5.5, None, ["lahiri", "raman"], None, 3)
+    assert stored_result(chart) is chart  # "full" mode by default
+
+    monkeypatch.setattr("services.chart.CHART_STORAGE_MODE", "inputs")
+    stored = stored_result(chart)
+    assert stored["storage"] == "inputs" and stored["transit_date"] == chart["transits"]["transit_date"]
+    assert stored["positions"]["Moon"] == round(chart["kundali"]["planets"]["Moon"]["longitude"], 6)
+    assert len(json.dumps(stored)) * 100 < len(json.dumps(chart))
+    assert materialize_chart(chart["birth_data"], stored) == chart
+
+    # Requested sections only, whether recomputed or cut from a full row
+    partial = materialize_chart(chart["birth_data"], stored, ["kundali", "D-9"])
+    assert partial == materialize_chart(chart["birth_data"], chart, ["kundali", "D-9"])
+    assert list(partial) == ["kundali", "vargas", "birth_data", "ayanamsas"] and list(partial["vargas"]) == ["D-9"]
+    assert partial["ayanamsas"]["raman"]["vargas"] == {"D-9": chart["ayanamsas"]["raman"]["vargas"]["D-9"]}
+
+def _validated_response(content: Dict) -> bytes:
+    # What FastAPI sends for an endpoint declared with response_model=Dict that returns a dict
+    field = create_response_field(name="Response_chart", type_=Dict)
+    return JSONResponse(asyncio.run(serialize_response(field=field, response_content=content))).body
+
+def test_fast_chart_response_matches_validated_response():
+    """The orjson response of a new or stored chart decodes to the same JSON as the validated response."""
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    chart = generate_chart(data, 5.5, None, ["lahiri", "raman"], None, 3)
+    stored = {"chart_id": 1, "user_id": None, "birth_data": chart["birth_data"], "result": chart,
+              "created_at": datetime(2025, 4, 6, 12, 30, 15, 250000, tzinfo=timezone.utc).isoformat()}  # as get_chart
+    for content in (chart, stored):
+        assert json.loads(ORJSONResponse(content).body) == json.loads(_validated_response(content))
+
+def test_binary_chart_responses_are_negotiated_and_columnar():
+    """Accept selects MessagePack or CBOR; the dasha tree travels as columns and expands back unchanged."""
+    assert negotiate(None) is None and negotiate("*/*") is None and negotiate("application/json") is None
+    assert negotiate("application/msgpack") == "application/msgpack"
+    assert negotiate("application/json;q=0.5, application/cbor") == "application/cbor"
+    assert negotiate("application/msgpack;q=0.5, application/json") is None
+    assert negotiate("application/json, application/x-msgpack") is None
+
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    chart = generate_chart(data, 5.5, None, "lahiri", None, 3)
+    stored = {"chart_id": 1, "user_id": 7, "birth_data": chart["birth_data"], "result": chart}
+
+    response = chart_response(stored, "application/msgpack")
+    assert response.media_type == "application/msgpack" and response.headers["vary"] == "Accept"
+    decoded = msgpack.unpackb(response.body)
+    columns = decoded["result"].pop("vimshottari_dasha")
+    assert columns["encoding"] == "columnar" and columns["fanout"] == 9
+    assert [len(level["lords"]) for level in columns["levels"]] == [9, 81, 729, 6561]
+    assert expand_dasha(columns) == chart["vimshottari_dasha"]
+    assert decoded["result"] == {key: value for key, value in chart.items() if key != "vimshottari_dasha"}
+    assert len(response.body) * 10 < len(chart_response(stored, "*/*").body)
+
+    assert expand_dasha(cbor2.loads(chart_response(chart, "application/cbor").body)["vimshottari_dasha"]) == chart["vimshottari_dasha"]
+
+    # Computed for a binary response, the dasha comes columnar from the arrays and is saved as the tree
+    computed = generate_chart(data, 5.5, None, "lahiri", None, 3, dasha_columns=True)
+    assert computed["vimshottari_dasha"]["levels"][-1]["boundaries"] == columns["levels"][-1]["boundaries"]
+    assert expand_dasha(computed["vimshottari_dasha"]) == chart["vimshottari_dasha"]
+    assert stored_result(computed)["vimshottari_dasha"] == chart["vimshottari_dasha"]
+    assert msgpack.unpackb(chart_response(computed, "application/msgpack").body)["vimshottari_dasha"] == computed["vimshottari_dasha"]
+    shallow = generate_chart(data, 5.5, None, "lahiri", None, 0, dasha_columns=True)["vimshottari_dasha"]
+    assert shallow["fanout"] == 0 and expand_dasha(shallow) == generate_chart(data, 5.5, None, "lahiri", None, 0)["vimshottari_dasha"]
+    assert columnar_dasha([{"planet": "Sun", "start_date": "2000-01-01", "end_date": "2000-02-01"},
+                           {"planet": "Moon", "start_date": "2000-03-01", "end_date": "2000-04-01"}]) is None
+
+def benchmark_serialization():
+    """Serialization time per dasha level: response_model=Dict with JSONResponse, then ORJSONResponse"""
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    print("\n===== SERIALIZATION BENCHMARK =====")
+    print(f"{'level':>5} {'bytes':>10} {'validated':>12} {'orjson':>10} {'speedup':>8}")
+    for level in range(6):
+        chart = generate_chart(data, 5.5, None, "lahiri", None, level)
+        runs = max(2, 200 // 4 ** level)
+        start_time = time.perf_counter()
+        for _ in range(runs):
+            _validated_response(chart)
+        validated = (time.perf_counter() - start_time) / runs
+        start_time = time.perf_counter()
+        for _ in range(runs):
+            body = ORJSONResponse(chart).body
+        fast = (time.perf_counter() - start_time) / runs
+        print(f"{level:>5} {len(body):>10} {validated * 1000:>10.2f}ms {fast * 1000:>8.2f}ms {validated / fast:>7.1f}x")
+
+def benchmark_binary_encoding():
+    """Payload size and client decode time per dasha level: JSON, then columnar MessagePack and CBOR"""
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    print("\n===== BINARY ENCODING BENCHMARK =====")
+    print(f"{'level':>5} {'json':>10} {'msgpack':>10} {'cbor':>10} {'json decode':>12} {'msgpack':>10} {'cbor':>10}")
+    for level in range(6):
+        chart = generate_chart(data, 5.5, None, "lahiri", None, level)
+        bodies = [chart_response(chart, accept).body for accept in ("application/json", "application/msgpack", "application/cbor")]
+        timings = []
+        for decode, body in zip((json.loads, msgpack.unpackb, cbor2.loads), bodies):
+            runs = max(2, 200 // 4 ** level)
+            start_time = time.perf_counter()
+            for _ in range(runs):
+                decode(body)
+            timings.append((time.perf_counter() - start_time) / runs)
+        sizes = "".join(f"{len(body):>11}" for body in bodies)
+        print(f"{level:>5}{sizes} {timings[0] * 1000:>10.2f}ms {timings[1] * 1000:>8.2f}ms {timings[2] * 1000:>8.2f}ms")
+
+if __name__ == "__main__":
+    benchmark_serialization()
+    benchmark_binary_encoding()
@@ -4,7 +4,9 @@
 import time
 from datetime import datetime
 from models import BirthData
-from services.dasha import calculate_vimshottari_dasha
+from utils import datetime_to_jd
+from services.dasha import calculate_vimshottari_dasha, calculate_dasha_window, calculate_current_dasha_batch, VimshottariDasha, dasha_template
+from services.dasha import YoginiDasha, AshtottariDasha, CharaDasha, chara_dasha_years
 
 def test_dasha_calculation(max_level=2):
     """
@@ -120,6 +122,141 @@ def benchmark_caching():
         speedup = first_run_time / second_run_time if second_run_time > 0 else float('inf')
         print(f"\nCache speedup: {speedup:.2f}x faster")
     
+def test_lazy_dasha_queries():
+    """The query-driven engine agrees with the materialized tree and only expands what it needs."""
+    birth = datetime(1990, 5, 15)
+    dasha = VimshottariDasha.from_moon_longitude(birth, 85.5)
+    mahadashas = dasha.mahadashas()
+    assert len(mahadashas) == 9
+    assert mahadashas[0].planet == "Jupiter"  # 85.5° is in Punarvasu, ruled by Jupiter
+    assert mahadashas[0].start_jd < mahadashas[0].end_jd
+
+    # Deha-level lookup walks one branch and every period on the path contains the instant
+    when = datetime(2026, 10, 15, 6, 0)
+    path = dasha.active_at(when)
+    assert len(path) == 6
+    for parent, child in zip(path, path[1:]):
+        assert parent.start_jd <= child.start_jd < child.end_jd <= parent.end_jd + 1e-9
+        assert child.parent is parent
+    assert path[0].start <= when < path[-1].end
+
+    # Lookups agree with the legacy nested structure
+    tree = dasha.to_tree(2)
+    md = next(p for p in tree if p["planet"] == path[0].planet)
+    ad = next(p for p in md["antardashas"] if p["planet"] == path[1].planet)
+    assert ad["start_date"] == path[1].to_dict()["start_date"]
+
+    # Window queries return contiguous periods at the requested level only
+    window = list(dasha.periods_between(datetime(2026, 1, 1), datetime(2027, 1, 1), level=3))
+    assert window and all(p.level == 3 for p in window)
+    for a, b in zip(window, window[1:]):
+        assert abs(a.end_jd - b.start_jd) < 1e-6
+    assert dasha.active_at(datetime(1700, 1, 1)) == []
+
+def test_dasha_templates_are_shared():
+    """Charts with the same starting lord reuse one template, shifted to their own cycle start."""
+    boundaries, lords = dasha_template(6, 2)
+    assert boundaries.shape == (9 ** 3 + 1,) and lords.shape == (9 ** 3,)
+    assert boundaries[0] == 0.0 and boundaries[-1] == 1.0
+    assert (boundaries[1:] > boundaries[:-1]).all()
+    assert dasha_template(6, 2)[0] is boundaries
+
+    first = VimshottariDasha.from_moon_longitude(datetime(1990, 5, 15), 85.5)
+    second = VimshottariDasha.from_moon_longitude(datetime(2001, 2, 3), 82.0)
+    assert first.starting_lord_index == second.starting_lord_index
+    shift = second.cycle_start_jd - first.cycle_start_jd
+    assert abs((second.boundaries(2) - first.boundaries(2) - shift).max()) < 1e-6
+
+    # The template tree matches the lazily expanded one
+    assert first.to_tree(2) == [first.subtree(p, 2) for p in first.mahadashas()]
+
+def test_array_backed_timeline():
+    """Binary-search lookups on the compact timeline agree with the lazy engine."""
+    dasha = VimshottariDasha.from_moon_longitude(datetime(1990, 5, 15), 85.5)
+    timeline = dasha.timeline(5)
+    assert timeline.nbytes < 10 * 1024 * 1024  # a full Deha timeline stays a few MB
+
+    when = datetime(2026, 10, 15, 6, 0)
+    assert timeline.active_at(when) == [p.to_dict() for p in dasha.active_at(when)]
+    lords = timeline.active_lords([datetime_to_jd(when), 0.0])
+    assert lords[0].tolist() == [p.lord_index for p in dasha.active_at(when)]
+    assert (lords[1] == 255).all()
+
+    window = (datetime(2026, 1, 1), datetime(2027, 1, 1))
+    assert timeline.rows(3, *window) == [p.to_dict() for p in dasha.periods_between(*window, level=3)]
+
+def test_dasha_window():
+    """Windowed queries return only overlapping periods, with their lineage."""
+    birth_data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    rows = calculate_dasha_window(birth_data, {"longitude": 85.5}, datetime(2026, 10, 1), datetime(2026, 10, 20), level=4)
+    assert rows and all(row["level"] == "prana_dasha" and len(row["lineage"]) == 5 for row in rows)
+    assert rows[0]["start_date"] <= "2026-10-01" and rows[-1]["end_date"] >= "2026-10-19"
+
+    try:
+        calculate_dasha_window(birth_data, {"longitude": 85.5}, datetime(1900, 1, 1), datetime(2100, 1, 1), level=5)
+        assert False, "oversized window should be rejected"
+    except ValueError:
+        pass
+
+def test_table_driven_systems():
+    """Yogini and Ashtottari run on the shared engine and agree across lazy, timeline and batch lookups."""
+    birth = datetime(1990, 5, 15)
+    when = datetime(2026, 10, 15, 6, 0)
+
+    yogini = YoginiDasha.from_moon_longitude(birth, 85.5)
+    assert yogini.mahadashas()[0].planet == "Pingala"  # Punarvasu is the 7th nakshatra: (7 + 3) mod 8 = 2
+    # The 36-year cycle repeats four times so the timeline covers a lifetime
+    assert len(yogini.mahadashas()) == 32
+    assert abs(yogini.cycle_end_jd - yogini.cycle_start_jd - 4 * 36 * 365.25) < 1e-6
+    assert yogini.mahadashas()[0].to_dict()["yogini"] == "Pingala"
+
+    ashtottari = AshtottariDasha.from_moon_longitude(birth, 85.5)
+    assert ashtottari.mahadashas()[0].planet == "Sun"  # Ardra to Ashlesha belong to the Sun
+    # Punarvasu is the second nakshatra of the Sun's run of four, so over a quarter of its 6 years has elapsed
+    assert ashtottari.cycle_start_jd < datetime_to_jd(birth) - 6 * 365.2422 / 4
+
+    for dasha in (yogini, ashtottari):
+        path = dasha.active_at(when, level=3)
+        timeline = dasha.timeline(3)
+        assert timeline.active_at(when) == [p.to_dict() for p in path]
+        window = (datetime(2026, 1, 1), datetime(2027, 1, 1))
+        assert timeline.rows(2, *window) == [p.to_dict() for p in dasha.periods_between(*window, level=2)]
+        assert dasha.to_tree(1) == [dasha.subtree(p, 1) for p in dasha.mahadashas()]
+
+        lords = calculate_current_dasha_batch([85.5], [datetime_to_jd(birth)], datetime_to_jd(when),
+                                              max_level=3, system=dasha.system.name)
+        assert lords[0].tolist() == [p.lord_index for p in path]
+
+def test_chara_dasha():
+    """Chara dasha periods come from the chart's signs and cover 144 years over two cycles."""
+    # Aries Lagna: the 9th (Sagittarius) is savya, so the sequence runs forward
+    planet_signs = {"Sun": 1, "Moon": 3, "Mars": 0, "Mercury": 1, "Jupiter": 8,
+                    "Venus": 2, "Saturn": 9, "Rahu": 10, "Ketu": 4}
+    periods = chara_dasha_years(0, planet_signs)
+    assert periods[0] == (0, 12)  # Mars in Aries
+    assert periods[1] == (1, 1)  # Taurus counts forward to Venus in Gemini
+    assert sum(years for _, years in periods) == 144
+
+    dasha = CharaDasha.from_signs(datetime(1990, 5, 15), 0, planet_signs)
+    assert dasha.mahadashas()[0].to_dict()["sign"] == "Aries"
+    assert [p.planet for p in dasha.children(dasha.mahadashas()[0])][:2] == ["Taurus", "Gemini"]
+    path = dasha.active_at(datetime(2026, 10, 15), level=2)
+    assert len(path) == 3 and dasha.timeline(2).active_at(datetime(2026, 10, 15)) == [p.to_dict() for p in path]
+
+def test_current_dasha_batch():
+    """The vectorized batch agrees with per-chart lookups."""
+    moon_longitudes = [85.5, 0.0, 120.5, 359.9]
+    births = [datetime(1990, 5, 15), datetime(1985, 10, 15), datetime(2001, 1, 1), datetime(1960, 7, 4)]
+    when = datetime(2026, 10, 15)
+    lords = calculate_current_dasha_batch(moon_longitudes, [datetime_to_jd(b) for b in births], datetime_to_jd(when), max_level=3)
+    assert lords.shape == (4, 4)
+    for row, moon, birth in zip(lords.tolist(), moon_longitudes, births):
+        expected = VimshottariDasha.from_moon_longitude(birth, moon).active_at(when, level=3)
+        assert row == [p.lord_index for p in expected]
+
+    # Outside the 120-year cycle
+    assert (calculate_current_dasha_batch([85.5], [datetime_to_jd(births[0])], 0.0) == 255).all()
+
 if __name__ == "__main__":
     # Test with different levels
     for level in range(6):
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from db_pool import TimedQueuePool, pool_stats
+
+def test_pool_records_checkout_waits_and_timeouts(tmp_path):
+    """Every checkout's wait for a connection is measured; exhausted pools count timeouts; dispose keeps the counters."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.2)
+    held = engine.connect()
+
+    def release():
+        time.sleep(0.1)
+        held.close()
+
+    threading.Thread(target=release).start()
+    with engine.connect() as connection:  # waits for the held connection
+        connection.execute(text("select 1"))
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+    stats = pool_stats(engine.pool)
+    assert stats["checkouts"] == 2 and stats["timeouts"] == 1 and stats["checked_out"] == 0
+    assert stats["max_wait_ms"] >= 200 and 20 <= stats["mean_wait_ms"] < 200
+    assert stats["wait_histogram"]["<=500ms"] == 2 and sum(stats["wait_histogram"].values()) == 3
+    engine.dispose()
+    assert pool_stats(engine.pool)["checkouts"] == 2
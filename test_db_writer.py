@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import asyncio
+from db_writer import ChartWriter, split_duplicates
+
+def birth_data(day: int, **fields) -> dict:
+    return dict(year=1990, month=5, day=day, hour=7.0, minute=0.0, second=0.0, latitude=13.0827, longitude=80.2707,
+                tz_offset=5.5, ayanamsa_type=None, dasha_level=3, **fields)
+
+def test_memory_write_behind_batches_and_drains():
+    """Queued charts get ids from sequence blocks, stay readable until written, and are written in
+    batches by size, by time and on close; a failed batch stays queued."""
+    blocks, batches = [], []
+    failing = {"on": False}
+
+    async def allocate_ids(count):
+        start = len(blocks) * count + 1
+        blocks.append(count)
+        return list(range(start, start + count))
+
+    async def insert_rows(rows):
+        if failing["on"]:
+            raise ConnectionRefusedError("database down")
+        batches.append([row["chart_id"] for row in rows])
+
+    async def saved_chart_id(user_id, input_hash, db):
+        return None
+
+    writer = ChartWriter(mode="memory", batch_size=3, interval=0.05, id_block=4,
+                         allocate_ids=allocate_ids, saved_chart_id=saved_chart_id, insert_rows=insert_rows)
+
+    async def run():
+        writer.start()
+        ids = [await writer.save(birth_data(n + 1), {"storage": "inputs"}, 7, db=None) for n in range(3)]
+        pending = await writer.pending(ids[0])
+        await asyncio.sleep(0.01)  # a full batch wakes the flusher
+        assert batches == [ids] and await writer.pending(ids[0]) is None
+        assert pending["birth_data"] == birth_data(1) and pending["user_id"] == 7 and pending["created_at"]
+
+        failing["on"] = True
+        ids.append(await writer.save(birth_data(4), {}, 7, db=None))
+        await asyncio.sleep(0.12)  # the time threshold flushes a partial batch, which fails and stays queued
+        assert len(batches) == 1 and await writer.pending(ids[3]) is not None
+        failing["on"] = False
+        ids.extend([await writer.save(birth_data(n + 1), {}, None, db=None) for n in (4, 5)])
+        await writer.close()  # drain
+        return ids
+
+    ids = asyncio.run(run())
+    assert ids == [1, 2, 3, 4, 5, 6] and blocks == [4, 4]
+    assert [chart_id for batch in batches for chart_id in batch] == ids and len(batches[1]) == 3
+    assert writer.stats() == {"mode": "memory", "queued": 0, "written": 6, "batches": 2, "ids_available": 2}
+
+def test_charts_are_deduplicated_per_user_and_inputs():
+    """A chart the user already queued or saved keeps its chart_id; other users and other inputs get new ones."""
+    saved = {}
+
+    async def allocate_ids(count):
+        return list(range(100, 100 + count))
+
+    async def saved_chart_id(user_id, input_hash, db):
+        return saved.get((user_id, input_hash))
+
+    async def insert_rows(rows):
+        saved.update(((row["user_id"], row["input_hash"]), row["chart_id"]) for row in rows)
+
+    writer = ChartWriter(mode="memory", batch_size=100, interval=60, allocate_ids=allocate_ids,
+                         saved_chart_id=saved_chart_id, insert_rows=insert_rows)
+
+    async def run():
+        first = await writer.save(birth_data(15), {}, 7, db=None)
+        queued_again = await writer.save(birth_data(15, name="again"), {}, 7, db=None)  # extra keys are not inputs
+        await writer.flush()
+        saved_again = await writer.save(birth_data(15), {}, 7, db=None)
+        other_user = await writer.save(birth_data(15), {}, 8, db=None)
+        other_include = await writer.save(birth_data(15, include=["kundali"]), {}, 7, db=None)
+        anonymous = [await writer.save(birth_data(15), {}, None, db=None) for _ in range(2)]
+        return first, queued_again, saved_again, other_user, other_include, anonymous
+
+    first, queued_again, saved_again, other_user, other_include, anonymous = asyncio.run(run())
+    assert first == queued_again == saved_again == 100
+    assert len({first, other_user, other_include, *anonymous}) == 5
+
+class FakeCharts:
+    """The charts table with its (user_id, input_hash) unique index, and chart_aliases."""
+    def __init__(self):
+        self.charts, self.aliases = {}, {}
+
+    def saved(self):
+        return {(row["user_id"], row["input_hash"]): chart_id for chart_id, row in self.charts.items()
+                if row["user_id"] is not None}
+
+    async def saved_chart_id(self, user_id, input_hash, db):
+        return self.saved().get((user_id, input_hash))
+
+    async def insert_rows(self, rows):
+        charts, aliases = split_duplicates(rows, self.saved())
+        self.charts.update((row["chart_id"], row) for row in charts)
+        self.aliases.update((alias["chart_id"], alias["target_id"]) for alias in aliases)
+
+    def get(self, chart_id):
+        return self.charts.get(chart_id) or self.charts.get(self.aliases.get(chart_id))
+
+def test_queued_duplicate_of_a_chart_saved_meanwhile_resolves_through_an_alias():
+    """A queued chart whose inputs were saved by another path before the flush still resolves by its id."""
+    table = FakeCharts()
+
+    async def allocate_ids(count):
+        return list(range(500, 500 + count))
+
+    writer = ChartWriter(mode="memory", batch_size=100, interval=60, allocate_ids=allocate_ids,
+                         saved_chart_id=table.saved_chart_id, insert_rows=table.insert_rows)
+
+    async def run():
+        queued = await writer.save(birth_data(15), {"queued": True}, 7, db=None)
+        # e.g. a batch import or another worker saves the same chart synchronously
+        await table.insert_rows([{"chart_id": 42, "user_id": 7, "birth_data": birth_data(15),
+                                  "result": {"queued": False}, "input_hash": writer._pending[queued]["input_hash"]}])
+        await writer.flush()
+        return queued
+
+    queued = asyncio.run(run())
+    assert queued == 500 and table.aliases == {500: 42} and table.get(queued)["chart_id"] == 42
+    assert list(table.charts) == [42]
+
+def test_concurrent_duplicates_share_one_id_and_no_id_is_lost():
+    """Identical saves racing an id block refill get one chart_id; the block loses no id."""
+    async def allocate_ids(count):
+        await asyncio.sleep(0.01)
+        return list(range(1, 1 + count))
+
+    async def saved_chart_id(user_id, input_hash, db):
+        await asyncio.sleep(0)
+        return None
+
+    async def insert_rows(rows):
+        pass
+
+    writer = ChartWriter(mode="memory", batch_size=100, interval=60, id_block=10, allocate_ids=allocate_ids,
+                         saved_chart_id=saved_chart_id, insert_rows=insert_rows)
+
+    async def run():
+        same = await asyncio.gather(*(writer.save(birth_data(15), {}, 7, db=None) for _ in range(4)))
+        other = await writer.save(birth_data(16), {}, 7, db=None)
+        return same, other
+
+    same, other = asyncio.run(run())
+    assert same == [1, 1, 1, 1] and other == 2 and writer.stats()["ids_available"] == 8
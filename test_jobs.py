@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+from services.jobs import SQLiteJobQueue, enqueue_upload, job_status, process_chunk, stream_rows
+from services.workers import ChartWorkerPool
+
+GOOD = dict(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707, tz_offset=5.5)
+
+async def _stream(body: bytes, size: int):
+    # Uneven network chunks that split lines and multi-byte characters
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+def test_import_job_streams_chunks_and_reports_row_errors():
+    """Rows are queued in chunks as the upload arrives; each row's failure is reported against its number."""
+    lines = [json.dumps(dict(GOOD, day=day, name="Ārya")) for day in range(1, 6)]
+    lines[1] = json.dumps(dict(GOOD, month=13))  # invalid birth data
+    lines[3] = "{not json"
+    body = ("\n".join(lines) + "\n").encode()
+
+    queue = SQLiteJobQueue()
+    pool = ChartWorkerPool(workers=1, mode="thread")
+    saved = []
+
+    def save(charts, user_id):
+        saved.append((len(charts), user_id))
+        return list(range(len(charts)))
+
+    async def run():
+        queue.create_job("job", {"transit_date": None, "ayanamsa_type": ["lahiri"], "dasha_level": 1,
+                                 "include": ["kundali"]}, 7)
+        rows = await enqueue_upload(queue, "job", _stream(body, 7), "ndjson", chunk_rows=2)
+        assert job_status(queue.get_job("job"))["status"] == "running"
+        while (chunk := queue.pop_chunk("consumer", timeout=0)) is not None:
+            await process_chunk(queue, pool, *chunk, save=save)
+            queue.ack_chunk("consumer")
+        return rows
+
+    try:
+        rows = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    status = job_status(queue.get_job("job"))
+    assert rows == 5 and status["status"] == "completed" and status["total_rows"] == 5
+    assert status["succeeded"] == 3 and status["failed"] == 2 and status["processed"] == 5
+    assert sorted((error["row"], error["status_code"]) for error in status["errors"]) == [(2, 422), (4, 400)]
+    assert saved == [(1, 7), (2, 7)] and status["rows_per_second"] > 0
+
+def test_chunks_of_stopped_consumers_are_requeued_and_orphaned_jobs_dropped():
+    """A held chunk is resumed by its consumer or, once its heartbeat expires, requeued for another;
+    a chunk whose job no longer exists is dropped."""
+    queue = SQLiteJobQueue()
+    queue.push_chunk("first", [(1, GOOD)])
+    queue.push_chunk("second", [(2, GOOD)])
+    queue.heartbeat("alive", ttl=60)
+    queue.heartbeat("dead", ttl=-1)
+    assert queue.pop_chunk("dead", timeout=0) == ("first", [(1, GOOD)])
+    assert queue.pop_chunk("dead", timeout=0) == ("first", [(1, GOOD)])  # not acked: the same chunk again
+    assert queue.pop_chunk("alive", timeout=0) == ("second", [(2, GOOD)])
+    assert queue.requeue_orphans() == 1 and queue.pop_chunk("other", timeout=0) == ("first", [(1, GOOD)])
+    queue.ack_chunk("other")
+    queue.ack_chunk("alive")
+    assert queue.pop_chunk("other", timeout=0) is None
+
+    saved = []
+    asyncio.run(process_chunk(queue, None, "missing", [(1, GOOD)], save=lambda charts, user_id: saved.append(charts)))
+    assert saved == [] and queue.get_job("missing") is None
+
+def test_csv_rows_are_typed_for_birth_data():
+    """CSV cells arrive as strings and are converted to the numbers BirthData expects."""
+    body = b"\xef\xbb\xbfyear,month,day,hour,minute,second,latitude,longitude,tz_offset\r\n1990,5,15,7,0,0,13.08,80.27,\r\n\r\n1990,x,15,7,0,0,13.08,80.27,5.5\r\n"
+
+    async def run():
+        return [row async for row in stream_rows(_stream(body, 5), "csv")]
+
+    first, second = asyncio.run(run())
+    assert first == (1, dict(year=1990, month=5, day=15, hour=7.0, minute=0.0, second=0.0, latitude=13.08, longitude=80.27), None)
+    assert second[0] == 2 and second[1] is None and second[2].startswith("Unparseable row")
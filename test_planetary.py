@@ -2,6 +2,15 @@
 
 import swisseph as swe
 from datetime import datetime
+import numpy as np
+from models import BirthData
+from services.planetary import (
+    calculate_positions_batch, calculate_planet_positions, calculate_kundali, calculate_kundalis, calculate_transits,
+    tropical_bodies, transit_instant, transit_snapshot, transit_ticker, BATCH_BODIES, PLANET_BODIES
+)
+from services.ephemeris_cache import build_cache, body_flags, tropical_positions, ayanamsa_values, ChebyshevEphemeris
+from concurrent.futures import ThreadPoolExecutor
+from utils import get_ayanamsa_value, datetime_to_jd
 
 # Set ephemeris path
 swe.set_ephe_path('./ephe')
@@ -32,4 +41,81 @@ print(f"Ayanamsa (True Chitrapaksha): {ayanamsa}")
 cusps, ascmc = swe.houses(jd, 13.0827, 80.2707, b'P')  # Chennai, India
 print(f"Ascendant: {ascmc[0]}")
 print(f"Midheaven: {ascmc[1]}")
-print(f"House cusps: {cusps[:3]}...") 
\ No newline at end of file
+print(f"House cusps: {cusps[:3]}...") 
+
+def test_positions_batch():
+    """The vectorized batch agrees with the per-instant chart calculation."""
+    jds = np.array([2447931.5, 2451545.0, 2461328.75])
+    positions = calculate_positions_batch(jds, "lahiri")
+    assert positions["longitude"].shape == (3, 9) and positions["pada"].shape == (3, 9)
+
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    for i, jd in enumerate(jds):
+        planets = calculate_planet_positions(data, jd, get_ayanamsa_value(jd, "lahiri"), "lahiri")["planets"]
+        for column, name in enumerate(BATCH_BODIES):
+            assert abs(planets[name]["longitude"] - positions["longitude"][i, column]) < 1e-9
+            assert planets[name]["pada"] == positions["pada"][i, column]
+
+def test_chebyshev_ephemeris_cache(tmp_path):
+    """The memory-mapped Chebyshev cache stays sub-arcsecond and falls back to swe outside its range."""
+    start, end = datetime(2026, 1, 1), datetime(2026, 3, 1)
+    cache = ChebyshevEphemeris.load(build_cache(str(tmp_path / "cache.npy"), start, end))
+    assert isinstance(cache.table, np.memmap)
+
+    pids = [pid for pid, _ in PLANET_BODIES]
+    jds = np.array([2461045.3, 2461070.0, 2461100.9, 2470000.0])  # the last one is outside the range
+    longitudes, speeds = tropical_positions(pids, jds, cache)
+    for column, pid in enumerate(pids):
+        for row, jd in enumerate(jds):
+            exact = swe.calc_ut(jd, pid, body_flags(pid))[0]
+            assert abs((longitudes[row, column] - exact[0] + 180) % 360 - 180) * 3600 < 1
+            assert abs(speeds[row, column] - exact[3]) < 1e-3
+
+    # Ayanamsas are cached too, so in-range lookups never touch the global sidereal mode
+    for ayanamsa_type in ("true_chitra", "lahiri", "raman", "krishnamurti"):
+        values = ayanamsa_values(jds, ayanamsa_type, cache)
+        for jd, value in zip(jds, values):
+            assert abs(value - get_ayanamsa_value(jd, ayanamsa_type)) * 3600 < 0.1
+
+def test_ayanamsa_lookups_are_thread_safe():
+    """Concurrent lookups with different ayanamsa types do not see each other's sidereal mode."""
+    jds = np.linspace(2451545.0, 2462000.0, 200)
+    types = ["true_chitra", "lahiri", "raman", "krishnamurti"] * 8
+    expected = {ayanamsa_type: ayanamsa_values(jds, ayanamsa_type) for ayanamsa_type in set(types)}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda ayanamsa_type: ayanamsa_values(jds, ayanamsa_type), types))
+    # swe's True Chitra value depends on its internal star cache by ~0.01"; a mode race would be degrees off
+    for ayanamsa_type, values in zip(types, results):
+        assert np.allclose(values, expected[ayanamsa_type], rtol=0, atol=1e-5)
+
+def test_multiple_ayanamsas_share_tropical_positions():
+    """Several ayanamsas at one instant reuse one tropical calculation and match single-ayanamsa charts."""
+    data = BirthData(year=1984, month=2, day=29, hour=21, minute=15, second=0, latitude=28.6139, longitude=77.2090)
+    types = [None, "lahiri", "raman", "krishnamurti"]
+    misses = tropical_bodies.cache_info().misses
+    kundalis = calculate_kundalis(data, 5.5, types)
+    assert tropical_bodies.cache_info().misses == misses + 1
+
+    for ayanamsa_type, kundali in zip(types, kundalis):
+        single = calculate_kundali(data, 5.5, ayanamsa_type)
+        assert kundali["ayanamsa"] == single["ayanamsa"]
+        assert kundali["planets"] == single["planets"]
+    assert kundalis[1]["planets"]["Sun"]["longitude"] != kundalis[2]["planets"]["Sun"]["longitude"]
+
+def test_transit_snapshot_is_shared_across_places():
+    """Current transits use one snapshot per minute; only the houses depend on the birth place."""
+    chennai = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    london = BirthData(year=1971, month=1, day=2, hour=3, minute=4, second=5, latitude=51.5072, longitude=-0.1276)
+    instant = transit_instant()
+    assert instant.second == 0 and instant.microsecond == 0
+    transit_ticker.warm()
+    snapshot = transit_snapshot(datetime_to_jd(instant))
+
+    misses = tropical_bodies.cache_info().misses
+    first, second = calculate_transits(chennai, 5.5, None, "lahiri"), calculate_transits(london, 0.0, None, "lahiri")
+    if first["transit_date"] == second["transit_date"] == instant.strftime("%Y-%m-%d %H:%M:%S"):
+        assert tropical_bodies.cache_info().misses == misses  # the minute did not roll over
+        assert first["planets"]["Moon"]["longitude"] == second["planets"]["Moon"]["longitude"]
+        assert first["ascendant"] != second["ascendant"]
+        expected = (snapshot.longitudes[1] - snapshot.ayanamsa("lahiri")) % 360
+        assert abs(first["planets"]["Moon"]["longitude"] - expected) < 1e-9
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from models import BirthData
+from services.chart import build_chart, generate_chart
+from services.workers import ChartWorkerPool
+from services.singleflight import SingleFlight, flight_key
+from utils import get_sid_mode
+
+def test_chart_pool_runs_charts_in_worker_processes():
+    """A chart built in a worker process matches the in-process one; HTTPExceptions cross the boundary."""
+    data = BirthData(year=1990, month=5, day=15, hour=7, minute=0, second=0, latitude=13.0827, longitude=80.2707)
+    pool = ChartWorkerPool(workers=2, mode="process")
+
+    async def run():
+        chart = await pool.run(build_chart, data, 5.5, None, "lahiri", 2)
+        with pytest.raises(HTTPException) as error:
+            await pool.run(get_sid_mode, "tropical")
+        return chart, error.value
+
+    try:
+        chart, error = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    expected = generate_chart(data, 5.5, None, "lahiri", None, 2)
+    assert chart["birth_data"] == expected["birth_data"]
+    assert chart["vimshottari_dasha"] == expected["vimshottari_dasha"]
+    assert error.status_code == 400
+    assert pool.pending == 0
+
+def test_chart_pool_rejects_jobs_beyond_the_queue():
+    """Jobs past the queue bound are refused with 503 instead of waiting without limit."""
+    pool = ChartWorkerPool(workers=1, mode="thread", queue_size=2)
+
+    async def run():
+        jobs = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as error:
+            await pool.run(abs, -1)
+        await asyncio.gather(*jobs)
+        return error.value, await pool.run(abs, -1)
+
+    try:
+        error, value = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert error.status_code == 503 and error.headers["Retry-After"] == "1"
+    assert value == 1
+
+class LeaseStore:
+    """Just enough of redis.asyncio for SingleFlight's lease."""
+    def __init__(self):
+        self.values = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def eval(self, script, numkeys, key, token):
+        if self.values.get(key) == token:
+            del self.values[key]
+            return 1
+        return 0
+
+def test_single_flight_coalesces_identical_requests():
+    """Concurrent callers of one key share a computation; a second worker waits on the lease first."""
+    calls = []
+
+    async def compute():
+        calls.append(time.monotonic())
+        await asyncio.sleep(0.1)
+        return {"value": len(calls)}
+
+    async def run():
+        store = LeaseStore()
+        worker_a, worker_b = SingleFlight(store), SingleFlight(store)
+        key = flight_key({"year": 1990}, 5.5, None, ["lahiri"], 3)
+        results = await asyncio.gather(*(worker_a.run(key, compute) for _ in range(50)),
+                                       worker_b.run(key, compute))
+        return results, store.values
+
+    results, leases = asyncio.run(run())
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.1  # worker b computed only after a's lease
+    assert all(result == {"value": 1} for result in results[:50]) and results[50] == {"value": 2}
+    assert leases == {}
+
+    # Without Redis, coalescing is per process
+    calls.clear()
+    async def local():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.run("key", compute) for _ in range(10)))
+    assert asyncio.run(local()) == [{"value": 1}] * 10 and len(calls) == 1
@@ -1,10 +1,11 @@
 # utils.py
 from fastapi import HTTPException
-from compatibility import swe
+from compatibility import swe, SWE_LOCK
 from typing import Optional
 from constants import AYANAMSA_TYPES
 from models import BirthData
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import math
 from timezonefinder import TimezoneFinder
 import pytz
 
@@ -18,15 +19,37 @@ def decimal_to_dms(decimal: float) -> str:
     seconds = int((minutes_decimal - minutes) * 60)
     return f"{degrees}° {minutes}' {seconds}\""
 
-def get_ayanamsa_value(jd: float, ayanamsa_type: Optional[str]) -> float:
+# Julian Day of 0001-01-01 00:00 minus one day, so that JD = ordinal + offset
+JD_ORDINAL_OFFSET = 1721424.5
+
+def datetime_to_jd(value: datetime) -> float:
+    """Convert a naive (UTC) datetime to a Julian Day without calling into swe."""
+    seconds = value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    return value.toordinal() + JD_ORDINAL_OFFSET + seconds / 86400
+
+def jd_to_datetime(jd: float) -> datetime:
+    """Convert a Julian Day back to a naive (UTC) datetime."""
+    return datetime.min + timedelta(days=jd - JD_ORDINAL_OFFSET - 1)
+
+def jd_to_date_string(jd: float) -> str:
+    """Format the calendar date (YYYY-MM-DD) a Julian Day falls on."""
+    return date.fromordinal(int(math.floor(jd - JD_ORDINAL_OFFSET))).isoformat()
+
+def get_sid_mode(ayanamsa_type: Optional[str]) -> int:
+    """Swiss Ephemeris sidereal mode for an ayanamsa type (True Chitrapaksha by default)."""
     if ayanamsa_type is None:
-        swe.set_sid_mode(swe.SIDM_TRUE_CITRA, 0, 0)
-        return swe.get_ayanamsa_ut(jd)
+        return swe.SIDM_TRUE_CITRA
     elif ayanamsa_type.lower() in AYANAMSA_TYPES:
-        swe.set_sid_mode(AYANAMSA_TYPES[ayanamsa_type.lower()], 0, 0)
-        return swe.get_ayanamsa_ut(jd)
+        return AYANAMSA_TYPES[ayanamsa_type.lower()]
     else:
         raise HTTPException(status_code=400, detail=f"Invalid Ayanamsa type: {ayanamsa_type}")
+
+def get_ayanamsa_value(jd: float, ayanamsa_type: Optional[str]) -> float:
+    """Ayanamsa straight from Swiss Ephemeris; serialized because the sidereal mode is global."""
+    sid_mode = get_sid_mode(ayanamsa_type)
+    with SWE_LOCK:
+        swe.set_sid_mode(sid_mode, 0, 0)
+        return swe.get_ayanamsa_ut(jd)
     
 def sanitize_birth_data(data: BirthData, tz_offset: float) -> dict:
     """